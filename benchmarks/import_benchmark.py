@@ -0,0 +1,67 @@
+"""
+Measures the time 'import pyRacetrack' takes in a new interpreter, and checks it does not load the HTTP stack or
+Pillow, which are imported on first use.
+
+    python benchmarks/import_benchmark.py [--runs 20] [--max-ms 150]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Imported by the first call or the first ImagePipeline, never by 'import pyRacetrack'.
+LAZY_MODULES = ("requests", "urllib3", "httplib", "PIL", "multiprocessing")
+
+_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+before = set(sys.modules)
+start = time.time()
+import {module}
+elapsed = time.time() - start
+loaded = [name for name in set(sys.modules) - before if sys.modules[name] is not None]
+print(json.dumps({{"ms": elapsed * 1000, "modules": len(loaded), "loaded": sorted(loaded)}}))
+"""
+
+
+def measure(module, runs):
+    """
+    Returns the import times of 'module', one new interpreter per run, and the modules the last run loaded.
+    """
+    times = []
+    result = None
+    for _ in xrange(runs + 1):
+        output = subprocess.check_output([sys.executable, "-c", _SCRIPT.format(root=ROOT, module=module)])
+        result = json.loads(output)
+        times.append(result["ms"])
+    # The first run compiles the .pyc files.
+    return sorted(times[1:]), result["loaded"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--max-ms", type=float, default=None, help="Exit with 1 when the median is slower.")
+    args = parser.parse_args()
+
+    times, loaded = measure("pyRacetrack", args.runs)
+    median = times[len(times) // 2]
+    eager = [name for name in LAZY_MODULES if name in loaded or any(m.startswith(name + ".") for m in loaded)]
+    print "import pyRacetrack : %8.1f ms median, %8.1f ms min, %d modules" % (median, times[0], len(loaded))
+    try:
+        requests_times, _ = measure("requests", args.runs)
+        print "import requests    : %8.1f ms median" % requests_times[len(requests_times) // 2]
+    except subprocess.CalledProcessError:
+        pass
+    print "loaded eagerly     : %s" % (", ".join(eager) or "none")
+
+    if eager or (args.max_ms is not None and median > args.max_ms):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
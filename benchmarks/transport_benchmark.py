@@ -0,0 +1,60 @@
+"""
+Compares a bare requests.post per call against the pooled keep-alive HTTPTransport, using the local stub server
+standing in for racetrack (pyRacetrack.stub). See pyRacetrack.benchmark for the scenario benchmarks.
+
+    python benchmarks/transport_benchmark.py [--calls 2000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import requests
+
+from pyRacetrack import Racetrack
+from pyRacetrack.stub import StubServer
+
+
+class _BareTransport(object):
+    """
+    The pre-transport behaviour: a new connection for every call.
+    """
+
+    def post(self, uri, data=None, files=None, headers=None, timeout=None):
+        return requests.post(uri, data=data, files=files, headers=headers, timeout=timeout)
+
+    def close(self):
+        pass
+
+
+def run(rt, calls):
+    rt.test_set_begin(buildid=1, product="bench", description="bench", user="bench")
+    rt.test_case_begin("case", "feature")
+    start = time.time()
+    for i in xrange(calls):
+        rt.comment("comment %d" % i)
+    elapsed = time.time() - start
+    rt.test_case_end()
+    rt.test_set_end()
+    return calls / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=2000)
+    args = parser.parse_args()
+
+    with StubServer() as server:
+        bare = run(Racetrack(server=server.url, port=80, transport=_BareTransport()), args.calls)
+        with Racetrack(server=server.url, port=80) as rt:
+            pooled = run(rt, args.calls)
+
+    print "bare requests.post : %10.1f calls/s" % bare
+    print "pooled keep-alive  : %10.1f calls/s" % pooled
+    print "speed-up           : %10.2fx" % (pooled / bare)
+
+
+if __name__ == "__main__":
+    main()
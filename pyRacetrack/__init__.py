@@ -1,3 +1,9 @@
-
-from _base import Racetrack, RESULT
-from _loggers import RacetrackHandler
\ No newline at end of file
+from _base import Racetrack, TestSet, TestCase, RESULT
+from _transport import HTTPTransport, HTTPLibTransport, CircuitBreaker, CircuitOpenError, ConnectError, ServerError, \
+    TransportError
+from _cache import AttachmentCache
+from _metrics import Metrics
+from _imaging import ImagePipeline
+from _loggers import RacetrackHandler, LogBudget
+from _tail import LogTail
+from _mirror import Mirror
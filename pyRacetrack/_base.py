@@ -1,21 +1,32 @@
 __author__ = 'rramchandani'
 
+import Queue
+import functools
+import json
 import os
+import threading
+import time
 import urlparse
-import requests
 from collections import namedtuple
+from xml.etree import ElementTree
 
 import logging
 
+from _transport import HTTPTransport, HTTPLibTransport, CircuitBreaker, CircuitOpenError, ServerError, DEFAULT_TIMEOUT, server_url, \
+    HTTP_CLIENTS
+from _dispatch import Dispatcher
+from _spool import Spool, is_placeholder
+from _multipart import MultipartEncoder, attachment as _attachment, is_path
+from _cache import AttachmentCache
+from _imaging import ImagePipeline
+from _metrics import Metrics, to_json, to_prometheus
+from _overhead import OverheadAccount
+from _recording import Recorder
+from _tail import LogTail
+from _overflow import Overflow
+from _mirror import Mirror
+from sidecar import SidecarTransport
 
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
-
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
-
-import logging
-
-logging.getLogger("requests").setLevel(logging.WARNING)
-logging.getLogger("urllib3").setLevel(logging.WARNING)
 
 Result = namedtuple("Result", "passs fail running config script product rerunpass unsupported")
 Verify = namedtuple("Verify", "true false")
@@ -23,6 +34,19 @@ Verify = namedtuple("Verify", "true false")
 RESULT = Result("PASS", "FAIL", "RUNNING", "CONFIG", "SCRIPT", "PRODUCT", "RERUNPASS", "UNSUPPORTED")
 VERIFY = Verify("TRUE", "FALSE")
 
+# Per-step calls which return nothing the caller needs, these may be sent from the background in asynchronous mode.
+ASYNC_METHODS = ("TestCaseComment.php", "TestCaseWarning.php", "TestCaseVerification.php", "TestCaseScreenshot.php",
+                 "TestCaseLog.php")
+
+# Calls which are dropped rather than failed while the server is down, with on_server_down="drop".
+DROPPABLE_METHODS = ("TestCaseComment.php",)
+
+# Priority lane of the calls queued in asynchronous mode, the others go to the "normal" lane. The calls of a test case
+# keep their order, a test case with a failed verification or a warning queued is sent first; async_policy applies
+# to the comments.
+HIGH_PRIORITY_METHODS = ("TestCaseWarning.php",)
+LOW_PRIORITY_METHODS = ("TestCaseComment.php",)
+
 
 XML_CONTENTS = """
 <Racetrack>
@@ -41,11 +65,52 @@ XML_CONTENTS = """
 </Racetrack>
 """
 
+# Elements of XML_CONTENTS, and the attributes they restore in Racetrack.from_state.
+XML_STATE = (("Racetrack_Address", "server"), ("Racetrack_Port", "port"), ("RACETRACK_SET_ID", "test_set_id"),
+             ("RACETRACK_SET_BUILD_ID", "buildid"), ("RACETRACK_SET_USER", "user"),
+             ("RACETRACK_SET_PRODUCT", "product"), ("RACETRACK_SET_DESCRIPTION", "description"),
+             ("RACETRACK_SET_HOST_OS", "hostos"), ("RACETRACK_CASE_FEATURE", "feature"),
+             ("RACETRACK_CASE_MACHINE_NAME", "machine_name"), ("RACETRACK_CASE_LOCALE", "input_language"),
+             ("RACETRACK_CASE_GOS", "gos"))
+
+# Attributes saved by Racetrack.to_state, besides server and port.
+STATE_ATTRIBUTES = ("test_set_id", "buildid", "user", "product", "description", "hostos", "branch", "testtype",
+                    "language", "buildtype", "feature", "machine_name", "input_language", "gos", "test_case_id",
+                    "test_case_name")
+
+# Environment variable Racetrack.to_env sets and Racetrack.from_state reads by default.
+STATE_ENV = "RACETRACK_STATE"
+
+
+def _xml_value(value):
+    from xml.sax.saxutils import escape
+
+    return escape(value if isinstance(value, basestring) else str(value), {'"': "&quot;"})
+
+
+def _parse_state(text):
+    """
+    Returns the state held by the output of Racetrack.get_as_xml or Racetrack.to_json.
+    """
+    text = text.strip()
+    if not text.startswith("<"):
+        return json.loads(text)
+    attributes = dict(XML_STATE)
+    state = {}
+    for element in ElementTree.fromstring(text):
+        if element.tag in attributes:
+            value = element.get("value")
+            state[attributes[element.tag]] = None if value == "None" else value
+    return state
+
 
 def build_logger(loglevel="INFO"):
     loglevel = getattr(logging, loglevel.upper(), 'INFO')
     _ = logging.getLogger()
     _.setLevel(loglevel)
+    # The connections made by the transport are not worth a line each.
+    logging.getLogger("requests").setLevel(logging.WARNING)
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
 
     ch = logging.StreamHandler()
     ch.setLevel(loglevel)
@@ -97,6 +162,8 @@ def _console_log(function):
                     path_ = args[1]
                 else:
                     path_ = kwargs.get('log') or kwargs.get('screenshot', '')
+                if not is_path(path_):
+                    path_ = "<{0} in memory>".format(type(path_).__name__)
                 logging_function(description + ' [FilePath: {0}]'.format(path_))
 
             elif function.__name__ == 'test_set_begin':
@@ -126,6 +193,175 @@ def _console_log(function):
     return func
 
 
+def _lane(method, parameters):
+    if method in HIGH_PRIORITY_METHODS or parameters.get('Result') == VERIFY.false:
+        return "high"
+    if method in LOW_PRIORITY_METHODS:
+        return "low"
+    return "normal"
+
+
+def _coalesce(queued, call):
+    """
+    Merges two comments queued for the same test case, see Racetrack(async_policy="coalesce").
+    """
+    if queued[0] != "TestCaseComment.php" or call[0] != "TestCaseComment.php":
+        return None
+    parameters = dict(queued[1])
+    parameters['Description'] = parameters['Description'] + "\n" + call[1]['Description']
+    return queued[0], parameters, queued[2]
+
+
+def _overhead(function):
+    """
+    Adds the time spent in a test case call to the overhead of its test case, see Racetrack(account_overhead=True).
+    Calls made from within an accounted call are not accounted again.
+    """
+    @functools.wraps(function)
+    def func(self, *args, **kwargs):
+        if self._overhead is None or getattr(self._local, 'accounting', False):
+            return function(self, *args, **kwargs)
+
+        import inspect
+
+        callargs = inspect.getcallargs(function, self, *args, **kwargs)
+        test_case_id = callargs.get('result_id') or callargs.get('id') or self.test_case_id
+        self._local.accounting = True
+        return_ = None
+        start = time.time()
+        try:
+            return_ = function(self, *args, **kwargs)
+            return return_
+        finally:
+            end = time.time()
+            self._local.accounting = False
+            if function.__name__ in ('test_case_begin', '_test_case_begin'):
+                if return_ is not None:
+                    self._overhead.begin(return_, start, end)
+            elif function.__name__ == 'test_case_end':
+                self._overhead.end(test_case_id, end, end - start)
+            else:
+                self._overhead.add(test_case_id, end - start)
+    return func
+
+
+class _Handle(object):
+    """
+    Compares, hashes and prints like the ID it stands for, so code using the IDs returned by
+    test_set_begin/test_case_begin keeps working.
+    """
+
+    __slots__ = ("racetrack", "id")
+
+    def __init__(self, racetrack, id):
+        self.racetrack = racetrack
+        self.id = id
+
+    def __str__(self):
+        return str(self.id)
+
+    def __int__(self):
+        return int(self.id)
+
+    def __eq__(self, other):
+        return self.id == (other.id if isinstance(other, _Handle) else other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __nonzero__(self):
+        return bool(self.id)
+
+    def __repr__(self):
+        return "<{0} {1}>".format(self.__class__.__name__, self.id)
+
+
+class TestSet(_Handle):
+    """
+    Test set returned by Racetrack.test_set_begin.
+    Test cases begun from it do not change the current test case of the Racetrack object, so several of them can be
+    reported at the same time from different threads.
+    """
+
+    __slots__ = ()
+
+    @property
+    def url(self):
+        return self.racetrack.get_test_set_url(self.id)
+
+    def test_case_begin(self, name, feature, description=None, machine_name=None, tcmsid=None,
+                        input_language="EN", gos=None, start_time=None):
+        return self.racetrack._test_case_begin(name, feature, description, machine_name, tcmsid, input_language,
+                                               gos, start_time, result_set_id=self.id)
+
+    def update(self, **kwargs):
+        self.racetrack.test_set_update(id=self.id, **kwargs)
+
+    def data(self, name, value):
+        return self.racetrack.test_set_data(name, value, result_set_id=self.id)
+
+    def data_bulk(self, data, **kwargs):
+        return self.racetrack.test_set_data_bulk(data, result_set_id=self.id, **kwargs)
+
+    def end(self):
+        self.racetrack.test_set_end(id=self.id)
+
+
+class TestCase(_Handle):
+    """
+    Test case returned by Racetrack.test_case_begin or TestSet.test_case_begin, it holds its own result.
+    Safe to use from several threads at once.
+    """
+
+    __slots__ = ("test_set_id", "name", "result", "_lock")
+
+    def __init__(self, racetrack, id, test_set_id, name):
+        super(TestCase, self).__init__(racetrack, id)
+        self.test_set_id = test_set_id
+        self.name = name
+        self.result = RESULT.passs
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return self.racetrack.get_test_case_url(self.id, self.test_set_id)
+
+    def _verified(self, passed):
+        if not passed:
+            with self._lock:
+                self.result = RESULT.fail
+
+    def comment(self, description):
+        self.racetrack.comment(description, result_id=self.id)
+
+    def warning(self, description):
+        self.racetrack.warning(description, result_id=self.id)
+
+    def verify(self, description, actual, expected, screenshot=None):
+        self.racetrack.verify(description, actual, expected, screenshot=screenshot, result_id=self.id)
+
+    def verify_many(self, checks, **kwargs):
+        return self.racetrack.verify_many(checks, result_id=self.id, **kwargs)
+
+    def screenshot(self, description, screenshot):
+        self.racetrack.screenshot(description, screenshot, result_id=self.id)
+
+    def log(self, description, log):
+        self.racetrack.log(description, log, result_id=self.id)
+
+    def tail_log(self, path, **kwargs):
+        return self.racetrack.tail_log(path, result_id=self.id, **kwargs)
+
+    def update(self, **kwargs):
+        self.racetrack.test_case_update(id=self.id, **kwargs)
+
+    def end(self, result=None, end_time=None):
+        self.racetrack.test_case_end(id=self.id, result=result, end_time=end_time)
+
+
 class Racetrack(object):
     """
     Racetrack is a results repository and triage tool. 
@@ -136,16 +372,156 @@ class Racetrack(object):
     _url = None
 
     def __init__(self, server="racetrack.eng.vmware.com", port=443, log_on_console=False, logger=None, loglevel='INFO',
-                 log_request_and_response=False, log_action_msgs_as='info'):
+                 log_request_and_response=False, log_action_msgs_as='info', transport=None, pool_size=10,
+                 timeout=DEFAULT_TIMEOUT, asynchronous=False, async_workers=2, async_queue_size=1000,
+                 async_drain_timeout=30, async_policy="block", spool=None, attachment_cache=None, image_pipeline=None, retries=2,
+                 circuit_breaker=True, on_server_down="raise", fallback_spool=None, metrics=False,
+                 account_overhead=False, overhead_slowest=5, record=None, record_attachments=False, sidecar=None,
+                 overflow_size=None, mirrors=None, http_client="requests"):
         """
         :param server: (str) Racetrack server. Use 'racetrack-dev.eng.vmware.com' for stagging/tests.
          Default: "racetrack.eng.vmware.com"
          
         :param port: (int) Racetrack port. 'racetrack.eng.vmware.com' requires to be connect over port 80.
          Default: 443, for racetrack.eng.vmware.com
+
+        :param transport: Object used to send the requests, anything providing post(uri, data, files, headers)
+         and close(). A transport passed in is shared and is not closed by this object.
+         Default: None, a pooled keep-alive HTTPTransport is created.
+
+        :param pool_size: (int) Connection pool size of the default transport.
+         Default: 10
+
+        :param timeout: (float or tuple) Connect/read timeout of the default transport, in seconds, either one
+         value for both or a (connect, read) tuple. None waits forever. Log and screenshot uploads get a longer read
+         timeout, see HTTPTransport.timeouts.
+         Default: (10, 120)
+
+        :param retries: (int) Number of times the default transport sends a call again, with a jittered exponential
+         delay. Calls are retried when they could not reach the server; updates and ends (which may safely be sent
+         twice) also after a timeout or a 5xx response.
+         Default: 2
+
+        :param circuit_breaker: (CircuitBreaker or bool) Fails the calls of the default transport at once, with
+         CircuitOpenError, once the server is down instead of waiting for every call to time out. True creates a
+         CircuitBreaker with its defaults: open after 5 consecutive failures, try again after 30 seconds.
+         Default: True
+
+        :param on_server_down: (str) What calls do while the circuit breaker is open: "raise" CircuitOpenError,
+         "drop" comments (counted in 'dropped') and raise for the other calls, or "spool" them, and every call after
+         them, to 'fallback_spool', as with the spool parameter.
+         Default: "raise"
+
+        :param fallback_spool: (str) Journal file path used by on_server_down="spool".
+         Default: None
+
+        :param metrics: (Metrics or bool) Records call counts, latency histograms, bytes sent, errors and retries per
+         method, see stats(). True creates a Metrics object. A transport passed in keeps its own metrics, if any.
+         Default: False
+
+        :param account_overhead: (bool) Measure the time each test case spends blocked in reporting calls, from
+         test_case_begin to test_case_end. test_set_end publishes the totals and the test cases with the most
+         overhead as test set data.
+         Default: False
+
+        :param overhead_slowest: (int) Number of test cases with the most overhead published by test_set_end.
+         Default: 5
+
+        :param record: (str) File the calls are recorded to, with their timing and the size of their attachments,
+         to be played back by the load generator: 'python -m pyRacetrack.load <recording>'.
+         Default: None
+
+        :param record_attachments: (bool) Also keep a copy of the recorded screenshots and logs, in
+         '<record>.files/'. Otherwise the load generator sends zero bytes of the same size.
+         Default: False
+
+        :param sidecar: (str) Unix socket of a sidecar (python -m pyRacetrack.sidecar) sending the calls of all the
+         processes of the host over one pool of connections. Only test_set_begin, test_case_begin and test_set_data
+         wait for the server; failures of the other calls are counted in stats()["transport"]. pool_size, timeout,
+         retries, circuit_breaker and metrics then apply to the sidecar, not to this object.
+         Default: None
+
+        :param asynchronous: (bool) Queue comment/warning/verify/screenshot/log calls and send them from background
+         threads instead of waiting for the server. test_case_end/test_set_end wait for the queued calls first.
+         Default: False
+
+        :param async_workers: (int) Number of background threads in asynchronous mode.
+         Default: 2
+
+        :param async_queue_size: (int) Calls waiting per background thread before the caller blocks.
+         Default: 1000
+
+        :param async_drain_timeout: (float) Seconds the interpreter exit waits for queued or spooled calls.
+         Default: 30
+
+        :param async_policy: (str) What a comment does in asynchronous mode once async_queue_size comments are
+         queued: "block" until there is room, "coalesce" into the last call queued for the test case if it is a
+         comment, "drop-oldest" queued comment, or "spill" to a temporary file. The calls of a test case are sent in
+         order, the test cases with a failed verification or a warning queued first; these calls always block. stats()["lanes"] counts what was delayed, merged or dropped.
+         Default: "block"
+
+        :param spool: (str) Journal file path. When given, every call is appended to this journal and sent to the
+         server from the background, in order, retrying while the server is down. test_set_begin/test_case_begin
+         return placeholder IDs, they are mapped to the real ones when sent. Calls not sent when the process ends
+         can be sent later with 'python -m pyRacetrack.replay <journal>'. Screenshot and log files are read when
+         sent, they must be kept until then.
+         Default: None
+
+        :param attachment_cache: (AttachmentCache or bool) Cache of the screenshots/logs already uploaded, an
+         attachment with the same content as an earlier one is replaced by a reference to it. True creates an
+         AttachmentCache with its defaults.
+         Default: None
+
+        :param image_pipeline: (ImagePipeline) Downscales and re-encodes screenshots in a process pool before they
+         are uploaded. The encoded copies are deleted once uploaded. True creates an ImagePipeline with its defaults,
+         closed by close(); a pipeline passed in is left to the caller, which may share it.
+         Default: None
+
+        :param overflow_size: (int) Comments and verification actual/expected values longer than this many
+         characters are gzipped and uploaded as logs of the test case from a background thread, a summary pointing
+         to the log is sent inline instead; the full text is sent inline, as a comment, if that upload fails. None
+         sends them inline whatever their size.
+         Default: None
+
+        :param mirrors: (list) Other servers every call is replicated to: server names or URLs, (server, port) tuples
+         or Mirror objects. Each one journals the calls and sends them from its own thread and connections, mapping
+         the IDs of this server to its own; it never slows down the calls to this server, nor raises. See
+         racetrack.mirrors[i].get_test_set_url(...) and .stats().
+         Default: None
+
+        :param http_client: (str) HTTP client of the default transport and of the mirrors given by name:
+         "requests" (HTTPTransport) or "httplib", the standard library's (HTTPLibTransport), for agents which should
+         not load requests.
+         Default: "requests"
         """
         self.server = server
         self.port = port
+        self._owns_transport = transport is None
+        if circuit_breaker is True:
+            circuit_breaker = CircuitBreaker()
+        if metrics is True:
+            metrics = Metrics()
+        if transport is None and sidecar is not None:
+            transport = SidecarTransport(sidecar)
+            self._owns_transport = True
+        if http_client not in HTTP_CLIENTS:
+            raise ValueError("http_client must be one of {0}, not {1!r}".format(", ".join(sorted(HTTP_CLIENTS)),
+                                                                                http_client))
+        if transport is None:
+            transport = HTTP_CLIENTS[http_client](pool_size=pool_size, timeout=timeout, retries=retries,
+                                                  breaker=circuit_breaker or None, metrics=metrics or None)
+        elif metrics and getattr(transport, "metrics", False) is None:
+            transport.metrics = metrics
+        self.transport = transport
+        self.metrics = getattr(transport, "metrics", None)
+        if on_server_down not in ("raise", "drop", "spool"):
+            raise ValueError("on_server_down must be 'raise', 'drop' or 'spool', not {0!r}".format(on_server_down))
+        if on_server_down == "spool" and fallback_spool is None:
+            raise ValueError("on_server_down='spool' requires fallback_spool.")
+        self.on_server_down = on_server_down
+        self.fallback_spool = fallback_spool
+        self.dropped = 0
+        self._drain_timeout = async_drain_timeout
         self._log_on_console = log_on_console
         self.log_request_and_response = log_request_and_response
         if self._log_on_console:
@@ -157,6 +533,42 @@ class Racetrack(object):
         else:
             self.logger = None
 
+        self._dispatcher = None
+        if asynchronous:
+            self._dispatcher = Dispatcher(self._send, workers=async_workers, queue_size=async_queue_size,
+                                          drain_timeout=async_drain_timeout, on_error=self._async_error,
+                                          policy=async_policy, coalesce=_coalesce)
+
+        self._spool = None
+        self._spool_lock = threading.Lock()
+        if spool is not None:
+            self._spool = Spool(spool, self.url, self.transport, drain_timeout=async_drain_timeout)
+
+        if attachment_cache is True:
+            attachment_cache = AttachmentCache()
+        self.attachment_cache = attachment_cache or None
+        self._owns_image_pipeline = image_pipeline is True
+        if image_pipeline is True:
+            image_pipeline = ImagePipeline()
+        self.image_pipeline = image_pipeline or None
+
+        self._test_cases = {}
+        self._test_case_end_hooks = []
+        self._tails = []
+        # Test set ID to {name: (value, ResultSetDataId)} of the data published, see test_set_data_bulk.
+        self._published = {}
+        self._published_lock = threading.Lock()
+        self._overflow = Overflow(self, overflow_size) if overflow_size is not None else None
+        self.mirrors = []
+        for mirror in mirrors or ():
+            if isinstance(mirror, basestring):
+                mirror = Mirror(mirror, http_client=http_client)
+            elif isinstance(mirror, tuple):
+                mirror = Mirror(*mirror, http_client=http_client)
+            self.mirrors.append(mirror)
+        self._overhead = OverheadAccount(slowest=overhead_slowest) if account_overhead else None
+        self._recorder = Recorder(record, self.url, record_attachments) if record is not None else None
+        self._local = threading.local()
         self._testset_defaults()
         self._testcase_defaults()
 
@@ -183,6 +595,7 @@ class Racetrack(object):
         self.feature = None
         self.test_case_id = None
         self.test_case_name = None
+        self._test_case = None
         self.result = RESULT.passs
         self.description = None
         self.machine_name = None
@@ -190,21 +603,45 @@ class Racetrack(object):
         self.input_language = None
         self.gos = None
 
+    @property
+    def result(self):
+        """
+        Result of the current test case, it turns to FAIL with the first failed verification.
+        """
+        if self._test_case is not None:
+            return self._test_case.result
+        return self._result
+
+    @result.setter
+    def result(self, value):
+        if self._test_case is not None:
+            self._test_case.result = value
+        else:
+            self._result = value
+
     @property
     def url(self):
         if self._url is None:
-            self._url = "http{0}://{1}".format(("s" if self.port == 443 else ""), self.server) \
-                        if not self.server.startswith("http") else self.server
+            self._url = server_url(self.server, self.port)
         return self._url
 
+    def _resolve(self, id):
+        return self._spool.resolve(id) if self._spool is not None else id
+
+    def get_test_set_url(self, test_set_id):
+        return urlparse.urljoin(self.url, "result.php?id={0}".format(self._resolve(test_set_id)))
+
+    def get_test_case_url(self, test_case_id, test_set_id):
+        return urlparse.urljoin(self.url, "resultdetails.php?id={0}&resultid={1}&view=false&failonly=No"\
+                                .format(self._resolve(test_case_id), self._resolve(test_set_id)))
+
     @property
     def test_set_url(self):
-        return urlparse.urljoin(self.url, "result.php?id={0}".format(self.test_set_id))
+        return self.get_test_set_url(self.test_set_id)
 
     @property
     def test_case_url(self):
-        return urlparse.urljoin(self.url, "resultdetails.php?id={0}&resultid={1}&view=false&failonly=No"\
-                                .format(self.test_case_id, self.test_set_id))
+        return self.get_test_case_url(self.test_case_id, self.test_set_id)
 
     def _post(self, method, parameters):
         uri = urlparse.urljoin(self.url, method)
@@ -214,7 +651,9 @@ class Racetrack(object):
             self.logger.debug("  URI:     {0}".format(uri))
             self.logger.debug("  Params:  {0}".format(parameters))
 
-        headers = {"charset": "UTF-8"}
+        for name, value in parameters.iteritems():
+            if isinstance(value, _Handle):
+                parameters[name] = value.id
 
         files = {}
 
@@ -226,10 +665,68 @@ class Racetrack(object):
             files['Log'] = parameters['Log']
             del parameters['Log']
 
-        response = requests.post(uri, data=parameters, files=files, headers=headers)
+        if not self.mirrors:
+            return self._record(method, parameters, files)
+        kept = [mirror.keep(files) for mirror in self.mirrors]
+        try:
+            result = self._record(method, parameters, files)
+        except Exception:
+            for mirror, mirror_files in zip(self.mirrors, kept):
+                mirror.replicate(method, parameters, mirror_files, failed=True)
+            raise
+        for mirror, mirror_files in zip(self.mirrors, kept):
+            mirror.replicate(method, parameters, mirror_files, result)
+        return result
+
+    def _record(self, method, parameters, files):
+        if self._recorder is None:
+            return self._route(method, parameters, files)
+        entry = self._recorder.start(method, parameters, files)
+        try:
+            result = self._route(method, parameters, files)
+        except Exception as err:
+            self._recorder.finish(entry, error=err)
+            raise
+        self._recorder.finish(entry, result)
+        return result
+
+    def _route(self, method, parameters, files):
+        if self._spool is None and self.on_server_down != "raise" and self.server_down:
+            return self._degraded(method, parameters, files)
+
+        if self._spool is not None:
+            return self._spool.append(method, parameters, files)
+
+        if self._dispatcher is not None and method in ASYNC_METHODS:
+            # Sent after the call returned, the caller may reuse its buffers and files by then.
+            files = dict((field, attachment.detach()) for field, attachment in files.iteritems())
+            self._dispatcher.submit(parameters.get('ResultID'), method, parameters, files,
+                                    lane=_lane(method, parameters))
+            return ''
+
+        return self._send(method, parameters, files)
+
+    def _send(self, method, parameters, files):
+        uri = urlparse.urljoin(self.url, method)
+        headers = {"charset": "UTF-8"}
+
+        if files:
+            body = MultipartEncoder(parameters, files)
+            headers["Content-Type"] = body.content_type
+            try:
+                response = self.transport.post(uri, data=body, headers=headers)
+            except Exception:
+                self._upload_failed(parameters, files)
+                raise
+            finally:
+                body.close()
+                for attachment in files.itervalues():
+                    attachment.close()
+        else:
+            response = self.transport.post(uri, data=parameters, headers=headers)
 
         if self.logger is not None and self.log_request_and_response:
-            if response.status_code == requests.codes.ok:
+            if response.status_code == 200:
                 self.logger.debug("[Racetrack]: Post response.")
                 self.logger.debug("  Return code:    {0}".format(response.status_code))
                 self.logger.debug("  Response data:  {0}".format(response.content))
@@ -238,8 +735,143 @@ class Racetrack(object):
                 self.logger.error("  Return code:    {0}".format(response.status_code))
                 self.logger.error("  Response data:  {0}".format(response.content))
 
+        if response.status_code != 200:
+            self._upload_failed(parameters, files)
+            raise ServerError(method, response.status_code, response.content)
         return response.content
 
+    def _upload_failed(self, parameters, files):
+        """
+        Makes the attachment cache forget the attachments of a call which failed, they were not uploaded.
+        """
+        if files and self.attachment_cache is not None:
+            self.attachment_cache.forget(parameters.get('ResultID'), parameters.get('Description'))
+
+    @property
+    def server_down(self):
+        """
+        True while the circuit breaker of the transport is open.
+        """
+        breaker = getattr(self.transport, "breaker", None)
+        return breaker is not None and breaker.is_open
+
+    def _degraded(self, method, parameters, files):
+        if self.on_server_down == "spool":
+            # Threads finding the server down together share one journal.
+            with self._spool_lock:
+                if self._spool is None:
+                    if self.logger is not None:
+                        self.logger.warning("[Racetrack]: Server is down, spooling the calls to '{0}'.".format(
+                            self.fallback_spool))
+                    self._spool = Spool(self.fallback_spool, self.url, self.transport,
+                                        drain_timeout=self._drain_timeout)
+            return self._spool.append(method, parameters, files)
+        if method in DROPPABLE_METHODS:
+            self.dropped += 1
+            return ''
+        self._upload_failed(parameters, files)
+        raise CircuitOpenError("Racetrack server is down, {0} was not sent.".format(method))
+
+    def _async_error(self, args, err):
+        if self.logger is not None:
+            self.logger.error("[Racetrack]: Queued post to '{0}' failed: {1!r}".format(args[0], err))
+
+    def add_test_case_end_hook(self, hook):
+        """
+        Registers 'hook' to be called as hook(test_case_id) by test_case_end, before the test case is ended. Its
+        exceptions are logged, not raised.
+        """
+        self._test_case_end_hooks.append(hook)
+
+    def remove_test_case_end_hook(self, hook):
+        self._test_case_end_hooks.remove(hook)
+
+    def _attachment_reference(self, result_id, description, attachment):
+        """
+        Returns the text replacing 'attachment' if the same content was uploaded before, None if it is uploaded.
+        """
+        if self.attachment_cache is None:
+            return None
+        test_case = self._test_cases.get(result_id)
+        test_set_id = test_case.test_set_id if test_case is not None else self.test_set_id
+        return self.attachment_cache.reference(attachment, description, test_set_id, result_id,
+                                               self.get_test_case_url(result_id, test_set_id))
+
+    def flush(self, timeout=None):
+        """
+        Waits until every queued call of the asynchronous mode, or every spooled call, is sent.
+
+        :param timeout: (float) Maximum number of seconds to wait. Default: None, waits until done.
+        :return: (bool) False if the timeout elapsed before the queue was drained.
+        """
+        if self._spool is not None:
+            return self._spool.flush(timeout=timeout)
+        if self._dispatcher is None:
+            return True
+        return self._dispatcher.flush(timeout=timeout)
+
+    def stats(self, format=None):
+        """
+        Returns the metrics of the calls per method (if enabled), the number of queued and spooled calls not sent yet,
+        and the statistics of the transport and the attachment cache.
+
+        :param format: (str) None for a dict, "json" or "prometheus" (text exposition format) for a string.
+        """
+        stats = {
+            "endpoints": self.metrics.snapshot() if self.metrics is not None else {},
+            "queue_depth": self._dispatcher.depth if self._dispatcher is not None else None,
+            "spool_depth": self._spool.depth if self._spool is not None else None,
+            "dropped": self.dropped,
+        }
+        if hasattr(self.transport, "stats"):
+            stats["transport"] = self.transport.stats()
+        if self.attachment_cache is not None:
+            stats["attachment_cache"] = self.attachment_cache.stats()
+        if self._overflow is not None:
+            stats["overflow"] = self._overflow.stats()
+        if self._dispatcher is not None:
+            stats["lanes"] = self._dispatcher.stats()
+        if self.mirrors:
+            stats["mirrors"] = [mirror.stats() for mirror in self.mirrors]
+        if self._recorder is not None:
+            stats["recording_errors"] = self._recorder.errors
+        if format == "json":
+            return to_json(stats)
+        if format == "prometheus":
+            return to_prometheus(stats)
+        if format is not None:
+            raise ValueError("format must be None, 'json' or 'prometheus', not {0!r}".format(format))
+        return stats
+
+    def close(self):
+        """
+        Sends the queued calls and releases the connections held by the transport, if this object created it.
+        """
+        for tail in list(self._tails):
+            tail.stop()
+        if self._overflow is not None:
+            self._overflow.close(timeout=self._drain_timeout)
+        if self._dispatcher is not None:
+            self._dispatcher.close(timeout=self._dispatcher.drain_timeout)
+        if self._spool is not None:
+            self._spool.close()
+        if self.attachment_cache is not None:
+            self.attachment_cache.save()
+        if self._recorder is not None:
+            self._recorder.close()
+        for mirror in self.mirrors:
+            mirror.close()
+        if self._owns_image_pipeline:
+            self.image_pipeline.close()
+        if self._owns_transport:
+            self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     @_console_log
     def test_set_begin(self, buildid, product, description, user, hostos=None,
                        server_buildid=None, branch=None, buildtype=None, testtype=None, language=None):
@@ -301,6 +933,7 @@ class Racetrack(object):
             'Language': language
         }
         self.test_set_id = self._post("TestSetBegin.php", parameters=params)
+        return TestSet(self, self.test_set_id)
 
     def test_set_update(self, id=None, buildid=None, user=None, product=None, description=None, hostos=None,
                         server_buildid=None, branch=None, buildtype="ob", testtype="Regression", language="English"):
@@ -371,10 +1004,15 @@ class Racetrack(object):
             'ID': id
         }
 
+        if self._overhead is not None:
+            self.test_set_data_bulk(self._overhead.summary(id), result_set_id=id)
+
+        if self._dispatcher is not None:
+            self._dispatcher.flush()
         self._post("TestSetEnd.php", parameters=params)
 
-        self.test_set_id = None
-        self._testset_defaults()
+        if id == self.test_set_id:
+            self._testset_defaults()
 
     def test_set_data(self, name, value, result_set_id=None):
         """
@@ -401,10 +1039,71 @@ class Racetrack(object):
             'Name': name,
             'Value': value
         }
-        result_set_data_id = int(self._post("TestSetData.php", parameters=params))
+        result_set_data_id = self._post("TestSetData.php", parameters=params)
+        # A spooled call returns its placeholder.
+        result_set_data_id = int(result_set_data_id) if result_set_data_id.isdigit() else result_set_data_id
+        with self._published_lock:
+            self._published.setdefault(self._data_key(result_set_id), {})[name] = (value, result_set_data_id)
         return result_set_data_id
 
+    def _data_key(self, result_set_id):
+        if isinstance(result_set_id, _Handle):
+            result_set_id = result_set_id.id
+        return unicode(self._resolve(result_set_id))
+
+    def test_set_data_bulk(self, data, result_set_id=None, workers=8):
+        """
+        Associates every Name/Value pair of 'data' with the test set, see test_set_data. The pairs are sent at once
+        over the pooled connections; the pairs this object already published to the test set with the same value
+        are not sent again.
+
+        :param data: (dict or iterable) Name to value, or (name, value) pairs.
+        :param workers: (int) Maximum number of pairs sent at once.
+        :return: (dict) Name to ResultSetDataId.
+        """
+        if not result_set_id:
+            if self.test_set_id is None:
+                raise RacetrackError("No active TestSet Id was found. Have you executed 'test_set_begin' first \
+                or modified the variable 'test_set_id'?")
+            result_set_id = self.test_set_id
+
+        ids = {}
+        pending = Queue.Queue()
+        with self._published_lock:
+            published = self._published.get(self._data_key(result_set_id), {})
+            for name, value in (data.iteritems() if isinstance(data, dict) else data):
+                if name in published and published[name][0] == value:
+                    ids[name] = published[name][1]
+                else:
+                    pending.put((name, value))
+        if pending.empty():
+            return ids
+
+        errors = []
+
+        def send():
+            while True:
+                try:
+                    name, value = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    ids[name] = self.test_set_data(name, value, result_set_id=result_set_id)
+                except Exception as err:
+                    errors.append(err)
+
+        threads = [threading.Thread(target=send, name="RacetrackTestSetData")
+                   for _ in xrange(min(workers, pending.qsize()))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return ids
+
     @_console_log
+    @_overhead
     def test_case_begin(self, name, feature, description=None, machine_name=None, tcmsid=None,
                         input_language="EN", gos=None, start_time=None, result_set_id=None):
         """
@@ -436,6 +1135,17 @@ class Racetrack(object):
         self.input_language = input_language
         self.gos = gos
 
+        self._test_case = self._test_case_begin(name, feature, description, machine_name, tcmsid, input_language, gos,
+                                                start_time, result_set_id)
+        self.test_case_id = self._test_case.id
+        return self._test_case
+
+    @_overhead
+    def _test_case_begin(self, name, feature, description, machine_name, tcmsid, input_language, gos, start_time,
+                         result_set_id):
+        if description is None:
+            description = name
+
         params = {
             'ResultSetID': result_set_id,
             'Name': name,
@@ -448,9 +1158,11 @@ class Racetrack(object):
             'StartTime': start_time
         }
 
-        self.test_case_id = self._post("TestCaseBegin.php", parameters=params)
-        return self.test_case_id
+        test_case = TestCase(self, self._post("TestCaseBegin.php", parameters=params), result_set_id, name)
+        self._test_cases[test_case.id] = test_case
+        return test_case
 
+    @_overhead
     def test_case_update(self, id=None, name=None, feature=None, description=None, machine_name=None, tcmsid=None,
                          input_language="EN", gos=None):
         """
@@ -501,6 +1213,7 @@ class Racetrack(object):
         self._post("TestCaseUpdate.php", parameters=params)
 
     @_console_log
+    @_overhead
     def test_case_end(self, id=None, result=None, end_time=None):
         """
         TestCaseEnd will be a POST request which will return a HTML page with NO content.
@@ -525,8 +1238,18 @@ class Racetrack(object):
 
             id = self.test_case_id
 
+        # Hooks may still report to the test case, e.g. failed verifications, before its result is taken. A hook
+        # which fails does not keep the test case open.
+        for hook in list(self._test_case_end_hooks):
+            try:
+                hook(id)
+            except Exception as err:
+                if self.logger is not None:
+                    self.logger.error("[Racetrack]: Test case end hook {0!r} failed: {1!r}".format(hook, err))
+
         if result is None:
-            result = self.result
+            test_case = self._test_cases.get(id)
+            result = test_case.result if test_case is not None else self.result
         elif isinstance(result, bool):
             result = RESULT.passs if result else RESULT.fail
         else:
@@ -538,11 +1261,16 @@ class Racetrack(object):
             'EndTime': end_time
         }
 
+        if self._dispatcher is not None:
+            self._dispatcher.flush(key=id)
         self._post("TestCaseEnd.php", parameters=params)
 
-        self._testcase_defaults()
+        self._test_cases.pop(id, None)
+        if id == self.test_case_id:
+            self._testcase_defaults()
 
     @_console_log
+    @_overhead
     def comment(self, description, result_id=None):
         """
         TestCaseComment will be a POST request which will return a HTML page with NO content.
@@ -565,6 +1293,9 @@ class Racetrack(object):
                 or modified the variable 'test_case_id'?")
             result_id = self.test_case_id
 
+        if self._overflow is not None:
+            description = self._overflow.offload(result_id, "Comment", description)
+
         params = {
             'ResultID': result_id,
             'Description': description
@@ -573,6 +1304,7 @@ class Racetrack(object):
         self._post("TestCaseComment.php", parameters=params)
 
     @_console_log
+    @_overhead
     def warning(self, description, result_id=None):
         """
         TestCaseWarning is a POST request which will return a HTML page with NO content.
@@ -603,6 +1335,7 @@ class Racetrack(object):
         self._post("TestCaseWarning.php", parameters=params)
 
     @_console_log
+    @_overhead
     def screenshot(self, description, screenshot, result_id=None):
         """
         TestCaseComment will be a POST request which will return a HTML page with NO content.
@@ -615,6 +1348,9 @@ class Racetrack(object):
 
         Example
         TestCaseComment.php?ResultID=1&Description=This%20test%20will%20do%20some%20testing
+
+        The screenshot is a file path, the image in memory (bytearray, memoryview, buffer, or a str holding the
+        image data) or a seekable file-like object read from its current position.
         """
         if not result_id:
             if self.test_set_id is None:
@@ -625,18 +1361,31 @@ class Racetrack(object):
                 or modified the variable 'test_case_id'?")
             result_id = self.test_case_id
 
-        if not os.path.isfile(screenshot):
+        if is_path(screenshot) and not os.path.isfile(screenshot):
             raise IOError("Screenshot path: '{0}' doesn't exists.".format(screenshot))
 
+        attachment = _attachment(screenshot, "screenshot")
+        reference = self._attachment_reference(result_id, description, attachment)
+        if reference is not None:
+            self._post("TestCaseComment.php", parameters={
+                'ResultID': result_id,
+                'Description': "{0} [Screenshot {1}]".format(description, reference)
+            })
+            return
+
+        if self.image_pipeline is not None:
+            attachment = self.image_pipeline.submit(attachment)
+
         params = {
             'ResultID': result_id,
             'Description': description,
-            'Screenshot': (os.path.basename(screenshot), open(screenshot, 'rb'))
+            'Screenshot': attachment
         }
 
         self._post("TestCaseScreenshot.php", parameters=params)
 
     @_console_log
+    @_overhead
     def log(self, description, log, result_id=None):
         """
         TestCaseLog will be a POST request which will return a HTML page with NO content.
@@ -650,6 +1399,10 @@ class Racetrack(object):
 
         Example
         TBD - file upload will be POST request, client code samples are probably more useful.
+
+        The log is a file path, the log in memory (bytearray, memoryview or buffer; a str is a path unless it
+        holds a NUL byte) or a seekable
+        file-like object read from its current position.
         """
         if not result_id:
             if self.test_set_id is None:
@@ -660,18 +1413,52 @@ class Racetrack(object):
                 or modified the variable 'test_case_id'?")
             result_id = self.test_case_id
 
-        if not os.path.isfile(log):
+        if is_path(log) and not os.path.isfile(log):
             raise IOError("Log path: '{0}' doesn't not exists".format(log))
 
+        attachment = _attachment(log, "log.txt")
+        reference = self._attachment_reference(result_id, description, attachment)
+        if reference is not None:
+            self._post("TestCaseComment.php", parameters={
+                'ResultID': result_id,
+                'Description': "{0} [Log {1}]".format(description, reference)
+            })
+            return
+
         params = {
             'ResultID': result_id,
             'Description': description,
-            'Log': (os.path.basename(log), open(log, 'rb'))
+            'Log': attachment
         }
 
         self._post("TestCaseLog.php", parameters=params)
 
+    def tail_log(self, path, description=None, interval=10, chunk_size=1024 * 1024, from_start=True, result_id=None):
+        """
+        Follows the log file 'path' from a background thread and uploads what is appended to it as numbered parts
+        (TestCaseLog), instead of the whole log at the end. The last part is uploaded by test_case_end.
+
+        :param interval: (float) Maximum seconds new content waits before it is uploaded.
+        :param chunk_size: (int) Size from which new content is uploaded without waiting, and maximum part size.
+        :param from_start: (bool) Upload the content already in the file, otherwise only what is appended.
+        :return: (LogTail) stop() ends the tail before the test case ends.
+        """
+        if not result_id:
+            if self.test_set_id is None:
+                raise RacetrackError("No active TestSet Id was found. Have you executed 'test_set_begin' first \
+                or modified the variable 'test_set_id'?")
+            if self.test_case_id is None:
+                raise RacetrackError("No active TestCase Id was found. Have you executed 'test_case_begin' first \
+                or modified the variable 'test_case_id'?")
+            result_id = self.test_case_id
+
+        tail = LogTail(self, path, result_id, description=description, interval=interval, chunk_size=chunk_size,
+                       from_start=from_start)
+        self._tails.append(tail)
+        return tail
+
     @_console_log
+    @_overhead
     def verify(self, description, actual, expected, screenshot=None, result_id=None):
         """
         TestCaseVerification will be a POST request which will return a HTML page with NO content.
@@ -698,25 +1485,146 @@ class Racetrack(object):
                 or modified the variable 'test_case_id'?")
             result_id = self.test_case_id
 
-        verification_result = VERIFY.true if actual == expected else VERIFY.false
+        passed = actual == expected
+        self._verified(result_id, passed)
+        params = self._verification(result_id, description, actual, expected, passed)
+
+        if screenshot is not None and (not is_path(screenshot) or screenshot and os.path.exists(screenshot)):
+            attachment = _attachment(screenshot, "screenshot")
+            reference = self._attachment_reference(result_id, description, attachment)
+            if reference is not None:
+                params['Description'] = "{0} [Screenshot {1}]".format(description, reference)
+            elif self.image_pipeline is not None:
+                params['Screenshot'] = self.image_pipeline.submit(attachment)
+            else:
+                params['Screenshot'] = attachment
 
-        if actual == expected and self.result == RESULT.passs:
-            self.result = RESULT.passs
-        else:
+        self._post("TestCaseVerification.php", parameters=params)
+
+    def _verified(self, result_id, passed):
+        test_case = self._test_cases.get(result_id)
+        if test_case is not None:
+            test_case._verified(passed)
+        elif not passed:
             self.result = RESULT.fail
 
-        params = {
+    def _verification(self, result_id, description, actual, expected, passed):
+        if self._overflow is not None:
+            actual = self._overflow.offload(result_id, "Actual", actual)
+            expected = self._overflow.offload(result_id, "Expected", expected)
+
+        return {
             'ResultID': result_id,
             'Description': description,
             'Actual': actual,
             'Expected': expected,
-            'Result': verification_result,
+            'Result': VERIFY.true if passed else VERIFY.false,
         }
 
-        if screenshot and os.path.exists(screenshot):
-            params['Screenshot'] = (os.path.basename(screenshot), open(screenshot, 'rb'))
+    @_overhead
+    def verify_many(self, checks, collapse_passed=False, window=8, result_id=None):
+        """
+        Verifies every (description, actual, expected) of 'checks' in one go: the comparisons are made as the
+        iterable is consumed, and the test case result is updated and logged once. The verifications are sent in
+        order, up to 'window' at a time over the pooled connections of the transport, so that the round trips
+        overlap instead of adding up; verifications in flight together may be recorded by the server in a slightly
+        different order, window=1 keeps it strict. In asynchronous or spool mode they are queued like the calls of
+        verify().
 
-        self._post("TestCaseVerification.php", parameters=params)
+        :param checks: (iterable) (description, actual, expected) tuples, consumed once, e.g. a generator.
+
+        :param collapse_passed: (bool) Send every run of consecutive passing checks as one verification.
+         Default: False
+
+        :param window: (int) Maximum number of verifications waiting for the server at once, 1 sends them one after
+         the other.
+         Default: 8
+
+        :return: (tuple) Number of checks, number of failed checks.
+        """
+        if not result_id:
+            if self.test_set_id is None:
+                raise RacetrackError("No active TestSet Id was found. Have you executed 'test_set_begin' first \
+                or modified the variable 'test_set_id'?")
+            if self.test_case_id is None:
+                raise RacetrackError("No active TestCase Id was found. Have you executed 'test_case_begin' first \
+                or modified the variable 'test_case_id'?")
+            result_id = self.test_case_id
+
+        queue, errors, senders = None, [], []
+        if self._spool is None and self._dispatcher is None and window > 1:
+            # The senders take the verifications from one queue, so they start in the order they were made.
+            queue = Queue.Queue(maxsize=window)
+
+            def send():
+                while True:
+                    params = queue.get()
+                    if params is None:
+                        return
+                    if not errors:
+                        try:
+                            self._post("TestCaseVerification.php", parameters=params)
+                        except Exception as err:
+                            errors.append(err)
+
+            for _ in xrange(window):
+                sender = threading.Thread(target=send, name="RacetrackVerifyMany")
+                sender.daemon = True
+                sender.start()
+                senders.append(sender)
+
+        def submit(params):
+            if queue is None:
+                self._post("TestCaseVerification.php", parameters=params)
+            else:
+                queue.put(params)
+
+        def submit_run(run):
+            count, first, last = run
+            if count == 1:
+                submit(self._verification(result_id, first[0], first[1], first[2], True))
+            else:
+                submit(self._verification(result_id, "{0} checks passed: '{1}' to '{2}'".format(count, first[0], last),
+                                          count, count, True))
+
+        total = failed = 0
+        run = None
+        try:
+            for description, actual, expected in checks:
+                total += 1
+                passed = actual == expected
+                if passed and collapse_passed:
+                    if run is None:
+                        run = [1, (description, actual, expected), description]
+                    else:
+                        run[0] += 1
+                        run[2] = description
+                    continue
+                if run is not None:
+                    submit_run(run)
+                    run = None
+                if not passed:
+                    failed += 1
+                    if self._log_on_console:
+                        self.logger.error(description + ' [Actual: {0}, Expected: {1}]'.format(actual, expected))
+                submit(self._verification(result_id, description, actual, expected, passed))
+                if errors:
+                    break
+            if run is not None and not errors:
+                submit_run(run)
+        finally:
+            for _ in senders:
+                queue.put(None)
+            for sender in senders:
+                sender.join()
+            self._verified(result_id, not failed)
+
+        if self._log_on_console:
+            getattr(self.logger, self.log_action_msgs_as.lower())(
+                "Verified {0} checks, {1} failed.".format(total, failed))
+        if errors:
+            raise errors[0]
+        return total, failed
 
     def get_as_xml(self, feature=None, machine=None, gos=None):
         """
@@ -739,8 +1647,66 @@ class Racetrack(object):
         if machine is None: machine = self.machine_name
         if gos is None: gos = self.gos
         if self.test_set_id:
-            return XML_CONTENTS.format(self.url, self.port, self.test_set_id, self.buildid, self.user, self.product,
-                                       self.description, self.hostos, feature, machine, self.input_language, gos)
+            return XML_CONTENTS.format(*[_xml_value(value) for value in (
+                self.url, self.port, self._resolve(self.test_set_id), self.buildid, self.user, self.product,
+                self.description, self.hostos, feature, machine, self.input_language, gos)])
+
+    def to_state(self):
+        """
+        Returns the server, the current test set (and test case, if any) and their details, for
+        Racetrack.from_state to carry on in another process or on another machine.
+        """
+        state = dict((name, getattr(self, name)) for name in STATE_ATTRIBUTES)
+        state.update(server=self.server, port=self.port)
+        for name in ("test_set_id", "test_case_id"):
+            if state[name] is not None:
+                state[name] = self._resolve(state[name])
+                if is_placeholder(state[name]):
+                    raise RacetrackError("The {0} is not known yet, the spooled calls were not sent.".format(name))
+        return state
+
+    def to_json(self):
+        return json.dumps(self.to_state(), separators=(',', ':'))
+
+    def to_env(self):
+        """
+        Returns the environment variables passing the state to a child process, e.g.
+        subprocess.Popen(..., env=dict(os.environ, **racetrack.to_env())).
+        """
+        return {STATE_ENV: self.to_json()}
+
+    @classmethod
+    def from_state(cls, state=None, **kwargs):
+        """
+        Creates a Racetrack object reporting to an existing test set, without any call to the server.
+
+        :param state: (dict or str) State returned by to_state, to_json or get_as_xml, or the path of a file holding
+         one of them.
+         Default: None, read from the RACETRACK_STATE environment variable set with to_env.
+
+        :param kwargs: Arguments of Racetrack, server and port default to those of the state.
+        """
+        if state is None:
+            state = os.environ.get(STATE_ENV)
+            if state is None:
+                raise RacetrackError("No state given and {0} is not set.".format(STATE_ENV))
+        if isinstance(state, basestring):
+            if not state.lstrip().startswith(("<", "{")) and os.path.isfile(state):
+                with open(state) as fh:
+                    state = fh.read()
+            state = _parse_state(state)
+        state = dict(state)
+
+        kwargs.setdefault("server", state.pop("server"))
+        kwargs.setdefault("port", int(state.pop("port")))
+        racetrack = cls(**kwargs)
+        for name in STATE_ATTRIBUTES:
+            if name in state:
+                setattr(racetrack, name, state[name])
+        if racetrack.test_case_id is not None:
+            test_case = TestCase(racetrack, racetrack.test_case_id, racetrack.test_set_id, racetrack.test_case_name)
+            racetrack._test_cases[test_case.id] = racetrack._test_case = test_case
+        return racetrack
 
 
 
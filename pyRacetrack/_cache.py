@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class AttachmentCache(object):
+    """
+    Content-hash LRU of the screenshots/logs already uploaded.
+    When the same content is attached again it is replaced by a short reference to the first upload,
+    unless the file is smaller than the reference itself.
+    """
+
+    def __init__(self, max_entries=4096, path=None, scope="test_set"):
+        """
+        :param max_entries: (int) Number of uploads remembered, the least recently used ones are forgotten first.
+         Default: 4096
+
+        :param path: (str) JSON file the cache is loaded from and saved to, so identical attachments are also
+         recognized across runs, together with scope=None.
+         Default: None, kept in memory only.
+
+        :param scope: (str) Where an earlier upload may be referenced from: "test_case", "test_set", or None for
+         anywhere, including earlier runs.
+         Default: "test_set"
+        """
+        if scope not in ("test_case", "test_set", None):
+            raise ValueError("scope must be 'test_case', 'test_set' or None, not {0!r}".format(scope))
+        self.max_entries = max_entries
+        self.path = path
+        self.scope = scope
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_uploaded = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if path is not None and os.path.isfile(path):
+            with open(path, 'rb') as fh:
+                self._entries.update((digest, tuple(entry)) for digest, entry in json.load(fh))
+
+    @staticmethod
+    def digest(attachment):
+        sha1 = hashlib.sha1()
+        with attachment.open() as fh:
+            for chunk in iter(lambda: fh.read(64 * 1024), ''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def _in_scope(self, entry, test_set_id, test_case_id):
+        if self.scope == "test_case":
+            return entry[1] == test_case_id
+        if self.scope == "test_set":
+            return entry[0] == test_set_id
+        return True
+
+    def reference(self, attachment, description, test_set_id, test_case_id, url):
+        """
+        Returns the text referencing an earlier upload of the same content, or None if 'attachment' has to be
+        uploaded, in which case it is remembered as uploaded by test case 'test_case_id' until forget() says the
+        upload failed.
+        """
+        digest = self.digest(attachment)
+        size = attachment.size
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and self._in_scope(entry, test_set_id, test_case_id):
+                self._entries[digest] = self._entries.pop(digest)
+                reference = "identical to '{0}' ({1}) uploaded earlier: {2}".format(entry[2], entry[3], entry[4])
+                if len(reference) < size:
+                    self.hits += 1
+                    self.bytes_saved += size - len(reference)
+                    return reference
+
+            self.misses += 1
+            self.bytes_uploaded += size
+            self._entries.pop(digest, None)
+            self._entries[digest] = (test_set_id, test_case_id, description, attachment.name, url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return None
+
+    def forget(self, test_case_id, description):
+        """
+        Forgets the uploads remembered for 'description' in test case 'test_case_id', when they failed.
+        """
+        with self._lock:
+            for digest, entry in self._entries.items():
+                if unicode(entry[1]) == unicode(test_case_id) and entry[2] == description:
+                    del self._entries[digest]
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes_saved": self.bytes_saved,
+            "bytes_uploaded": self.bytes_uploaded,
+        }
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            entries = self._entries.items()
+        with open(self.path, 'wb') as fh:
+            json.dump(entries, fh)
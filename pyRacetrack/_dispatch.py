@@ -0,0 +1,356 @@
+import atexit
+import cPickle
+import itertools
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+
+# Priority lanes, highest first. The calls of one key are always sent in the order they were made, the lanes decide
+# which key a worker sends next: the one with a call in the highest lane, then the one waiting the longest.
+LANES = ("high", "normal", "low")
+
+# What submit() does when the queue of the low lane is full, the other lanes always block.
+POLICIES = ("block", "coalesce", "drop-oldest", "spill")
+
+
+class _Lane(object):
+    """
+    Counters of one priority lane of a worker, and what was done to the calls submitted to it.
+    """
+
+    def __init__(self, name, size, policy):
+        self.name = name
+        self.size = size
+        self.policy = policy
+        self.counters = {
+            "submitted": 0,
+            "sent": 0,
+            "blocked": 0,
+            "blocked_seconds": 0.0,
+            "coalesced": 0,
+            "dropped": 0,
+            "spilled": 0,
+        }
+        # Calls queued in memory, and spilled to disk, not sent yet.
+        self.queued = 0
+        self.spilled = 0
+
+    def __len__(self):
+        return self.queued + self.spilled
+
+    @property
+    def full(self):
+        return self.queued >= self.size
+
+
+class _Call(object):
+    __slots__ = ("number", "lane", "args", "offset")
+
+    def __init__(self, number, lane, args):
+        self.number = number
+        self.lane = lane
+        self.args = args
+        # Position of the args in the spill file, once spilled.
+        self.offset = None
+
+
+class _Worker(object):
+    """
+    Calls queued for one worker thread: one FIFO per key, the lanes only order the keys.
+    """
+
+    def __init__(self, queue_size, policy):
+        self.lanes = dict((name, _Lane(name, queue_size, policy if name == "low" else "block")) for name in LANES)
+        self.queues = {}
+        # Calls queued per key and lane, in the order of LANES.
+        self._counts = {}
+        self._numbers = itertools.count()
+        self._spill = None
+        self._spilled = 0
+
+    def append(self, key, lane, args):
+        call = _Call(next(self._numbers), lane, args)
+        self.queues.setdefault(key, deque()).append(call)
+        self._counts.setdefault(key, [0] * len(LANES))[LANES.index(lane.name)] += 1
+        lane.queued += 1
+        return call
+
+    def spill(self, call):
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(prefix="racetrack-spill-")
+        self._spill.seek(0, os.SEEK_END)
+        offset = self._spill.tell()
+        cPickle.dump(call.args, self._spill, cPickle.HIGHEST_PROTOCOL)
+        call.args = None
+        call.offset = offset
+        call.lane.queued -= 1
+        call.lane.spilled += 1
+        call.lane.counters["spilled"] += 1
+        self._spilled += 1
+
+    def last(self, key):
+        queue = self.queues.get(key)
+        return queue[-1] if queue else None
+
+    def remove(self, key, call):
+        self.queues[key].remove(call)
+        self._forget(key, call)
+        call.lane.queued -= 1
+
+    def oldest(self, lane):
+        """
+        Returns the key and the oldest call of 'lane' queued in memory, (None, None) if there is none.
+        """
+        found = None, None
+        for key, queue in self.queues.iteritems():
+            for call in queue:
+                if call.lane is lane and call.offset is None:
+                    if found[1] is None or call.number < found[1].number:
+                        found = key, call
+                    break
+        return found
+
+    def pop(self):
+        """
+        Returns the key and args of the next call to send, None if nothing is queued.
+        """
+        best = None
+        for key, queue in self.queues.iteritems():
+            counts = self._counts[key]
+            rank = (next(index for index, count in enumerate(counts) if count), queue[0].number)
+            if best is None or rank < best[0]:
+                best = rank, key
+        if best is None:
+            return None
+        key = best[1]
+        call = self.queues[key].popleft()
+        self._forget(key, call)
+        if call.offset is None:
+            call.lane.queued -= 1
+            return key, call.args, call.lane
+        self._spill.seek(call.offset)
+        args = cPickle.load(self._spill)
+        call.lane.spilled -= 1
+        self._spilled -= 1
+        if not self._spilled:
+            self._spill.seek(0)
+            self._spill.truncate()
+        return key, args, call.lane
+
+    def _forget(self, key, call):
+        counts = self._counts[key]
+        counts[LANES.index(call.lane.name)] -= 1
+        if not self.queues[key]:
+            del self.queues[key]
+            del self._counts[key]
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+
+
+class Dispatcher(object):
+    """
+    Sends queued Racetrack calls from background worker threads.
+    Calls submitted with the same key (the test case ResultID) always land on the same worker and reach the server in
+    the order they were made; a worker sends first the keys with a call in a higher lane.
+    """
+
+    def __init__(self, send, workers=2, queue_size=1000, drain_timeout=30, on_error=None, policy="block",
+                 coalesce=None):
+        """
+        :param send: Callable doing the actual request, called as send(*args) for every submitted call.
+
+        :param workers: (int) Number of worker threads.
+         Default: 2
+
+        :param queue_size: (int) Maximum number of calls waiting per worker and lane. submit() blocks once it is
+         reached, unless 'policy' says otherwise for the low lane.
+         Default: 1000
+
+        :param drain_timeout: (float) Seconds the interpreter exit waits for queued calls to be sent.
+         Default: 30
+
+        :param on_error: Callable, called as on_error(args, exception) when a queued call fails.
+         Default: None
+
+        :param policy: (str) What submit() does when the queue of the low lane is full: "block" until there is room,
+         "coalesce" the call into the last one queued with the same key when it is in the low lane too (see
+         coalesce), "drop-oldest" call of the lane, or "spill" the call to a temporary file, read back in order.
+         Default: "block"
+
+        :param coalesce: Callable, called as coalesce(queued_args, args), returns the args of one call doing both
+         or None if they cannot be merged, submit() then blocks.
+         Default: None
+        """
+        if policy not in POLICIES:
+            raise ValueError("policy must be one of {0}, not {1!r}".format(", ".join(POLICIES), policy))
+        self._send = send
+        self.drain_timeout = drain_timeout
+        self.on_error = on_error
+        self.policy = policy
+        self.coalesce = coalesce
+        self.errors = 0
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._closed = False
+        self._workers = [_Worker(queue_size, policy) for _ in xrange(workers)]
+        self._threads = []
+        for worker in self._workers:
+            thread = threading.Thread(target=self._work, args=(worker,), name="RacetrackDispatcher")
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        atexit.register(self._drain_at_exit)
+
+    @property
+    def depth(self):
+        """
+        Number of calls submitted but not sent yet.
+        """
+        with self._condition:
+            return sum(self._pending.itervalues())
+
+    def submit(self, key, *args, **kwargs):
+        """
+        Queues send(*args). The 'lane' keyword argument is one of LANES.
+         Default: "normal"
+        """
+        if self._closed:
+            raise RuntimeError("Dispatcher is closed.")
+        worker = self._workers[hash(key) % len(self._workers)]
+        lane = worker.lanes[kwargs.get("lane", "normal")]
+        with self._condition:
+            lane.counters["submitted"] += 1
+            if lane.full:
+                if self._apply_policy(worker, lane, key, args):
+                    return
+                start = time.time()
+                if lane.full:
+                    lane.counters["blocked"] += 1
+                    while lane.full:
+                        self._condition.wait()
+                    lane.counters["blocked_seconds"] += time.time() - start
+            worker.append(key, lane, args)
+            self._pending[key] = self._pending.get(key, 0) + 1
+            self._condition.notify_all()
+
+    def _apply_policy(self, worker, lane, key, args):
+        """
+        Returns True if the policy of 'lane' took care of the call, False if it has to be queued, once there is room.
+        """
+        if lane.policy == "spill":
+            call = worker.append(key, lane, args)
+            try:
+                worker.spill(call)
+            except (cPickle.PicklingError, TypeError):
+                worker.remove(key, call)
+                return False
+            self._pending[key] = self._pending.get(key, 0) + 1
+            self._condition.notify_all()
+            return True
+
+        if lane.policy == "coalesce" and self.coalesce is not None:
+            # Only into the last call of the key, merging over another call would send it out of order.
+            last = worker.last(key)
+            if last is not None and last.lane is lane and last.offset is None:
+                merged = self.coalesce(last.args, args)
+                if merged is not None:
+                    last.args = merged
+                    lane.counters["coalesced"] += 1
+                    return True
+
+        if lane.policy == "drop-oldest":
+            dropped_key, dropped = worker.oldest(lane)
+            if dropped is not None:
+                worker.remove(dropped_key, dropped)
+                lane.counters["dropped"] += 1
+                self._done(dropped_key)
+        return False
+
+    def _done(self, key):
+        self._pending[key] -= 1
+        if not self._pending[key]:
+            del self._pending[key]
+        self._condition.notify_all()
+
+    def flush(self, key=None, timeout=None):
+        """
+        Waits until the queued calls of 'key' (or all of them) are sent.
+        Returns False if 'timeout' seconds elapsed first.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._pending.get(key) if key is not None else self._pending:
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """
+        Sends what is queued, waiting at most 'timeout' seconds, and stops the workers once their lanes are empty.
+        """
+        if self._closed:
+            return True
+        flushed = self.flush(timeout=timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if flushed:
+            for thread in self._threads:
+                if thread is not threading.current_thread():
+                    thread.join()
+        return flushed
+
+    def stats(self):
+        """
+        Returns the counters and the depth of every lane, summed over the workers.
+        """
+        with self._condition:
+            stats = {}
+            for name in LANES:
+                lanes = [worker.lanes[name] for worker in self._workers]
+                counters = dict((counter, sum(lane.counters[counter] for lane in lanes))
+                                for counter in lanes[0].counters)
+                counters["depth"] = sum(len(lane) for lane in lanes)
+                counters["policy"] = lanes[0].policy
+                stats[name] = counters
+            return stats
+
+    def _drain_at_exit(self):
+        self.close(timeout=self.drain_timeout)
+
+    def _work(self, worker):
+        while True:
+            with self._condition:
+                while True:
+                    call = worker.pop()
+                    if call is not None:
+                        break
+                    if self._closed:
+                        worker.close()
+                        return
+                    self._condition.wait()
+                key, args, lane = call
+                # Room for a blocked submit().
+                self._condition.notify_all()
+
+            try:
+                self._send(*args)
+            except Exception as err:
+                with self._condition:
+                    self.errors += 1
+                if self.on_error is not None:
+                    self.on_error(args, err)
+            finally:
+                with self._condition:
+                    lane.counters["sent"] += 1
+                    self._done(key)
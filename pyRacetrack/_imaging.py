@@ -0,0 +1,229 @@
+import io
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+from _multipart import Attachment, BufferAttachment
+
+
+FORMATS = {
+    "JPEG": ".jpg",
+    "PNG": ".png",
+    "WEBP": ".webp",
+}
+
+
+def _image():
+    """
+    Returns PIL.Image, imported on first use: Pillow is optional and slow to import.
+    """
+    from PIL import Image
+    return Image
+
+
+def _encode(path, data, max_size, format, quality):
+    """
+    Runs in the pool: downscales and re-encodes the file 'path' into a temporary file, or the image 'data' in memory.
+    Returns (encoded path or data, None if it would not be smaller, original size, encoded size, seconds).
+    """
+    start = time.time()
+    Image = _image()
+    if data is None:
+        original_size = os.path.getsize(path)
+        image = Image.open(path)
+    else:
+        original_size = len(data)
+        image = Image.open(io.BytesIO(data))
+    if max_size is not None:
+        image.thumbnail(max_size, Image.LANCZOS)
+    if format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    if data is None:
+        fd, encoded = tempfile.mkstemp(prefix="racetrack-", suffix=FORMATS[format])
+        fh = os.fdopen(fd, 'wb')
+    else:
+        fh = io.BytesIO()
+    if format == "PNG":
+        image.save(fh, format, optimize=True)
+    else:
+        image.save(fh, format, quality=quality)
+    encoded_size = fh.tell()
+    if data is None:
+        fh.close()
+    else:
+        encoded = fh.getvalue()
+
+    if encoded_size >= original_size:
+        if data is None:
+            os.remove(encoded)
+        return None, original_size, original_size, time.time() - start
+    return encoded, original_size, encoded_size, time.time() - start
+
+
+class EncodedAttachment(Attachment):
+    """
+    Screenshot being re-encoded in the ImagePipeline pool.
+    Only reading it (its path, name, size or content) waits for the encoding to finish, in asynchronous mode that
+    happens on the background threads.
+    """
+
+    def __init__(self, original, pending, pipeline):
+        self.original = original
+        self._pending = pending
+        self._pipeline = pipeline
+        self._encoded = None
+
+    def _result(self):
+        """
+        Returns the attachment uploaded: the encoded screenshot, or the original one if it is not smaller.
+        """
+        if self._encoded is None:
+            from multiprocessing import TimeoutError
+
+            source = self.original.path or self.original.name
+            try:
+                encoded, original_size, encoded_size, seconds = self._pending.get(self._pipeline.timeout)
+            except Exception as err:
+                # Failed, or the pool worker is stuck or was killed: the original is uploaded.
+                encoded, original_size, encoded_size, seconds = None, self.original.size, self.original.size, 0
+                self._pipeline._record(source, original_size, encoded_size, seconds, err)
+                if isinstance(err, TimeoutError):
+                    self._pipeline._stuck = True
+            else:
+                self._pipeline._record(source, original_size, encoded_size, seconds)
+
+            if not encoded:
+                self._encoded = self.original
+            else:
+                name = os.path.splitext(self.original.name)[0] + FORMATS[self._pipeline.format]
+                if self.original.path is None:
+                    self._encoded = BufferAttachment(encoded, name)
+                else:
+                    self._encoded = Attachment(encoded, name)
+                    self._encoded.temporary = True
+        return self._encoded
+
+    @property
+    def temporary(self):
+        return self._result().temporary
+
+    @temporary.setter
+    def temporary(self, value):
+        self._result().temporary = value
+
+    @property
+    def path(self):
+        return self._result().path
+
+    @property
+    def name(self):
+        return self._result().name
+
+    @property
+    def size(self):
+        return self._result().size
+
+    def open(self):
+        return self._result().open()
+
+    def close(self):
+        self._result().close()
+
+
+class ImagePipeline(object):
+    """
+    Downscales and re-encodes screenshots before upload, in a pool of processes.
+    Requires Pillow.
+    """
+
+    def __init__(self, max_size=(1920, 1080), format="JPEG", quality=85, processes=None, history=1000, timeout=60):
+        """
+        :param max_size: (tuple) Maximum (width, height), larger screenshots are scaled down keeping their aspect
+         ratio. None keeps the resolution.
+         Default: (1920, 1080)
+
+        :param format: (str) "JPEG" or "WEBP" (lossy, see quality) or "PNG" (lossless).
+         Default: "JPEG"
+
+        :param quality: (int) Quality of the lossy formats, 1 to 100.
+         Default: 85
+
+        :param processes: (int) Size of the process pool.
+         Default: None, one process per CPU.
+
+        :param history: (int) Number of encodings kept for stats().
+         Default: 1000
+
+        :param timeout: (float) Seconds the upload of a screenshot waits for its encoding, the original is uploaded
+         afterwards. None waits forever.
+         Default: 60
+        """
+        try:
+            _image()
+        except ImportError:
+            raise ImportError("ImagePipeline requires Pillow, install it with 'pip install Pillow'.")
+        if format not in FORMATS:
+            raise ValueError("format must be one of {0}, not {1!r}".format(", ".join(sorted(FORMATS)), format))
+        self.max_size = max_size
+        self.format = format
+        self.quality = quality
+        self.processes = processes
+        self.timeout = timeout
+        self._pool = None
+        # An encoding timed out, close() does not wait for the workers.
+        self._stuck = False
+        self._lock = threading.Lock()
+        self._history = deque(maxlen=history)
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                import multiprocessing
+                self._pool = multiprocessing.Pool(self.processes)
+            return self._pool
+
+    def submit(self, attachment):
+        """
+        Starts encoding 'attachment' and returns the EncodedAttachment to upload instead.
+        """
+        data = None
+        if attachment.path is None:
+            with attachment.open() as fh:
+                data = fh.read()
+        pending = self.pool.apply_async(_encode, (attachment.path, data, self.max_size, self.format, self.quality))
+        return EncodedAttachment(attachment, pending, self)
+
+    def _record(self, path, original_size, encoded_size, seconds, error=None):
+        self._history.append({
+            "path": path,
+            "original_size": original_size,
+            "encoded_size": encoded_size,
+            "seconds": seconds,
+            "error": None if error is None else repr(error),
+        })
+
+    def stats(self):
+        """
+        Returns the before/after sizes and encoding time of the latest screenshots, oldest first.
+        """
+        return list(self._history)
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                if self._stuck:
+                    self._pool.terminate()
+                else:
+                    self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,25 +1,298 @@
-
+import Queue
+import gzip
 import logging
+import os
+import tempfile
+import threading
+import time
 from pyRacetrack import Racetrack
+from pyRacetrack._multipart import Attachment
+
+
+class LogBudget(object):
+    """
+    Per test case limits of the records RacetrackHandler reports. Once a level is over its budget, or records come
+    faster than the rate limit allows, only every 'sample_every'-th record is reported and the others are suppressed.
+    WARNING and more severe records are always reported.
+    """
+
+    def __init__(self, records=None, bytes=None, rate=None, burst=None, sample_every=100, overflow_log=True):
+        """
+        :param records: (dict) Level name to maximum number of records reported per test case, e.g. {"INFO": 1000}.
+         Default: None, no limit.
+
+        :param bytes: (dict) Level name to maximum number of message bytes reported per test case.
+         Default: None, no limit.
+
+        :param rate: (float) Records per second reported on average (token bucket), None for no rate limit.
+         Default: None
+
+        :param burst: (int) Records which may be reported at once above the rate.
+         Default: None, same as rate.
+
+        :param sample_every: (int) Report one of this many records once over budget, 0 reports none of them.
+         Default: 100
+
+        :param overflow_log: (bool) Keep the suppressed records in a gzipped log attached to the test case when it ends.
+         Default: True
+        """
+        self.records = records or {}
+        self.bytes = bytes or {}
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.sample_every = sample_every
+        self.overflow_log = overflow_log
+
+
+class _TestCaseBudget(object):
+    """
+    What RacetrackHandler reported and suppressed for one test case.
+    """
+
+    __slots__ = ("records", "bytes", "suppressed", "over", "tokens", "updated", "overflow_path", "overflow")
+
+    def __init__(self, burst):
+        self.records = {}
+        self.bytes = {}
+        self.suppressed = {}
+        self.over = 0
+        self.tokens = burst
+        self.updated = time.time()
+        self.overflow_path = None
+        self.overflow = None
+
+    def admit(self, budget, record, message):
+        level = record.levelname
+        if record.levelno >= logging.WARNING:
+            return True
+
+        over = self.records.get(level, 0) >= budget.records.get(level, float("inf")) or \
+            self.bytes.get(level, 0) + len(message) > budget.bytes.get(level, float("inf"))
+        if budget.rate is not None:
+            now = time.time()
+            self.tokens = min(budget.burst, self.tokens + (now - self.updated) * budget.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+            else:
+                over = True
+
+        if over:
+            self.over += 1
+            if not budget.sample_every or self.over % budget.sample_every:
+                self.suppressed[level] = self.suppressed.get(level, 0) + 1
+                if budget.overflow_log:
+                    self._overflow(record, message)
+                return False
+
+        self.records[level] = self.records.get(level, 0) + 1
+        self.bytes[level] = self.bytes.get(level, 0) + len(message)
+        return True
+
+    def _overflow(self, record, message):
+        if self.overflow is None:
+            fd, self.overflow_path = tempfile.mkstemp(prefix="racetrack-", suffix=".log.gz")
+            self.overflow = gzip.GzipFile(fileobj=os.fdopen(fd, 'wb'), mode='wb')
+        if isinstance(message, unicode):
+            message = message.encode('utf-8')
+        self.overflow.write("{0} {1} {2}\n".format(
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created)), record.levelname, message))
+
+    def close(self):
+        if self.overflow is not None:
+            fileobj = self.overflow.fileobj
+            self.overflow.close()
+            fileobj.close()
+            self.overflow = None
 
 
 class RacetrackHandler(logging.Handler):
 
-    def __init__(self, racetrack=None, ignore_errors=False, *args, **kwargs):
+    def __init__(self, racetrack=None, ignore_errors=False, batch=False, max_records=100, max_bytes=64 * 1024,
+                 flush_interval=1.0, block_budget=0.005, queue_size=10000, flush_timeout=30, budget=None,
+                 *args, **kwargs):
+        """
+        :param racetrack: (Racetrack) Object the records are reported to, as comments, warnings (WARN/CRITICAL)
+         and failed verifications (ERROR).
+
+        :param ignore_errors: (bool) Report ERROR records as comments instead of failed verifications.
+         Default: False
+
+        :param batch: (bool) Queue the records and send them from a background thread. Consecutive comments are
+         coalesced into one TestCaseComment; warnings and failed verifications are sent in order between them.
+         test_case_end waits for the records of the test case to be sent.
+         Default: False
+
+        :param max_records: (int) Maximum number of records coalesced into one comment.
+         Default: 100
+
+        :param max_bytes: (int) Maximum size of a coalesced comment.
+         Default: 65536
+
+        :param flush_interval: (float) Maximum seconds a record waits to be coalesced with the following ones.
+         Default: 1.0
+
+        :param block_budget: (float) Maximum seconds a log call waits when the queue is full, the record is dropped
+         (and counted in 'dropped') afterwards. Only INFO and DEBUG records are dropped: WARNING and more severe
+         records wait for room.
+         Default: 0.005
+
+        :param queue_size: (int) Maximum number of queued records.
+         Default: 10000
+
+        :param flush_timeout: (float) Maximum seconds test_case_end/flush() wait for the queued records.
+         Default: 30
+
+        :param budget: (LogBudget) Limits the records reported per test case. test_case_end adds a comment with the
+         number of records suppressed, and the gzipped log holding them.
+         Default: None, every record is reported.
+        """
         super(RacetrackHandler, self).__init__(*args, **kwargs)
         self.racetrack = racetrack
         self.ignore_errors = ignore_errors
+        self.batch = batch
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.block_budget = block_budget
+        self.flush_timeout = flush_timeout
+        self.budget = budget
+        self.dropped = 0
+        self.errors = 0
+        self._budgets = {}
+
+        if self.batch or self.budget is not None:
+            if not isinstance(self.racetrack, Racetrack):
+                raise ValueError("Racetrack object is not of type: %s" % Racetrack.__name__)
+            self.racetrack.add_test_case_end_hook(self._test_case_end)
+        if self.batch:
+            self._queue = Queue.Queue(maxsize=queue_size)
+            self._thread = threading.Thread(target=self._work, name="RacetrackHandler")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _action(self, record):
+        if record.levelname in ['ERROR'] and not self.ignore_errors:
+            return "verify"
+        elif record.levelname in ['WARN', 'CRITICAL']:
+            return "warning"
+        return "comment"
+
+    def _report(self, action, message, result_id=None):
+        if action == "verify":
+            self.racetrack.verify(message, actual=False, expected=True, result_id=result_id)
+        else:
+            getattr(self.racetrack, action)(message, result_id=result_id)
 
     def emit(self, record):
         if not isinstance(self.racetrack, Racetrack):
-            raise ValueError("Racetrack object is not of type: %s" % Racetrack().__class__.__name__))
-        if self.racetrack.test_case_id:
-            if record.levelname in ['ERROR'] and not self.ignore_errors:
-                self.racetrack.verify(record.msg, actual=False, expected=True)
-            elif record.levelname in ['WARN', 'CRITICAL']:
-                self.racetrack.warning(record.msg)
+            raise ValueError("Racetrack object is not of type: %s" % Racetrack.__name__)
+        result_id = self.racetrack.test_case_id
+        if not result_id:
+            return
+        if self.batch and threading.current_thread() is self._thread:
+            # Logged while reporting, e.g. by the console logging of the Racetrack object.
+            return
+        message = record.getMessage()
+        if self.budget is not None:
+            budget = self._budgets.get(result_id)
+            if budget is None:
+                budget = self._budgets[result_id] = _TestCaseBudget(self.budget.burst)
+            if not budget.admit(self.budget, record, message):
+                return
+        if not self.batch:
+            self._report(self._action(record), message)
+            return
+        action = self._action(record)
+        if action == "verify":
+            # Failed whether or not it is sent yet.
+            self.racetrack._verified(result_id, False)
+        if record.levelno >= logging.WARNING:
+            # Never dropped, and kept in order with the other records.
+            self._queue.put((result_id, action, message))
+            return
+        try:
+            self._queue.put((result_id, action, message), timeout=self.block_budget)
+        except Queue.Full:
+            self.dropped += 1
+
+    def _send(self, result_id, action, messages):
+        try:
+            self._report(action, "\n".join(messages), result_id=result_id)
+        except Exception:
+            self.errors += 1
+
+    def _work(self):
+        # Comments waiting to be coalesced: their test case, messages, size and when the first one was queued.
+        result_id, messages, size, started = None, [], 0, None
+        while True:
+            timeout = None if not messages else max(0, started + self.flush_interval - time.time())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except Queue.Empty:
+                item = None
+
+            if messages and (item is None or item[1] != "comment" or item[0] != result_id or
+                             len(messages) >= self.max_records or size + len(item[2]) > self.max_bytes):
+                self._send(result_id, "comment", messages)
+                result_id, messages, size, started = None, [], 0, None
+
+            if item is None:
+                continue
+            if item[1] == "flush":
+                item[2].set()
+            elif item[1] == "stop":
+                item[2].set()
+                return
+            elif item[1] == "comment":
+                if not messages:
+                    result_id, started = item[0], time.time()
+                messages.append(item[2])
+                size += len(item[2])
             else:
-                self.racetrack.comment(record.msg)
+                self._send(item[0], item[1], [item[2]])
+
+    def _wait_for(self, action):
+        done = threading.Event()
+        # The marker ends the pending comment, so everything queued before it is sent once it is reached.
+        self._queue.put((None, action, done))
+        return done.wait(self.flush_timeout)
+
+    def _test_case_end(self, test_case_id):
+        self.flush()
+        self.acquire()
+        try:
+            budget = self._budgets.pop(test_case_id, None)
+        finally:
+            self.release()
+        if budget is None or not budget.suppressed:
+            return
+
+        budget.close()
+        summary = ", ".join("{0}: {1}".format(level, count) for level, count in sorted(budget.suppressed.iteritems()))
+        try:
+            self.racetrack.comment("Log budget exceeded, {0} records were not reported ({1}).".format(
+                sum(budget.suppressed.itervalues()), summary), result_id=test_case_id)
+            if budget.overflow_path is not None:
+                attachment = Attachment(budget.overflow_path, "suppressed.log.gz")
+                attachment.temporary = True
+                self.racetrack._post("TestCaseLog.php", parameters={
+                    'ResultID': test_case_id,
+                    'Description': "Records over the log budget",
+                    'Log': attachment
+                })
+        except Exception:
+            self.errors += 1
+
+    def flush(self):
+        if self.batch and self._thread.is_alive():
+            self._wait_for("flush")
+
+    def close(self):
+        if self.batch and self._thread.is_alive():
+            self.racetrack.remove_test_case_end_hook(self._test_case_end)
+            self._wait_for("stop")
+        super(RacetrackHandler, self).close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,146 @@
+import json
+import threading
+
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _Endpoint(object):
+
+    __slots__ = ("calls", "errors", "retries", "bytes_sent", "seconds", "max_seconds", "buckets")
+
+    def __init__(self, buckets):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * (len(buckets) + 1)
+
+
+class Metrics(object):
+    """
+    Call counts, latency histograms, bytes sent, errors and retries per Racetrack method, recorded by the transport.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        """
+        :param buckets: (tuple) Upper bounds of the latency histogram buckets in seconds, in increasing order.
+         Default: BUCKETS
+        """
+        self.buckets = tuple(buckets)
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def _endpoint(self, method):
+        endpoint = self._endpoints.get(method)
+        if endpoint is None:
+            endpoint = self._endpoints[method] = _Endpoint(self.buckets)
+        return endpoint
+
+    def record(self, method, seconds, bytes_sent=0, error=False):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                index = i
+                break
+        with self._lock:
+            endpoint = self._endpoint(method)
+            endpoint.calls += 1
+            endpoint.errors += bool(error)
+            endpoint.bytes_sent += bytes_sent
+            endpoint.seconds += seconds
+            endpoint.max_seconds = max(endpoint.max_seconds, seconds)
+            endpoint.buckets[index] += 1
+
+    def retry(self, method):
+        with self._lock:
+            self._endpoint(method).retries += 1
+
+    def snapshot(self):
+        """
+        Returns {method: {"calls", "errors", "retries", "bytes_sent", "seconds", "max_seconds", "buckets"}},
+        "buckets" being [upper bound, calls] pairs, None for the last, unbounded one.
+        """
+        with self._lock:
+            return dict((method, {
+                "calls": endpoint.calls,
+                "errors": endpoint.errors,
+                "retries": endpoint.retries,
+                "bytes_sent": endpoint.bytes_sent,
+                "seconds": endpoint.seconds,
+                "max_seconds": endpoint.max_seconds,
+                "buckets": zip(self.buckets + (None,), endpoint.buckets),
+            }) for method, endpoint in self._endpoints.iteritems())
+
+
+def percentile(values, percent):
+    """
+    Returns the 'percent' percentile of the sorted 'values', None if there are none.
+    """
+    if not values:
+        return None
+    return values[int(round(percent / 100.0 * (len(values) - 1)))]
+
+
+def to_json(stats):
+    return json.dumps(stats, indent=2, sort_keys=True)
+
+
+def _counter(lines, name, help, endpoints, key):
+    lines.append("# HELP {0} {1}".format(name, help))
+    lines.append("# TYPE {0} counter".format(name))
+    for method, endpoint in sorted(endpoints.iteritems()):
+        lines.append('{0}{{endpoint="{1}"}} {2}'.format(name, method, endpoint[key]))
+
+
+def to_prometheus(stats):
+    """
+    Formats the result of Racetrack.stats() in the Prometheus text exposition format.
+    """
+    endpoints = stats.get("endpoints", {})
+    lines = []
+    _counter(lines, "racetrack_requests_total", "Calls sent to the Racetrack server.", endpoints, "calls")
+    _counter(lines, "racetrack_request_errors_total", "Calls which failed or did not return 200.", endpoints,
+             "errors")
+    _counter(lines, "racetrack_request_retries_total", "Calls sent again.", endpoints, "retries")
+    _counter(lines, "racetrack_request_bytes_total", "Request bytes sent.", endpoints, "bytes_sent")
+
+    name = "racetrack_request_duration_seconds"
+    lines.append("# HELP {0} Duration of the calls, retries included.".format(name))
+    lines.append("# TYPE {0} histogram".format(name))
+    for method, endpoint in sorted(endpoints.iteritems()):
+        count = 0
+        for bound, calls in endpoint["buckets"]:
+            count += calls
+            lines.append('{0}_bucket{{endpoint="{1}",le="{2}"}} {3}'.format(
+                name, method, "+Inf" if bound is None else bound, count))
+        lines.append('{0}_sum{{endpoint="{1}"}} {2}'.format(name, method, endpoint["seconds"]))
+        lines.append('{0}_count{{endpoint="{1}"}} {2}'.format(name, method, endpoint["calls"]))
+
+    for key, name, type, help in (
+            ("queue_depth", "racetrack_queue_depth", "gauge", "Calls queued in asynchronous mode and not sent yet."),
+            ("spool_depth", "racetrack_spool_depth", "gauge", "Spooled calls not sent yet."),
+            ("dropped", "racetrack_dropped_total", "counter", "Calls dropped while the server was down.")):
+        if stats.get(key) is None:
+            continue
+        lines.append("# HELP {0} {1}".format(name, help))
+        lines.append("# TYPE {0} {1}".format(name, type))
+        lines.append("{0} {1}".format(name, stats[key]))
+
+    lanes = stats.get("lanes") or {}
+    for key, name, type, help in (
+            ("depth", "racetrack_lane_depth", "gauge", "Calls queued in the lane and not sent yet."),
+            ("blocked", "racetrack_lane_blocked_total", "counter", "Calls which waited for room in the lane."),
+            ("coalesced", "racetrack_lane_coalesced_total", "counter", "Calls merged into a call already queued."),
+            ("dropped", "racetrack_lane_dropped_total", "counter", "Calls dropped to make room in the lane."),
+            ("spilled", "racetrack_lane_spilled_total", "counter", "Calls spilled to disk, the lane being full.")):
+        if not lanes:
+            break
+        lines.append("# HELP {0} {1}".format(name, help))
+        lines.append("# TYPE {0} {1}".format(name, type))
+        for lane, counters in sorted(lanes.iteritems()):
+            lines.append('{0}{{lane="{1}"}} {2}'.format(name, lane, counters[key]))
+    return "\n".join(lines) + "\n"
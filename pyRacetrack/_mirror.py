@@ -0,0 +1,280 @@
+import Queue
+import atexit
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urlparse
+
+from _multipart import Attachment
+from _recording import ID_METHODS
+from _spool import ID_PARAMETERS, Spool
+from _transport import DEFAULT_TIMEOUT, HTTP_CLIENTS, server_url
+
+
+# Guards the number of mirrors still holding a temporary attachment of the primary.
+_holders_lock = threading.Lock()
+
+
+class _Kept(object):
+    """
+    Attachment file of a call, linked or copied into the mirror's directory by the mirror's thread rather than on the
+    test thread. A temporary file of the primary is not deleted by it once uploaded, the last mirror holding it
+    deletes it once it has its own link or copy.
+    """
+
+    def __init__(self, attachment):
+        self.attachment = attachment
+        with _holders_lock:
+            holders = getattr(attachment, "mirror_holders", 0)
+            self.owned = holders > 0 or attachment.temporary
+            if self.owned:
+                attachment.temporary = False
+                attachment.mirror_holders = holders + 1
+
+    def materialize(self, path):
+        """
+        Returns the attachment to journal, as a temporary file 'path'.
+        """
+        try:
+            try:
+                os.link(self.attachment.path, path)
+            except OSError:
+                # Another file system.
+                shutil.copyfile(self.attachment.path, path)
+        finally:
+            self.release()
+        kept = Attachment(path, self.attachment.name)
+        kept.temporary = True
+        return kept
+
+    def release(self):
+        if not self.owned:
+            return
+        self.owned = False
+        with _holders_lock:
+            self.attachment.mirror_holders -= 1
+            last = not self.attachment.mirror_holders
+        if last and os.path.isfile(self.attachment.path):
+            os.remove(self.attachment.path)
+
+    def close(self):
+        self.release()
+
+
+class Mirror(object):
+    """
+    Replicates the calls of a Racetrack object to another server, see Racetrack(mirrors=...).
+    The calls are handed to the mirror's thread, which copies their attachments and journals them, and sent in order
+    by another thread over the mirror's own connections, so a slow or unreachable mirror slows down neither the test
+    nor the other servers. The IDs returned by the primary server are mapped to the ones the mirror returns, until
+    the test set ends. Like with the spool, screenshots and logs passed by path are read after the call returned, keep them.
+    """
+
+    def __init__(self, server, port=443, path=None, pool_size=2, timeout=DEFAULT_TIMEOUT, drain_timeout=30,
+                 http_client="requests"):
+        """
+        :param server: (str) Racetrack server name or URL.
+
+        :param port: (int) Port of the server, when given by name.
+         Default: 443
+
+        :param path: (str) Journal of the calls to replicate, see Spool.
+         Default: None, a journal in a temporary directory, removed by close() once everything was sent.
+
+        :param pool_size: (int) Connection pool size.
+         Default: 2
+
+        :param timeout: Timeout of the calls, see HTTPTransport.
+         Default: DEFAULT_TIMEOUT
+
+        :param drain_timeout: (float) Seconds close() and the interpreter exit wait for the calls not sent yet.
+         Default: 30
+
+        :param http_client: (str) "requests" or "httplib", see Racetrack(http_client=...).
+         Default: "requests"
+        """
+        if http_client not in HTTP_CLIENTS:
+            raise ValueError("http_client must be one of {0}, not {1!r}".format(", ".join(sorted(HTTP_CLIENTS)),
+                                                                                http_client))
+        self.url = server_url(server, port)
+        self._directory = None
+        if path is None:
+            self._directory = tempfile.mkdtemp(prefix="racetrack-mirror-")
+            path = os.path.join(self._directory, "journal")
+        self.path = path
+        self.files_path = path + ".mirrored"
+        self.transport = HTTP_CLIENTS[http_client](pool_size=pool_size, timeout=timeout)
+        self.spool = Spool(path, self.url, self.transport, drain_timeout=drain_timeout)
+        # ID returned by the primary server to the placeholder ID of the call on the mirror, and the test cases of
+        # every test set, forgotten once the test set ends.
+        self.ids = {}
+        self._test_cases = {}
+        self.skipped = 0
+        self.errors = 0
+        self.last_error = None
+        self._numbers = itertools.count(1)
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._queued = 0
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._work, name="RacetrackMirror")
+        self._thread.daemon = True
+        self._thread.start()
+        self._closed = False
+        atexit.register(self.close)
+
+    def keep(self, files):
+        """
+        Called on the test thread before the primary server is sent the call, returns what replicate() takes.
+        Attachments in memory are copied, as the caller may change them once the call returned; files are linked or
+        copied later by the mirror's thread. Returns None if they could not be kept.
+        """
+        kept = {}
+        try:
+            for field, attachment in files.iteritems():
+                kept[field] = attachment.detach() if attachment.path is None else _Kept(attachment)
+        except Exception as err:
+            self.errors += 1
+            self.last_error = err
+            for attachment in kept.itervalues():
+                attachment.close()
+            return None
+        return kept
+
+    def replicate(self, method, parameters, files, result=None, failed=False):
+        """
+        Hands a call made to the primary server to the mirror's thread, 'files' being returned by keep() and 'result'
+        what the primary returned. When the call 'failed' on the primary, the calls creating something are not
+        replicated, there is no ID to map.
+        """
+        if files is None:
+            return
+        with self._condition:
+            self._queued += 1
+        self._queue.put((method, dict(parameters), files, result, failed))
+
+    def _work(self):
+        while True:
+            call = self._queue.get()
+            if call is None:
+                return
+            try:
+                self._journal(*call)
+            except Exception as err:
+                self.errors += 1
+                self.last_error = err
+            finally:
+                with self._condition:
+                    self._queued -= 1
+                    self._condition.notify_all()
+
+    def _journal(self, method, parameters, files, result, failed):
+        if failed and method in ID_METHODS:
+            self._close(files)
+            return
+        with self._lock:
+            for name in ID_PARAMETERS:
+                value = parameters.get(name)
+                if value is None:
+                    continue
+                if unicode(value) not in self.ids:
+                    # Created before the mirror was added, or by another process.
+                    self.skipped += 1
+                    self._close(files)
+                    return
+                parameters[name] = self.ids[unicode(value)]
+        try:
+            for field, attachment in files.items():
+                if isinstance(attachment, _Kept):
+                    if not os.path.isdir(self.files_path):
+                        os.makedirs(self.files_path)
+                    name = "{0}-{1}".format(next(self._numbers), attachment.attachment.name)
+                    files[field] = attachment.materialize(os.path.join(self.files_path, name))
+        except Exception:
+            self._close(files)
+            raise
+        placeholder = self.spool.append(method, parameters, files)
+        with self._lock:
+            if method in ("TestCaseBegin.php", "TestSetData.php") and result is not None:
+                self._test_cases.setdefault(parameters["ResultSetID"], []).append(unicode(result))
+            if method in ID_METHODS and result is not None:
+                self.ids[unicode(result)] = placeholder
+            elif method == "TestSetEnd.php":
+                # The journal already holds the mirror's IDs of the calls made so far.
+                ended = [key for key, value in self.ids.iteritems() if value == parameters["ID"]]
+                for key in ended:
+                    del self.ids[key]
+                for test_case in self._test_cases.pop(parameters["ID"], ()):
+                    self.ids.pop(test_case, None)
+
+    @staticmethod
+    def _close(files):
+        for attachment in files.itervalues():
+            attachment.close()
+
+    def resolve(self, id):
+        """
+        Returns the mirror's ID of the primary server's 'id', None while the mirror did not create it yet or once its
+        test set ended.
+        """
+        with self._lock:
+            placeholder = self.ids.get(unicode(id))
+        if placeholder is None:
+            return None
+        id = self.spool.resolve(placeholder)
+        return None if id == placeholder else id
+
+    def get_test_set_url(self, test_set_id):
+        id = self.resolve(test_set_id)
+        if id is None:
+            return None
+        return urlparse.urljoin(self.url, "result.php?id={0}".format(id))
+
+    def get_test_case_url(self, test_case_id, test_set_id):
+        ids = self.resolve(test_case_id), self.resolve(test_set_id)
+        if None in ids:
+            return None
+        return urlparse.urljoin(self.url, "resultdetails.php?id={0}&resultid={1}&view=false&failonly=No"
+                                .format(*ids))
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "depth": self._queued + self.spool.depth,
+            "rejected": self.spool.rejected,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "last_error": repr(self.spool.last_error or self.last_error) if self.spool.last_error or self.last_error
+            else None,
+        }
+
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._queued:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return self.spool.flush(timeout=None if deadline is None else max(0, deadline - time.time()))
+
+    def close(self, timeout=None):
+        """
+        Waits up to 'timeout' (default: drain_timeout) seconds for the calls to be sent. The temporary journal is
+        removed if they all were, it is left for pyRacetrack.replay otherwise.
+        """
+        if self._closed:
+            return True
+        self._closed = True
+        timeout = self.spool.drain_timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+        self._queue.put(None)
+        self._thread.join(timeout)
+        flushed = self.spool.close(max(0, deadline - time.time())) and not self._thread.is_alive()
+        self.transport.close()
+        if flushed and self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+        return flushed
@@ -0,0 +1,323 @@
+import binascii
+import os
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+# Leading bytes of the image formats, to name the screenshots passed in memory.
+IMAGE_SIGNATURES = (
+    ("\x89PNG\r\n\x1a\n", ".png"),
+    ("\xff\xd8\xff", ".jpg"),
+    ("GIF8", ".gif"),
+    ("BM", ".bmp"),
+)
+
+
+class Attachment(object):
+    """
+    A file uploaded with TestCaseScreenshot/TestCaseLog/TestCaseVerification.
+    The file is only opened, and read in chunks, while the request is sent.
+    """
+
+    # The file is a copy made for the upload and is deleted by close().
+    temporary = False
+
+    def __init__(self, path, name=None):
+        self.path = path
+        self.name = name or os.path.basename(path)
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path)
+
+    @property
+    def content_type(self):
+        import mimetypes
+
+        return mimetypes.guess_type(self.name)[0] or "application/octet-stream"
+
+    def open(self):
+        return open(self.path, 'rb')
+
+    def detach(self):
+        """
+        Returns the attachment to upload after the call returned, when the caller may have changed or closed
+        what it passed.
+        """
+        return self
+
+    def close(self):
+        """
+        Called once the attachment is uploaded.
+        """
+        if self.temporary and os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def __repr__(self):
+        return "<Attachment {0}>".format(self.path)
+
+
+class _BufferReader(object):
+
+    def __init__(self, data):
+        self._data = data
+        self._offset = 0
+
+    def read(self, size=-1):
+        end = len(self._data) if size is None or size < 0 else self._offset + size
+        chunk = self._data[self._offset:end]
+        self._offset += len(chunk)
+        if isinstance(chunk, memoryview):
+            return chunk.tobytes()
+        # A str slice spanning the whole str is the str itself, not a copy.
+        return chunk if isinstance(chunk, str) else str(chunk)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class BufferAttachment(Attachment):
+    """
+    Content held in memory (str, bytearray, memoryview or buffer), uploaded from memory without a copy of the
+    whole content.
+    """
+
+    path = None
+
+    def __init__(self, data, name):
+        if isinstance(data, memoryview) and data.itemsize != 1:
+            data = data.tobytes()
+        self.data = data
+        self.name = name
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def open(self):
+        return _BufferReader(self.data)
+
+    def detach(self):
+        if isinstance(self.data, str):
+            return self
+        return BufferAttachment(_BufferReader(self.data).read(), self.name)
+
+    def close(self):
+        pass
+
+    def __repr__(self):
+        return "<Attachment {0}, {1} bytes in memory>".format(self.name, self.size)
+
+
+class _FileReader(object):
+
+    def __init__(self, fh, start, size):
+        fh.seek(start)
+        self._fh = fh
+        self._remaining = size
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._fh.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        # The file belongs to the caller.
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class FileObjectAttachment(Attachment):
+    """
+    Content of a seekable file-like object, from its current position to its end, read while the request is sent.
+    """
+
+    path = None
+
+    def __init__(self, fh, name):
+        self.file = fh
+        self.name = name
+        self.start = fh.tell()
+        fh.seek(0, os.SEEK_END)
+        self._size = fh.tell() - self.start
+        fh.seek(self.start)
+
+    @property
+    def size(self):
+        return self._size
+
+    def open(self):
+        return _FileReader(self.file, self.start, self._size)
+
+    def detach(self):
+        with self.open() as fh:
+            return BufferAttachment(fh.read(), self.name)
+
+    def close(self):
+        pass
+
+    def __repr__(self):
+        return "<Attachment {0}, {1!r}>".format(self.name, self.file)
+
+
+def is_path(value):
+    """
+    True if 'value' is the path of the file to attach rather than its content. A str holding a NUL byte, as any
+    PNG or JPEG does, cannot be a path and is taken as content.
+    """
+    return isinstance(value, basestring) and "\0" not in value
+
+
+def _name(value, default):
+    name = getattr(value, "name", None)
+    if isinstance(name, basestring) and not name.startswith("<"):
+        return os.path.basename(name)
+    return default
+
+
+def attachment(value, default_name):
+    """
+    Returns the Attachment uploading 'value': a file path, content in memory (bytearray, memoryview, buffer or a
+    str which cannot be a path, see is_path) or a file-like object.
+
+    :param default_name: (str) File name given to content in memory, the extension of a recognized image format is
+     added to it.
+    """
+    if is_path(value):
+        return Attachment(value)
+
+    if hasattr(value, "read"):
+        try:
+            return FileObjectAttachment(value, _name(value, default_name))
+        except (AttributeError, IOError, ValueError):
+            # Not seekable, e.g. a pipe or a socket: read it all now.
+            value = value.read()
+
+    if not isinstance(value, (str, bytearray, memoryview, buffer)):
+        raise TypeError("Cannot attach a {0}, pass a path, a buffer or a file-like object.".format(
+            type(value).__name__))
+    if os.path.splitext(default_name)[1] == "":
+        head = str(value[:8]) if not isinstance(value, memoryview) else value[:8].tobytes()
+        for signature, extension in IMAGE_SIGNATURES:
+            if head.startswith(signature):
+                default_name += extension
+                break
+    return BufferAttachment(value, default_name)
+
+
+def _to_bytes(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def form_fields(fields):
+    """
+    Returns the form fields as unicode, the way the form encoders send them, so that they can be JSON encoded.
+    The bytes of str values which are not UTF-8 are replaced.
+    """
+    return dict((name, None if value is None else _to_bytes(value).decode('utf-8', 'replace'))
+                for name, value in fields.iteritems())
+
+
+class MultipartEncoder(object):
+    """
+    multipart/form-data body which streams its attachments instead of building the whole body in memory.
+    The length is known up front, so the request is sent with a Content-Length header; pass the encoder as
+    request body and 'content_type' as Content-Type header.
+    """
+
+    def __init__(self, fields, files, chunk_size=CHUNK_SIZE):
+        """
+        :param fields: (dict) Form fields, None values are left out.
+        :param files: (dict) Form field to Attachment.
+        :param chunk_size: (int) Number of bytes read from an attachment at once.
+        """
+        self.chunk_size = chunk_size
+        boundary = binascii.hexlify(os.urandom(16))
+        self.content_type = "multipart/form-data; boundary={0}".format(boundary)
+
+        self._segments = []
+        for name, value in sorted(fields.iteritems()):
+            if value is None:
+                continue
+            self._segments.append('--{0}\r\nContent-Disposition: form-data; name="{1}"\r\n\r\n{2}\r\n'
+                                  .format(boundary, name, _to_bytes(value)))
+        for name, attachment in sorted(files.iteritems()):
+            self._segments.append('--{0}\r\nContent-Disposition: form-data; name="{1}"; filename="{2}"\r\n'
+                                  'Content-Type: {3}\r\n\r\n'
+                                  .format(boundary, name, _to_bytes(attachment.name).replace('"', '%22'),
+                                          attachment.content_type))
+            self._segments.append((attachment, attachment.size))
+            self._segments.append('\r\n')
+        self._segments.append('--{0}--\r\n'.format(boundary))
+
+        self._length = sum(len(segment) if isinstance(segment, str) else segment[1] for segment in self._segments)
+        self._chunks = self._generate()
+        self._buffer = ''
+        self._offset = 0
+
+    def __len__(self):
+        return self._length
+
+    def _generate(self):
+        for segment in self._segments:
+            if isinstance(segment, str):
+                yield segment
+                continue
+            attachment, remaining = segment
+            with attachment.open() as fh:
+                while remaining:
+                    data = fh.read(min(self.chunk_size, remaining))
+                    if not data:
+                        raise IOError("{0!r} shrank while being uploaded.".format(attachment))
+                    remaining -= len(data)
+                    yield data
+
+    def read(self, size=-1):
+        """
+        Returns at most 'size' bytes of the body, an empty string once it has been read completely.
+        """
+        if size is None or size < 0:
+            data = self._buffer[self._offset:] + ''.join(self._chunks)
+            self._buffer, self._offset = '', 0
+            return data
+        if self._offset >= len(self._buffer):
+            self._buffer = next(self._chunks, '')
+            self._offset = 0
+        data = self._buffer[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+    def rewind(self):
+        """
+        Starts the body over, to send it again.
+        """
+        self._chunks.close()
+        self._chunks = self._generate()
+        self._buffer = ''
+        self._offset = 0
+
+    def __iter__(self):
+        while True:
+            data = self.read(self.chunk_size)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        self._chunks.close()
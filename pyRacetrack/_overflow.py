@@ -0,0 +1,116 @@
+import gzip
+import io
+import itertools
+import threading
+
+from _dispatch import Dispatcher
+from _multipart import BufferAttachment
+
+
+class Overflow(object):
+    """
+    Moves comment and verification texts over 'threshold' characters out of the form fields: the text is gzipped
+    and uploaded as a log of the test case from a background thread, and a summary pointing to that log is sent
+    inline instead. test_case_end waits for the logs of the test case to be uploaded. A text whose upload fails is
+    sent inline in full, as a comment, rather than lost.
+    """
+
+    def __init__(self, racetrack, threshold=64 * 1024, preview=200, workers=1):
+        """
+        :param racetrack: (Racetrack) Object the logs are uploaded with.
+
+        :param threshold: (int) Texts longer than this many characters are uploaded as logs.
+         Default: 65536
+
+        :param preview: (int) Number of leading characters of the text kept in the summary.
+         Default: 200
+
+        :param workers: (int) Threads compressing and uploading the texts.
+         Default: 1
+        """
+        self.racetrack = racetrack
+        self.threshold = threshold
+        self.preview = preview
+        self.texts = 0
+        self.bytes = 0
+        self.compressed_bytes = 0
+        self.workers = workers
+        self._numbers = itertools.count(1)
+        self._lock = threading.Lock()
+        # Started with the first text over the threshold.
+        self._dispatcher = None
+        racetrack.add_test_case_end_hook(self._test_case_end)
+
+    def offload(self, result_id, field, text):
+        """
+        Returns the text sent inline: 'text' itself, or its summary once its upload is queued.
+        """
+        if not isinstance(text, basestring) or len(text) <= self.threshold:
+            return text
+        with self._lock:
+            if self._dispatcher is None:
+                self._dispatcher = Dispatcher(self._upload, workers=self.workers, on_error=self._error)
+        name = "{0}-{1}.txt.gz".format(field.lower(), next(self._numbers))
+        self._dispatcher.submit(result_id, result_id, field, name, text)
+        summary = "{0}... [{1} characters, uploaded as log '{2}']"
+        if isinstance(text, unicode):
+            summary = unicode(summary)
+        return summary.format(text[:self.preview], len(text), name)
+
+    def _upload(self, result_id, field, name, text):
+        length = len(text)
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        buf = io.BytesIO()
+        with gzip.GzipFile(filename=name[:-3], mode='wb', fileobj=buf) as fh:
+            fh.write(text)
+        compressed = buf.getvalue()
+        self.racetrack._post("TestCaseLog.php", parameters={
+            'ResultID': result_id,
+            'Description': "{0} ({1} characters)".format(field, length),
+            'Log': BufferAttachment(compressed, name)
+        })
+        self.texts += 1
+        self.bytes += len(text)
+        self.compressed_bytes += len(compressed)
+
+    def _error(self, args, err):
+        result_id, field, name, text = args
+        if self.racetrack.logger is not None:
+            self.racetrack.logger.error("[Racetrack]: Upload of '{0}' failed, sent inline: {1!r}".format(name, err))
+        header = "{0} which could not be uploaded as log '{1}':\n"
+        if isinstance(text, unicode):
+            header = unicode(header)
+        try:
+            self.racetrack._post("TestCaseComment.php", parameters={
+                'ResultID': result_id,
+                'Description': header.format(field, name) + text
+            })
+        except Exception as err:
+            if self.racetrack.logger is not None:
+                self.racetrack.logger.error("[Racetrack]: '{0}' could not be sent inline either: {1!r}".format(
+                    name, err))
+
+    def _test_case_end(self, test_case_id):
+        if self._dispatcher is not None:
+            self._dispatcher.flush(key=test_case_id)
+
+    def flush(self, timeout=None):
+        if self._dispatcher is None:
+            return True
+        return self._dispatcher.flush(timeout=timeout)
+
+    def stats(self):
+        return {
+            "texts": self.texts,
+            "bytes": self.bytes,
+            "compressed_bytes": self.compressed_bytes,
+            "pending": self._dispatcher.depth if self._dispatcher is not None else 0,
+            "errors": self._dispatcher.errors if self._dispatcher is not None else 0,
+        }
+
+    def close(self, timeout=None):
+        self.racetrack.remove_test_case_end_hook(self._test_case_end)
+        if self._dispatcher is None:
+            return True
+        return self._dispatcher.close(timeout=timeout)
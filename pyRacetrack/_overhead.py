@@ -0,0 +1,92 @@
+import threading
+
+
+class _Case(object):
+
+    __slots__ = ("id", "name", "test_set_id", "started", "ended", "overhead", "calls")
+
+    def __init__(self, id, name, test_set_id, started):
+        self.id = id
+        self.name = name
+        self.test_set_id = test_set_id
+        self.started = started
+        self.ended = None
+        self.overhead = 0.0
+        self.calls = 0
+
+
+class OverheadAccount(object):
+    """
+    Time each test case spent blocked in reporting calls, against its duration from test_case_begin to the end of
+    test_case_end.
+    """
+
+    def __init__(self, slowest=5):
+        """
+        :param slowest: (int) Number of test cases with the most overhead listed by summary().
+         Default: 5
+        """
+        self.slowest = slowest
+        self._running = {}
+        self._ended = {}
+        self._lock = threading.Lock()
+
+    def begin(self, test_case, started, ended):
+        case = _Case(test_case.id, test_case.name, test_case.test_set_id, started)
+        case.overhead, case.calls = ended - started, 1
+        with self._lock:
+            self._running[test_case.id] = case
+
+    def add(self, test_case_id, seconds):
+        with self._lock:
+            case = self._running.get(test_case_id)
+            if case is not None:
+                case.overhead += seconds
+                case.calls += 1
+
+    def end(self, test_case_id, ended, seconds):
+        with self._lock:
+            case = self._running.pop(test_case_id, None)
+            if case is None:
+                return
+            case.overhead += seconds
+            case.calls += 1
+            case.ended = ended
+            self._ended.setdefault(case.test_set_id, []).append(case)
+
+    def overhead(self, test_case_id):
+        """
+        Returns (seconds blocked in reporting calls, number of calls) of a running test case.
+        """
+        with self._lock:
+            case = self._running.get(test_case_id)
+            return (case.overhead, case.calls) if case is not None else (0.0, 0)
+
+    def summary(self, test_set_id):
+        """
+        Returns the name/value pairs published at the end of the test set, and forgets its test cases.
+        """
+        with self._lock:
+            cases = self._ended.pop(test_set_id, [])
+            for id, case in self._running.items():
+                if case.test_set_id == test_set_id:
+                    del self._running[id]
+        if not cases:
+            return []
+
+        overhead = sum(case.overhead for case in cases)
+        duration = sum(case.ended - case.started for case in cases)
+        pairs = [
+            ("reporting_overhead_seconds", "{0:.3f}".format(overhead)),
+            ("reporting_overhead_percent", "{0:.1f}".format(100 * overhead / duration if duration else 0)),
+            ("reporting_calls", sum(case.calls for case in cases)),
+            ("test_case_seconds", "{0:.3f}".format(duration)),
+        ]
+        slowest = sorted(cases, key=lambda case: case.overhead, reverse=True)[:self.slowest]
+        for rank, case in enumerate(slowest, 1):
+            duration = case.ended - case.started
+            pairs.append(("reporting_overhead_slowest_{0}".format(rank),
+                          "{0} ({1}): {2:.3f}s of {3:.3f}s ({4:.1f}%), {5} calls".format(
+                              case.name, case.id, case.overhead, duration,
+                              100 * case.overhead / duration if duration else 0, case.calls)))
+        return pairs
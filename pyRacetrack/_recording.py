@@ -0,0 +1,122 @@
+import json
+import os
+import shutil
+import threading
+import time
+
+from _multipart import form_fields
+
+
+# Calls whose response is an ID used by later calls, the load generator maps them to the IDs of the target server.
+ID_METHODS = ("TestSetBegin.php", "TestCaseBegin.php", "TestSetData.php")
+
+
+class Recorder(object):
+    """
+    Records the calls of a Racetrack object, in the order and with the timing they were made, for the load generator
+    (python -m pyRacetrack.load).
+
+    The recording holds one JSON line per call: {"seq", "offset" (seconds since the first call), "seconds" (time the
+    caller was blocked), "thread", "method", "params", "files", "result", "error"}, where "files" maps the form field
+    to {"name", "size", "copy"}. The first line is {"version": 1, "url": ..., "started": ...}.
+    Recording never fails a call: the calls which could not be recorded are counted in 'errors'.
+    """
+
+    def __init__(self, path, url, attachments=False):
+        """
+        :param path: (str) Recording file, overwritten.
+
+        :param url: (str) Racetrack URL the calls are made to.
+
+        :param attachments: (bool) Copy the screenshots and logs into '<path>.files/'. Otherwise only their size is
+         recorded and the load generator sends as many zero bytes.
+         Default: False
+        """
+        self.path = path
+        self.attachments = attachments
+        self.files_path = path + ".files"
+        self.errors = 0
+        self.last_error = None
+        self._seq = 0
+        self._started = None
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb')
+        self._write({"version": 1, "url": url, "started": time.time()})
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, separators=(',', ':'), default=str) + "\n")
+        self._file.flush()
+
+    def start(self, method, parameters, files):
+        """
+        Called before the call is made, returns the entry passed to finish(), None if the call cannot be recorded.
+        """
+        try:
+            return self._start(method, parameters, files)
+        except Exception as err:
+            self._error(err)
+            return None
+
+    def _start(self, method, parameters, files):
+        now = time.time()
+        with self._lock:
+            if self._started is None:
+                self._started = now
+            self._seq += 1
+            seq = self._seq
+
+        recorded = {}
+        for field, attachment in files.iteritems():
+            copy = None
+            if self.attachments:
+                if not os.path.isdir(self.files_path):
+                    os.makedirs(self.files_path)
+                copy = "{0}-{1}".format(seq, field)
+                with attachment.open() as src, open(os.path.join(self.files_path, copy), 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+            recorded[field] = {"name": attachment.name, "size": attachment.size, "copy": copy}
+
+        return {
+            "seq": seq,
+            "offset": now - self._started,
+            "thread": threading.current_thread().name,
+            "method": method,
+            "params": form_fields(parameters),
+            "files": recorded,
+            "_start": now,
+        }
+
+    def finish(self, entry, result=None, error=None):
+        if entry is None:
+            return
+        entry["seconds"] = time.time() - entry.pop("_start")
+        entry["result"] = result if entry["method"] in ID_METHODS else None
+        entry["error"] = None if error is None else repr(error)
+        with self._lock:
+            if self._file.closed:
+                return
+            try:
+                self._write(entry)
+            except Exception as err:
+                self.errors += 1
+                self.last_error = err
+
+    def _error(self, err):
+        with self._lock:
+            self.errors += 1
+            self.last_error = err
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read(path):
+    """
+    Returns the header and the entries of a recording, in the order the calls were made.
+    """
+    with open(path, 'rb') as fh:
+        header = json.loads(fh.readline())
+        entries = [json.loads(line) for line in fh if line.strip()]
+    entries.sort(key=lambda entry: entry["seq"])
+    return header, entries
@@ -0,0 +1,286 @@
+import Queue
+import atexit
+import json
+import os
+import shutil
+import threading
+import time
+import urlparse
+
+from _multipart import CHUNK_SIZE, Attachment, MultipartEncoder, form_fields
+
+# Parameters holding the ID of a test set or test case, these are rewritten from placeholder to real ID on replay.
+ID_PARAMETERS = ("ID", "ResultSetID", "ResultID")
+
+PLACEHOLDER_PREFIX = "@"
+
+
+class SpoolError(Exception):
+
+    def __init__(self, message, permanent=False):
+        super(SpoolError, self).__init__(message)
+        # The server rejected the call itself, sending it again will not help.
+        self.permanent = permanent
+
+
+def is_placeholder(value):
+    return isinstance(value, basestring) and value.startswith(PLACEHOLDER_PREFIX)
+
+
+def post(transport, url, method, parameters, files, ids):
+    """
+    Sends one journal record, replacing placeholder IDs by the real ones found in 'ids'.
+    Returns the response content, raises SpoolError if the server did not accept the call.
+    """
+    parameters = dict(parameters)
+    for name in ID_PARAMETERS:
+        value = parameters.get(name)
+        if is_placeholder(value):
+            if ids.get(value) is None:
+                raise SpoolError("Placeholder '{0}' of {1} was never resolved.".format(value, method),
+                                 permanent=value in ids)
+            parameters[name] = ids[value]
+
+    uri = urlparse.urljoin(url, method)
+    headers = {"charset": "UTF-8"}
+    if files:
+        attachments = {}
+        for field, (name, path, temporary) in files.iteritems():
+            attachments[field] = Attachment(path, name)
+            attachments[field].temporary = temporary
+        body = MultipartEncoder(parameters, attachments)
+        headers["Content-Type"] = body.content_type
+        try:
+            response = transport.post(uri, data=body, headers=headers)
+        finally:
+            body.close()
+        if response.status_code == 200:
+            for attachment in attachments.itervalues():
+                attachment.close()
+    else:
+        response = transport.post(uri, data=parameters, headers=headers)
+
+    if response.status_code != 200:
+        raise SpoolError("{0} returned {1}: {2}".format(method, response.status_code, response.content),
+                         permanent=400 <= response.status_code < 500)
+    return response.content
+
+
+class Journal(object):
+    """
+    Append-only journal of Racetrack calls plus the acknowledgment file of the ones already sent.
+
+    The journal holds one JSON line per call: [seq, method, parameters, files], where 'files' maps the form field
+    to [basename, path, temporary]; temporary files are deleted once sent. Attachments passed in memory are
+    written to '<journal>.files/' as temporary files. A line holding a JSON object ({"url": ...}) sets the server of the records that follow.
+    '<journal>.ack' holds one [seq, response content] line per call the server accepted, the content is null for
+    calls the server rejected for good.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.ack_path = path + ".ack"
+
+    def records(self):
+        url = None
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'rb') as fh:
+            for line in fh:
+                if not line.endswith("\n"):
+                    # Torn write of a crashed process.
+                    break
+                record = json.loads(line)
+                if isinstance(record, dict):
+                    url = record["url"]
+                else:
+                    seq, method, parameters, files = record
+                    yield url, seq, method, parameters, files
+
+    def acknowledged(self):
+        """
+        Returns {seq: response content} of the calls already sent.
+        """
+        done = {}
+        if os.path.isfile(self.ack_path):
+            with open(self.ack_path, 'rb') as fh:
+                for line in fh:
+                    if line.endswith("\n"):
+                        seq, content = json.loads(line)
+                        done[seq] = content
+        return done
+
+
+class Spool(object):
+    """
+    Write-ahead spool: every call is appended to a local journal and returns immediately, a background thread
+    then sends the journal to the server in order, retrying while the server is unreachable.
+    Calls which return an ID (TestSetBegin, TestCaseBegin, TestSetData) return a placeholder instead,
+    it is replaced by the real ID when the call is sent.
+    Whatever could not be sent before the process ends stays in the journal, see pyRacetrack.replay.
+    """
+
+    def __init__(self, path, url, transport, drain_timeout=30, fsync=False, retry_interval=(1, 30)):
+        """
+        :param path: (str) Journal file. If it exists it is appended to, and the calls it holds which were not
+         sent yet are sent first.
+
+        :param url: (str) Racetrack server URL the calls are sent to.
+
+        :param transport: Transport used to send the calls.
+
+        :param drain_timeout: (float) Seconds close() and the interpreter exit wait for the journal to be sent.
+         Default: 30
+
+        :param fsync: (bool) fsync the journal after each call, survives power loss at a cost of milliseconds.
+         Default: False, the call is in the OS buffers when append() returns.
+
+        :param retry_interval: (tuple) Initial and maximum seconds to wait before re-sending a failed call.
+         Default: (1, 30)
+        """
+        self.journal = Journal(path)
+        self.url = url
+        self.transport = transport
+        self.drain_timeout = drain_timeout
+        self.fsync = fsync
+        self.retry_interval = retry_interval
+        self.ids = {}
+        self.last_error = None
+        self.rejected = 0
+
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._pending = 0
+        self._seq = 0
+
+        done = self.journal.acknowledged()
+        for record_url, seq, method, parameters, files in self.journal.records():
+            self._seq = max(self._seq, seq)
+            if seq in done:
+                self.ids[PLACEHOLDER_PREFIX + str(seq)] = done[seq]
+            else:
+                self._pending += 1
+                self._queue.put((record_url, seq, method, parameters, files))
+
+        self._condition = threading.Condition()
+        self._closed = False
+        self._stop = threading.Event()
+        self._journal = open(self.journal.path, 'ab')
+        self._ack = open(self.journal.ack_path, 'ab')
+        self._write(json.dumps({"url": url}))
+
+        self._thread = threading.Thread(target=self._drain, name="RacetrackSpool")
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _write(self, line):
+        self._journal.write(line + "\n")
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def append(self, method, parameters, files):
+        """
+        Journals one call and returns its placeholder ID.
+        """
+        # As they would be sent, any value can be journaled.
+        parameters = form_fields(parameters)
+        with self._lock:
+            if self._closed:
+                raise SpoolError("Spool '{0}' is closed.".format(self.journal.path))
+            self._seq += 1
+            seq = self._seq
+            files = dict((field, self._journal_file(seq, field, attachment))
+                         for field, attachment in files.iteritems())
+            self._write(json.dumps([seq, method, parameters, files], separators=(',', ':')))
+            with self._condition:
+                self._pending += 1
+            self._queue.put((self.url, seq, method, parameters, files))
+        return PLACEHOLDER_PREFIX + str(seq)
+
+    def _journal_file(self, seq, field, attachment):
+        if attachment.path is not None:
+            return attachment.name, os.path.abspath(attachment.path), attachment.temporary
+        # In memory, the journal needs it on disk to survive the process.
+        files_path = self.journal.path + ".files"
+        if not os.path.isdir(files_path):
+            os.makedirs(files_path)
+        path = os.path.abspath(os.path.join(files_path, "{0}-{1}".format(seq, field)))
+        with attachment.open() as src, open(path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        return attachment.name, path, True
+
+    @property
+    def depth(self):
+        """
+        Number of calls appended but not sent yet.
+        """
+        with self._condition:
+            return self._pending
+
+    def resolve(self, id):
+        """
+        Returns the real ID of a placeholder if its call was sent already, the given value otherwise.
+        """
+        return self.ids.get(id, id)
+
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._pending:
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """
+        Waits up to 'timeout' (default: drain_timeout) seconds for the journal to be sent and stops sending.
+        """
+        with self._lock:
+            if self._closed:
+                return True
+            self._closed = True
+        flushed = self.flush(self.drain_timeout if timeout is None else timeout)
+        self._stop.set()
+        self._queue.put(None)
+        self._thread.join(1)
+        self._journal.close()
+        return flushed
+
+    def _drain(self):
+        while True:
+            item = self._queue.get()
+            if item is None or self._stop.is_set():
+                break
+            url, seq, method, parameters, files = item
+            wait = self.retry_interval[0]
+            while True:
+                try:
+                    content = post(self.transport, url, method, parameters, files, self.ids)
+                    break
+                except SpoolError as err:
+                    self.last_error = err
+                    if err.permanent:
+                        self.rejected += 1
+                        content = None
+                        break
+                except Exception as err:
+                    self.last_error = err
+                if self._stop.wait(wait):
+                    self._ack.close()
+                    return
+                wait = min(wait * 2, self.retry_interval[1])
+
+            self.ids[PLACEHOLDER_PREFIX + str(seq)] = content
+            self._ack.write(json.dumps([seq, content]) + "\n")
+            self._ack.flush()
+            with self._condition:
+                self._pending -= 1
+                self._condition.notify_all()
+        self._ack.close()
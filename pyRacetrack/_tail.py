@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+
+from _multipart import BufferAttachment
+
+
+class LogTail(object):
+    """
+    Follows a growing log file and uploads what is appended to it to a test case, in numbered parts, see
+    Racetrack.tail_log. The last part is uploaded when the test case ends, or by stop().
+    """
+
+    def __init__(self, racetrack, path, result_id, description=None, interval=10, chunk_size=1024 * 1024, poll=1.0,
+                 from_start=True):
+        """
+        :param racetrack: (Racetrack) Object the parts are uploaded with.
+
+        :param path: (str) Log file, it does not need to exist yet.
+
+        :param result_id: Test case the parts are attached to.
+
+        :param description: (str) Description of the parts, followed by their number.
+         Default: None, the file name.
+
+        :param interval: (float) Maximum seconds new content waits before it is uploaded.
+         Default: 10
+
+        :param chunk_size: (int) Size from which new content is uploaded without waiting, and maximum size of a part.
+         Default: 1048576
+
+        :param poll: (float) Seconds between two checks of the file.
+         Default: 1.0
+
+        :param from_start: (bool) Upload the content already in the file, otherwise only what is appended.
+         Default: True
+        """
+        self.racetrack = racetrack
+        self.path = path
+        self.result_id = result_id
+        self.description = description or os.path.basename(path)
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.poll = poll
+        self.parts = 0
+        self.bytes = 0
+        self.errors = 0
+        self.last_error = None
+
+        self._position = 0
+        if not from_start and os.path.isfile(path):
+            self._position = os.path.getsize(path)
+        self._pending = []
+        self._size = 0
+        self._flushed = time.time()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._stopped = False
+
+        racetrack.add_test_case_end_hook(self._test_case_end)
+        self._thread = threading.Thread(target=self._watch, name="RacetrackLogTail")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _read(self):
+        """
+        Adds what was appended to the file since the last read to the pending content, at most 'chunk_size' bytes.
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            # Not created yet, or rotated away.
+            return False
+        if size < self._position:
+            # Truncated or replaced, follow the new content.
+            self._position = 0
+        if size == self._position:
+            return False
+        with open(self.path, 'rb') as fh:
+            fh.seek(self._position)
+            data = fh.read(min(size - self._position, self.chunk_size))
+        self._position += len(data)
+        self._pending.append(data)
+        self._size += len(data)
+        return True
+
+    def _upload(self, final=False):
+        """
+        Uploads the pending content which is due: parts of 'chunk_size', what waited 'interval' seconds, or
+        everything when 'final'. Parts end on a line boundary unless they are 'chunk_size' or final.
+        """
+        while self._size:
+            if self._size < self.chunk_size and not final and time.time() - self._flushed < self.interval:
+                return
+            data = "".join(self._pending)
+            end = min(len(data), self.chunk_size)
+            if not final or end < len(data):
+                newline = data.rfind("\n", 0, end)
+                if newline >= 0:
+                    end = newline + 1
+            self._send(data[:end])
+            self._pending = [data[end:]] if end < len(data) else []
+            self._size = len(data) - end
+            self._flushed = time.time()
+            if not final and self._size < self.chunk_size:
+                # The rest is a line still being written.
+                return
+
+    def _send(self, data):
+        number = self.parts + 1
+        root, extension = os.path.splitext(os.path.basename(self.path))
+        self.racetrack._post("TestCaseLog.php", parameters={
+            'ResultID': self.result_id,
+            'Description': "{0} (part {1})".format(self.description, number),
+            'Log': BufferAttachment(data, "{0}.part{1:03d}{2}".format(root, number, extension or ".log"))
+        })
+        self.parts = number
+        self.bytes += len(data)
+
+    def _watch(self):
+        while not self._stop.wait(self.poll):
+            with self._lock:
+                if self._stopped:
+                    return
+                try:
+                    while self._read() and self._size < self.chunk_size:
+                        pass
+                    self._upload()
+                except Exception as err:
+                    # Kept pending, uploaded again at the next check.
+                    self.errors += 1
+                    self.last_error = err
+                    if self.racetrack.logger is not None:
+                        self.racetrack.logger.error("[Racetrack]: Tail of '{0}' failed: {1!r}".format(self.path, err))
+
+    def _test_case_end(self, test_case_id):
+        if test_case_id == self.result_id:
+            self.stop()
+
+    def stop(self):
+        """
+        Stops following the file and uploads what was not uploaded yet. An upload which fails is counted in 'errors'
+        and logged, what it held is not uploaded.
+        """
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+        self._stop.set()
+        self._thread.join()
+        self.racetrack.remove_test_case_end_hook(self._test_case_end)
+        if self in self.racetrack._tails:
+            self.racetrack._tails.remove(self)
+        try:
+            while self._read():
+                if self._size >= self.chunk_size:
+                    self._upload(final=True)
+            self._upload(final=True)
+        except Exception as err:
+            self.errors += 1
+            self.last_error = err
+            if self.racetrack.logger is not None:
+                self.racetrack.logger.error("[Racetrack]: Last upload of the tail of '{0}' failed: {1!r}".format(
+                    self.path, err))
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "parts": self.parts,
+            "bytes": self.bytes,
+            "pending": self._size,
+            "errors": self.errors,
+        }
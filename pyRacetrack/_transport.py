@@ -0,0 +1,431 @@
+import random
+import socket
+import threading
+import time
+import urlparse
+import warnings
+
+# Calls which may be sent twice without changing the outcome, they are retried after a timeout or a 5xx response.
+IDEMPOTENT_METHODS = ("TestSetUpdate.php", "TestSetEnd.php", "TestCaseUpdate.php", "TestCaseEnd.php")
+
+DEFAULT_TIMEOUT = (10, 120)
+
+# Uploads get more time to read the response, the server only answers once the whole file is stored.
+DEFAULT_TIMEOUTS = {
+    "TestCaseLog.php": (10, 600),
+    "TestCaseScreenshot.php": (10, 600),
+}
+
+
+def server_url(server, port=443):
+    """
+    Returns the base URL of a Racetrack server given by name and port, or by URL.
+    """
+    if server.startswith("http"):
+        return server
+    return "http{0}://{1}".format(("s" if port == 443 else ""), server)
+
+
+class TransportError(IOError):
+    pass
+
+
+class ServerError(TransportError):
+
+    def __init__(self, method, status_code, content):
+        super(ServerError, self).__init__("{0} returned {1}: {2}".format(method, status_code, content))
+        self.method = method
+        self.status_code = status_code
+        self.content = content
+
+
+class CircuitOpenError(TransportError):
+    pass
+
+
+class ConnectError(TransportError):
+    """
+    The connection to the server could not be established, nothing was sent.
+    """
+
+
+class CircuitBreaker(object):
+    """
+    Stops sending requests once the server is clearly down, instead of paying a full timeout on every call.
+    After 'failure_threshold' consecutive failures the circuit opens and calls fail at once; 'reset_timeout'
+    seconds later a single trial call is let through (half-open), its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.state == self.OPEN and time.time() - self._opened_at < self.reset_timeout
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN and time.time() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial = False
+            if self.state == self.HALF_OPEN:
+                if self._trial:
+                    return False
+                self._trial = True
+                return True
+            return self.state == self.CLOSED
+
+    def success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and
+                                                self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened += 1
+                self._opened_at = time.time()
+
+
+def _not_sent(err):
+    """
+    True if the request failed before reaching the server, so any call can be sent again.
+    """
+    import requests
+    from requests.packages.urllib3.exceptions import MaxRetryError, NewConnectionError
+
+    if isinstance(err, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(err, requests.exceptions.ConnectionError) and err.args:
+        reason = err.args[0]
+        return isinstance(reason, MaxRetryError) and isinstance(reason.reason, NewConnectionError)
+    return False
+
+
+class HTTPTransport(object):
+    """
+    Persistent, pooled HTTP transport used by Racetrack to talk to the Racetrack WebServices.
+    A single requests.Session is kept for the lifetime of the transport so that TCP connections (and TLS sessions,
+    for port 443) are re-used across calls instead of being re-established for every comment/verify/log.
+    requests is imported by the first call, not with the module.
+    """
+
+    def __init__(self, pool_size=10, timeout=DEFAULT_TIMEOUT, keep_alive=True, verify=True, timeouts=None,
+                 retries=2, backoff=(0.5, 8), idempotent=IDEMPOTENT_METHODS, breaker=None,
+                 metrics=None):
+        """
+        :param pool_size: (int) Maximum number of connections kept open per host.
+         Default: 10
+
+        :param timeout: (float or tuple) Connect/read timeout in seconds, either one value for both or a
+         (connect, read) tuple. None waits forever.
+         Default: (10, 120)
+
+        :param keep_alive: (bool) Keep connections open between calls.
+         Default: True
+
+        :param verify: (bool or str) SSL certificate verification, passed through to requests.
+         Default: True
+
+        :param timeouts: (dict) Timeout per method (e.g. "TestCaseLog.php"), overriding 'timeout'.
+         Default: None, longer read timeouts for TestCaseLog.php and TestCaseScreenshot.php.
+
+        :param retries: (int) Number of times a call is sent again. Any call is retried when it could not reach the
+         server; calls in 'idempotent' also after a timeout or a 5xx response.
+         Default: 2
+
+        :param backoff: (tuple) Base and maximum seconds of the jittered exponential delay between retries.
+         Default: (0.5, 8)
+
+        :param idempotent: (tuple) Methods which are safe to send twice.
+         Default: IDEMPOTENT_METHODS
+
+        :param breaker: (CircuitBreaker) Fails calls at once while the server is down.
+         Default: None
+
+        :param metrics: (Metrics) Records the duration, size and outcome of every call.
+         Default: None
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.verify = verify
+        self.timeouts = dict(DEFAULT_TIMEOUTS if timeouts is None else timeouts)
+        self.retries = retries
+        self.backoff = backoff
+        self.idempotent = idempotent
+        self.breaker = breaker
+        self.metrics = metrics
+        self.retried = 0
+        self.failed = 0
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers["Connection"] = "keep-alive" if self.keep_alive else "close"
+                session.verify = self.verify
+                if not self.verify:
+                    from requests.packages.urllib3.exceptions import InsecureRequestWarning
+                    # Asked for, not worth a warning on every call.
+                    warnings.filterwarnings("ignore", category=InsecureRequestWarning)
+                self._session = session
+            return self._session
+
+    def _request(self, uri, data, files, headers, timeout):
+        return self.session.post(uri, data=data, files=files, headers=headers, timeout=timeout)
+
+    def _errors(self):
+        """
+        Exceptions of a request which did not get a response.
+        """
+        import requests
+        return requests.exceptions.RequestException
+
+    def _not_sent(self, err):
+        return _not_sent(err)
+
+    def _sent(self, response):
+        return int(response.request.headers.get("Content-Length", 0))
+
+    def post(self, uri, data=None, files=None, headers=None, timeout=None):
+        """
+        Returns the response, whatever its status code. Raises CircuitOpenError without sending anything while the
+        circuit breaker is open, and the exception of the last attempt if none reached the server.
+        """
+        method = urlparse.urlsplit(uri).path.rsplit("/", 1)[-1]
+        if timeout is None:
+            timeout = self.timeouts.get(method, self.timeout)
+
+        if self.metrics is None:
+            return self._post(method, uri, data, files, headers, timeout)
+        start = time.time()
+        response = None
+        try:
+            response = self._post(method, uri, data, files, headers, timeout)
+            return response
+        finally:
+            sent = self._sent(response) if response is not None else 0
+            self.metrics.record(method, time.time() - start, sent,
+                                error=response is None or response.status_code != 200)
+
+    def _post(self, method, uri, data, files, headers, timeout):
+        idempotent = method in self.idempotent
+        errors = self._errors()
+        attempt = 0
+        while True:
+            if self.breaker is not None and not self.breaker.allow():
+                raise CircuitOpenError("Racetrack server is down, {0} was not sent.".format(method))
+            try:
+                response = self._request(uri, data, files, headers, timeout)
+            except errors as err:
+                if self.breaker is not None:
+                    self.breaker.failure()
+                if attempt >= self.retries or not (idempotent or self._not_sent(err)):
+                    self.failed += 1
+                    raise
+            else:
+                if response.status_code < 500:
+                    if self.breaker is not None:
+                        self.breaker.success()
+                    return response
+                if self.breaker is not None:
+                    self.breaker.failure()
+                if attempt >= self.retries or not idempotent:
+                    self.failed += 1
+                    return response
+
+            attempt += 1
+            self.retried += 1
+            if self.metrics is not None:
+                self.metrics.retry(method)
+            time.sleep(random.uniform(0, min(self.backoff[1], self.backoff[0] * 2 ** attempt)))
+            if hasattr(data, "rewind"):
+                data.rewind()
+
+    def stats(self):
+        stats = {"retried": self.retried, "failed": self.failed}
+        if self.breaker is not None:
+            stats.update(breaker_state=self.breaker.state, breaker_failures=self.breaker.failures,
+                         breaker_opened=self.breaker.opened)
+        return stats
+
+    def close(self):
+        with self._session_lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _utf8(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return str(value)
+
+
+def _form(data):
+    """
+    Returns the urlencoded body of the form fields 'data', skipping the None values as requests does.
+    """
+    import urllib
+
+    fields = []
+    for name, value in data.iteritems():
+        if value is None:
+            continue
+        for item in value if isinstance(value, (list, tuple)) else (value,):
+            fields.append((_utf8(name), _utf8(item)))
+    return urllib.urlencode(fields)
+
+
+class _Response(object):
+
+    def __init__(self, status_code, content, headers, sent):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.sent = sent
+
+
+class HTTPLibTransport(HTTPTransport):
+    """
+    HTTPTransport built on the standard library's httplib instead of requests, for small agents which should not
+    load requests: the same timeouts, retries, circuit breaker and metrics, over persistent connections.
+    Bodies are form fields (a dict) or a MultipartEncoder, 'files' is not supported.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Takes the arguments of HTTPTransport. 'pool_size' is the number of idle connections kept open per server,
+        'verify' a bool or the path of a CA bundle.
+        """
+        super(HTTPLibTransport, self).__init__(*args, **kwargs)
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._context = None
+
+    def _ssl_context(self):
+        if self._context is None:
+            import ssl
+
+            if self.verify is False:
+                self._context = ssl._create_unverified_context()
+            else:
+                self._context = ssl.create_default_context(cafile=self.verify if self.verify is not True else None)
+        return self._context
+
+    def _connection(self, scheme, host, timeout):
+        """
+        Returns an idle connection to 'host' and True, or a new one and False.
+        """
+        with self._lock:
+            idle = self._idle.get((scheme, host))
+            if idle:
+                return idle.pop(), True
+        import httplib
+
+        if scheme == "https":
+            connection = httplib.HTTPSConnection(host, timeout=timeout, context=self._ssl_context())
+        else:
+            connection = httplib.HTTPConnection(host, timeout=timeout)
+        try:
+            connection.connect()
+        except (socket.error, httplib.HTTPException) as err:
+            connection.close()
+            raise ConnectError("Cannot connect to {0}: {1}".format(host, err))
+        return connection, False
+
+    def _release(self, scheme, host, connection):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, host), [])
+            if len(idle) < self.pool_size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def _request(self, uri, data, files, headers, timeout):
+        import httplib
+
+        if files:
+            raise ValueError("HTTPLibTransport does not support 'files', send a MultipartEncoder as 'data'.")
+        parts = urlparse.urlsplit(uri)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+        headers = dict(headers or {})
+        headers["Connection"] = "keep-alive" if self.keep_alive else "close"
+        body = data
+        if isinstance(data, dict):
+            body = _form(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        sent = len(body) if body is not None else 0
+        headers["Content-Length"] = str(sent)
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+
+        while True:
+            connection, reused = self._connection(parts.scheme, parts.netloc, connect_timeout)
+            try:
+                connection.sock.settimeout(read_timeout)
+                connection.request("POST", path, body, headers)
+                response = connection.getresponse()
+                content = response.read()
+            except (socket.error, httplib.HTTPException) as err:
+                connection.close()
+                if reused and not isinstance(err, socket.timeout):
+                    # The server closed the idle connection, send the call on a new one.
+                    if hasattr(body, "rewind"):
+                        body.rewind()
+                    continue
+                raise
+            if self.keep_alive and not response.will_close:
+                self._release(parts.scheme, parts.netloc, connection)
+            else:
+                connection.close()
+            return _Response(response.status, content, dict(response.getheaders()), sent)
+
+    def _errors(self):
+        import httplib
+        return socket.error, httplib.HTTPException, ConnectError
+
+    def _not_sent(self, err):
+        return isinstance(err, ConnectError)
+
+    def _sent(self, response):
+        return response.sent
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.itervalues():
+            for connection in connections:
+                connection.close()
+
+
+HTTP_CLIENTS = {"requests": HTTPTransport, "httplib": HTTPLibTransport}
@@ -0,0 +1,275 @@
+"""
+Measures the client against a local stub Racetrack server (see pyRacetrack.stub).
+
+    python -m pyRacetrack.benchmark [--scenario comment_storm ...] [--calls 2000] [--latency 0.005]
+                                    [--error-rate 0.01] [--asynchronous] [--output results.json]
+                                    [--baseline previous.json [--tolerance 0.2]]
+
+Every scenario runs in its own process, which reports calls/s, the latency of the reporting calls (p50/p90/p99),
+its peak RSS and CPU time as JSON. With --baseline the exit status is 1 when a scenario got slower than the
+baseline by more than the tolerance or a scenario failed, so the benchmark can gate changes in CI.
+"""
+import Queue
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from pyRacetrack._base import Racetrack, RacetrackError
+from pyRacetrack._metrics import percentile
+from pyRacetrack.stub import StubServer
+
+
+SCENARIOS = OrderedDict()
+
+
+def _scenario(function):
+    SCENARIOS[function.__name__] = function
+    return function
+
+
+class _Recorder(object):
+    """
+    Times the reporting calls of a scenario and counts the failed ones.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, function, *args, **kwargs):
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        except (Exception, RacetrackError):
+            with self._lock:
+                self.errors += 1
+        finally:
+            with self._lock:
+                self.latencies.append(time.time() - start)
+
+    def until_ok(self, function, *args, **kwargs):
+        """
+        Calls a begin method until it returns an ID, injected errors included.
+        """
+        while True:
+            id = self(function, *args, **kwargs)
+            if id:
+                return id
+
+
+@_scenario
+def comment_storm(rt, test_set, call, options):
+    """
+    One test case with a stream of comments.
+    """
+    call.until_ok(rt.test_case_begin, "comment_storm", "benchmark")
+    for i in xrange(options.calls):
+        call(rt.comment, "Step {0}: clicked the button and waited for the dialog".format(i))
+    call(rt.test_case_end)
+
+
+@_scenario
+def verify_heavy(rt, test_set, call, options):
+    """
+    Test cases of 50 verifications each, one in ten failing.
+    """
+    for case in xrange(max(1, options.calls / 50)):
+        call.until_ok(rt.test_case_begin, "verify_heavy_{0}".format(case), "benchmark")
+        for i in xrange(50):
+            call(rt.verify, "Value {0}".format(i), i, i if i % 10 else -1)
+        call(rt.test_case_end)
+
+
+@_scenario
+def large_logs(rt, test_set, call, options):
+    """
+    Log uploads of --log-size bytes, one per 100 calls.
+    """
+    fd, path = tempfile.mkstemp(prefix="racetrack-benchmark-", suffix=".log")
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            line = "2017-01-01 00:00:00 INFO Lorem ipsum dolor sit amet, consectetur adipiscing elit.\n"
+            for _ in xrange(options.log_size / len(line) + 1):
+                fh.write(line)
+        call.until_ok(rt.test_case_begin, "large_logs", "benchmark")
+        for i in xrange(max(1, options.calls / 100)):
+            call(rt.log, "Log {0}".format(i), path)
+        call(rt.test_case_end)
+    finally:
+        os.remove(path)
+
+
+@_scenario
+def concurrent_cases(rt, test_set, call, options):
+    """
+    --threads threads running test cases of 20 comments and verifications at the same time.
+    """
+    cases = max(options.threads, options.calls / 20)
+
+    def work(thread):
+        for case in xrange(thread, cases, options.threads):
+            test_case = call.until_ok(test_set.test_case_begin, "concurrent_{0}".format(case), "benchmark")
+            for i in xrange(10):
+                call(test_case.comment, "Step {0}".format(i))
+                call(test_case.verify, "Value {0}".format(i), i, i)
+            call(test_case.end)
+
+    threads = [threading.Thread(target=work, args=(thread,)) for thread in xrange(options.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def _run_scenario(name, url, options, results):
+    """
+    Runs in a child process, so the peak RSS and CPU time are those of the scenario alone.
+    """
+    call = _Recorder()
+    with Racetrack(server=url, port=80, asynchronous=options.asynchronous, pool_size=options.threads) as rt:
+        test_set = call.until_ok(rt.test_set_begin, buildid=1, product="benchmark", description=name,
+                                 user="benchmark")
+        start = time.time()
+        SCENARIOS[name](rt, test_set, call, options)
+        rt.flush()
+        seconds = time.time() - start
+        call(rt.test_set_end)
+        if rt._dispatcher is not None:
+            # Calls which failed in the background.
+            call.errors += rt._dispatcher.errors
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    latencies = sorted(call.latencies)
+    results.put({
+        "scenario": name,
+        "calls": len(latencies),
+        "errors": call.errors,
+        "seconds": seconds,
+        "calls_per_second": len(latencies) / seconds if seconds else None,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": latencies[-1] if latencies else None,
+        # Kilobytes on Linux, bytes on OS X.
+        "peak_rss": usage.ru_maxrss,
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+    })
+
+
+def _result(name, process, queue, timeout):
+    """
+    Returns the result the scenario process puts on 'queue', or {"scenario", "error"} if it died or timed out first.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Queue.Empty:
+            pass
+        if not process.is_alive():
+            # Put just before exiting, or never.
+            try:
+                return queue.get(timeout=1)
+            except Queue.Empty:
+                return {"scenario": name, "error": "exited with {0} without a result".format(process.exitcode)}
+        if deadline is not None and time.time() > deadline:
+            process.terminate()
+            return {"scenario": name, "error": "timed out after {0} seconds".format(timeout)}
+
+
+def run(options, scenarios=None):
+    """
+    Runs the scenarios, each against a new stub server configured from 'options' (see main), returns their results.
+    The result of a scenario which failed holds its "error" instead of its measures.
+    """
+    results = []
+    for name in scenarios or SCENARIOS:
+        with StubServer(latency=options.latency, jitter=options.jitter, error_rate=options.error_rate,
+                        seed=options.seed) as server:
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_run_scenario, args=(name, server.url, options, queue))
+            process.start()
+            result = _result(name, process, queue, getattr(options, "timeout", None))
+            process.join()
+            if process.exitcode and "error" not in result:
+                result = {"scenario": name, "error": "exited with {0}".format(process.exitcode)}
+            result["server"] = server.stats()
+        results.append(result)
+    return results
+
+
+def regressions(results, baseline, tolerance=0.2):
+    """
+    Returns a message for each scenario whose calls/s dropped, or p99 latency rose, by more than 'tolerance'
+    compared with 'baseline' (results of an earlier run).
+    """
+    previous = dict((result["scenario"], result) for result in baseline)
+    messages = []
+    for result in results:
+        before = previous.get(result["scenario"])
+        if before is None or "error" in result or "error" in before:
+            continue
+        if result["calls_per_second"] < before["calls_per_second"] * (1 - tolerance):
+            messages.append("{0}: {1:.1f} calls/s, was {2:.1f}".format(
+                result["scenario"], result["calls_per_second"], before["calls_per_second"]))
+        if result["latency_p99"] > before["latency_p99"] * (1 + tolerance):
+            messages.append("{0}: p99 latency {1:.4f}s, was {2:.4f}s".format(
+                result["scenario"], result["latency_p99"], before["latency_p99"]))
+    return messages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pyRacetrack.benchmark",
+                                     description="Benchmarks the client against a local stub Racetrack server.")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS.keys(),
+                        help="Scenario to run, may be repeated (default: all)")
+    parser.add_argument("--calls", type=int, default=2000, help="Reporting calls per scenario (default: 2000)")
+    parser.add_argument("--threads", type=int, default=8, help="Threads of concurrent_cases (default: 8)")
+    parser.add_argument("--log-size", type=int, default=1024 * 1024, help="Bytes per log of large_logs "
+                                                                          "(default: 1048576)")
+    parser.add_argument("--asynchronous", action="store_true", help="Use Racetrack(asynchronous=True)")
+    parser.add_argument("--latency", type=float, default=0, help="Seconds the stub delays every answer by "
+                                                                 "(default: 0)")
+    parser.add_argument("--jitter", type=float, default=0, help="Up to this many seconds added to the latency "
+                                                                "(default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of the calls the stub fails "
+                                                                    "(default: 0)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the injected latency and errors (default: 0)")
+    parser.add_argument("--output", help="Write the results to this file instead of the standard output")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Slow-down tolerated by --baseline "
+                                                                     "(default: 0.2)")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds a scenario may run before it is "
+                                                                   "stopped and failed (default: 600)")
+    args = parser.parse_args(argv)
+
+    results = run(args, args.scenario)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(output + "\n")
+    else:
+        print output
+
+    failed = [result for result in results if "error" in result]
+    for result in failed:
+        print >> sys.stderr, "Failed: {0}: {1}".format(result["scenario"], result["error"])
+    if args.baseline:
+        with open(args.baseline) as fh:
+            messages = regressions(results, json.load(fh), args.tolerance)
+        for message in messages:
+            print >> sys.stderr, "Regression: {0}".format(message)
+        return 1 if messages or failed else 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
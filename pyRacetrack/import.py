@@ -0,0 +1,252 @@
+"""
+Imports JUnit/xUnit XML result files into a Racetrack test set.
+
+    python -m pyRacetrack.import <results.xml> [<results.xml> ...] --product NAME --buildid N --user NAME
+                                 [--description TEXT] [--server HOST] [--port 443] [--workers 8] [--progress FILE]
+
+The files are read incrementally, test cases are imported by --workers threads at once, each one with its failures,
+errors and skips in order and its system-out/system-err attached as logs. Failures are reported as FAIL, errors as
+SCRIPT and skipped test cases as UNSUPPORTED.
+
+The progress file (default: <first file>.progress) records the test set and every test case imported; running the
+same command again after a crash carries on in the same test set with the test cases not imported yet. A test case
+which fails to import after it was begun is ended as SCRIPT, with a comment giving the error, and recorded too so that
+it is not begun a second time.
+"""
+import Queue
+import argparse
+import json
+import os
+import sys
+import threading
+from xml.etree import ElementTree
+
+from pyRacetrack import Racetrack, TestSet, RESULT
+
+
+class _Case(object):
+
+    __slots__ = ("key", "suite", "classname", "name", "time", "events", "stdout", "stderr")
+
+    def __init__(self, key, suite, element):
+        self.key = key
+        self.suite = suite
+        self.classname = element.get("classname")
+        self.name = element.get("name")
+        self.time = element.get("time")
+        # (tag, type, message, text) of the failure/error/skipped children, in order.
+        self.events = []
+        self.stdout = None
+        self.stderr = None
+        for child in element:
+            if child.tag in ("failure", "error", "skipped"):
+                self.events.append((child.tag, child.get("type"), child.get("message"), child.text))
+            elif child.tag == "system-out":
+                self.stdout = child.text
+            elif child.tag == "system-err":
+                self.stderr = child.text
+
+    @property
+    def result(self):
+        tags = set(event[0] for event in self.events)
+        if "error" in tags:
+            return RESULT.script
+        if "failure" in tags:
+            return RESULT.fail
+        if "skipped" in tags:
+            return RESULT.unsupported
+        return RESULT.passs
+
+
+def cases(path):
+    """
+    Yields the test cases of a JUnit/xUnit file as they are read, the elements read are freed.
+    """
+    stack = []
+    suites = []
+    index = 0
+    for event, element in ElementTree.iterparse(path, events=("start", "end")):
+        if event == "start":
+            stack.append(element)
+            if element.tag == "testsuite":
+                suites.append(element.get("name"))
+            continue
+
+        stack.pop()
+        if element.tag == "testsuite":
+            suites.pop()
+        elif element.tag == "testcase":
+            yield _Case("{0}:{1}".format(os.path.abspath(path), index), suites[-1] if suites else None, element)
+            index += 1
+            if stack:
+                stack[-1].remove(element)
+
+
+class Progress(object):
+    """
+    Append-only record of an import: a {"test_set_id": ...} line, then one line per test case imported.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.test_set_id = None
+        self.done = set()
+        if os.path.isfile(path):
+            with open(path, 'rb') as fh:
+                for line in fh:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn last line.
+                        break
+                    if isinstance(record, dict):
+                        self.test_set_id = record["test_set_id"]
+                    else:
+                        self.done.add(record)
+        self._file = open(path, 'ab')
+        self._lock = threading.Lock()
+
+    def _write(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def started(self, test_set_id):
+        self.test_set_id = test_set_id
+        self._write({"test_set_id": test_set_id})
+
+    def imported(self, key):
+        self.done.add(key)
+        self._write(key)
+
+    def close(self):
+        self._file.close()
+
+
+class PartialImport(Exception):
+    """
+    A test case failed to import after it was begun: it was ended with a SCRIPT result and is not imported again.
+    """
+
+
+def _log(test_case, description, text):
+    if not text or not text.strip():
+        return
+    # In memory: with an asynchronous or spooling Racetrack the log is read after the call returned.
+    test_case.log(description, buffer(text.encode('utf-8') if isinstance(text, unicode) else text))
+
+
+def import_case(test_set, case):
+    name = "{0}.{1}".format(case.classname, case.name) if case.classname else case.name
+    test_case = test_set.test_case_begin(name, case.suite or case.classname or "JUnit")
+    try:
+        if case.time is not None:
+            test_case.comment("Duration: {0}s".format(case.time))
+        for tag, type, message, text in case.events:
+            description = ": ".join(part for part in (tag.capitalize(), type, message) if part)
+            if tag == "skipped":
+                test_case.comment(description)
+            else:
+                test_case.verify(description, actual=tag, expected="pass")
+            if text and text.strip():
+                test_case.comment(text)
+        _log(test_case, "system-out", case.stdout)
+        _log(test_case, "system-err", case.stderr)
+    except Exception as err:
+        # Not left open on the server, nor begun again by the next run.
+        try:
+            test_case.comment("Import failed: {0!r}".format(err))
+        except Exception:
+            pass
+        test_case.end(result=RESULT.script)
+        raise PartialImport("{0} was ended as {1}, part of it was not imported: {2!r}".format(
+            name, RESULT.script, err))
+    test_case.end(result=case.result)
+
+
+def import_files(racetrack, paths, progress, workers=8, **test_set):
+    """
+    Imports the test cases of 'paths' which 'progress' does not list yet, into its test set or a new one begun with
+    the 'test_set' arguments of Racetrack.test_set_begin. Returns (imported, failed).
+    """
+    if progress.test_set_id is None:
+        progress.started(racetrack.test_set_begin(**test_set).id)
+    handle = TestSet(racetrack, progress.test_set_id)
+
+    queue = Queue.Queue(maxsize=workers * 2)
+    counts = {"imported": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            case = queue.get()
+            if case is None:
+                return
+            try:
+                import_case(handle, case)
+            except PartialImport as err:
+                print >> sys.stderr, "Failed to import {0}: {1}".format(case.name, err)
+                progress.imported(case.key)
+                with lock:
+                    counts["failed"] += 1
+                continue
+            except Exception as err:
+                print >> sys.stderr, "Failed to import {0}: {1!r}".format(case.name, err)
+                with lock:
+                    counts["failed"] += 1
+                continue
+            progress.imported(case.key)
+            with lock:
+                counts["imported"] += 1
+
+    threads = [threading.Thread(target=work, name="RacetrackImport") for _ in xrange(workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        for path in paths:
+            for case in cases(path):
+                if case.key not in progress.done:
+                    queue.put(case)
+    finally:
+        for _ in threads:
+            queue.put(None)
+        for thread in threads:
+            thread.join()
+    return counts["imported"], counts["failed"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pyRacetrack.import",
+                                     description="Imports JUnit/xUnit XML result files into Racetrack.")
+    parser.add_argument("files", nargs="+", help="JUnit/xUnit XML files")
+    parser.add_argument("--product", required=True)
+    parser.add_argument("--buildid", required=True)
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--description", help="Test set description (default: the file names)")
+    parser.add_argument("--hostos")
+    parser.add_argument("--server", default="racetrack.eng.vmware.com",
+                        help="Racetrack server (default: racetrack.eng.vmware.com)")
+    parser.add_argument("--port", type=int, default=443, help="Racetrack port (default: 443)")
+    parser.add_argument("--workers", type=int, default=8, help="Test cases imported at once (default: 8)")
+    parser.add_argument("--progress", help="Progress file (default: <first file>.progress)")
+    parser.add_argument("--no-end", action="store_true", help="Leave the test set open")
+    args = parser.parse_args(argv)
+
+    progress = Progress(args.progress or args.files[0] + ".progress")
+    with Racetrack(server=args.server, port=args.port, pool_size=args.workers) as racetrack:
+        imported, failed = import_files(
+            racetrack, args.files, progress, workers=args.workers, buildid=args.buildid, product=args.product,
+            description=args.description or ", ".join(os.path.basename(path) for path in args.files),
+            user=args.user, hostos=args.hostos)
+        print "Test set: {0}".format(racetrack.get_test_set_url(progress.test_set_id))
+        print "Imported: {0}, failed: {1}, imported before: {2}".format(imported, failed,
+                                                                      len(progress.done) - imported)
+        if not failed and not args.no_end:
+            racetrack.test_set_end(id=progress.test_set_id)
+    progress.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""
+Plays sessions recorded with Racetrack(record=...) against a Racetrack server, faster than recorded and with more
+and more sessions at once, and reports the latency percentiles and error rate of the server at every step.
+
+    python -m pyRacetrack.load <recording> [<recording> ...] [--server URL] [--speed 10] [--concurrency 1,4,16]
+                               [--output results.json]
+
+At a step of concurrency N, N sessions are played at the same time, each one keeping the order and (divided by
+--speed) the timing of its recorded calls. The IDs returned by the server replace the recorded ones, so every
+played session creates its own test sets and test cases. Point --server at a stub (python -m pyRacetrack.stub) to
+check the client side first.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from pyRacetrack._metrics import percentile
+from pyRacetrack._recording import read
+from pyRacetrack._spool import ID_PARAMETERS, post
+from pyRacetrack._transport import HTTPTransport
+
+
+class _Zeros(object):
+    """
+    Sparse files of zero bytes sent in place of the attachments recorded without their content.
+    """
+
+    def __init__(self):
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, size):
+        with self._lock:
+            path = self._paths.get(size)
+            if path is None:
+                fd, path = tempfile.mkstemp(prefix="racetrack-load-")
+                with os.fdopen(fd, 'wb') as fh:
+                    fh.truncate(size)
+                self._paths[size] = path
+            return path
+
+    def close(self):
+        for path in self._paths.itervalues():
+            os.remove(path)
+        self._paths.clear()
+
+
+class _Step(object):
+    """
+    Latencies and errors of the calls made at one concurrency.
+    """
+
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.latencies = []
+        self.errors = 0
+        self.methods = {}
+        self._lock = threading.Lock()
+
+    def add(self, method, seconds, error):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.errors += error is not None
+            calls, errors = self.methods.get(method, (0, 0))
+            self.methods[method] = (calls + 1, errors + (error is not None))
+
+    def result(self, seconds):
+        latencies = sorted(self.latencies)
+        return {
+            "concurrency": self.concurrency,
+            "calls": len(latencies),
+            "errors": self.errors,
+            "error_rate": float(self.errors) / len(latencies) if latencies else 0,
+            "seconds": seconds,
+            "calls_per_second": len(latencies) / seconds if seconds else None,
+            "latency_p50": percentile(latencies, 50),
+            "latency_p90": percentile(latencies, 90),
+            "latency_p99": percentile(latencies, 99),
+            "latency_max": latencies[-1] if latencies else None,
+            "methods": dict((method, {"calls": calls, "errors": errors})
+                            for method, (calls, errors) in self.methods.iteritems()),
+        }
+
+
+def _play(recording, url, transport, speed, step, zeros):
+    header, entries, files_path = recording
+    url = url or header["url"]
+    ids = {}
+    start = time.time()
+    for entry in entries:
+        delay = start + entry["offset"] / speed - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+        parameters = dict(entry["params"])
+        for name in ID_PARAMETERS:
+            if name in parameters and unicode(parameters[name]) in ids:
+                parameters[name] = ids[unicode(parameters[name])]
+        files = {}
+        for field, recorded in entry["files"].iteritems():
+            path = os.path.join(files_path, recorded["copy"]) if recorded["copy"] else zeros(recorded["size"])
+            files[field] = (recorded["name"], path, False)
+
+        sent = time.time()
+        try:
+            content = post(transport, url, entry["method"], parameters, files, {})
+        except Exception as err:
+            step.add(entry["method"], time.time() - sent, err)
+            continue
+        step.add(entry["method"], time.time() - sent, None)
+        if entry["result"] is not None:
+            ids[unicode(entry["result"])] = content
+
+
+def load(recordings, server=None, speed=1.0, concurrency=(1,), transport=None):
+    """
+    Plays the recordings at every concurrency in turn, returns the results of every step.
+
+    :param recordings: (list) Recording files, the sessions of a step are taken from them in turn.
+    :param server: (str) Racetrack URL, overrides the one recorded.
+    :param speed: (float) Multiple of the recorded speed.
+    :param concurrency: (list) Number of sessions played at once, per step.
+    :param transport: Transport the calls are sent with, shared by the sessions.
+     Default: None, an HTTPTransport without retries and pooling as many connections as the largest step.
+    """
+    sessions = [read(path) + (path + ".files",) for path in recordings]
+    owns_transport = transport is None
+    if transport is None:
+        transport = HTTPTransport(pool_size=max(concurrency), retries=0)
+    zeros = _Zeros()
+    results = []
+    try:
+        for sessions_at_once in concurrency:
+            step = _Step(sessions_at_once)
+            threads = [threading.Thread(target=_play, args=(sessions[i % len(sessions)], server, transport, speed,
+                                                            step, zeros))
+                       for i in xrange(sessions_at_once)]
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results.append(step.result(time.time() - start))
+    finally:
+        zeros.close()
+        if owns_transport:
+            transport.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pyRacetrack.load",
+                                     description="Plays recorded Racetrack sessions against a server under "
+                                                 "increasing load.")
+    parser.add_argument("recordings", nargs="+", help="Files written by Racetrack(record=...)")
+    parser.add_argument("--server", help="Racetrack URL, overrides the one recorded")
+    parser.add_argument("--speed", type=float, default=1.0, help="Multiple of the recorded speed (default: 1)")
+    parser.add_argument("--concurrency", default="1,2,4,8,16",
+                        help="Sessions played at once, per step (default: 1,2,4,8,16)")
+    parser.add_argument("--output", help="Also write the results of every step to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = load(args.recordings, server=args.server, speed=args.speed,
+                   concurrency=[int(value) for value in args.concurrency.split(",")])
+    print "{0:>11} {1:>8} {2:>10} {3:>10} {4:>9} {5:>9} {6:>9}".format(
+        "concurrency", "calls", "error rate", "calls/s", "p50 (ms)", "p90 (ms)", "p99 (ms)")
+    for result in results:
+        print "{0:>11} {1:>8} {2:>9.2%} {3:>10.1f} {4:>9.1f} {5:>9.1f} {6:>9.1f}".format(
+            result["concurrency"], result["calls"], result["error_rate"], result["calls_per_second"] or 0,
+            1000 * (result["latency_p50"] or 0), 1000 * (result["latency_p90"] or 0),
+            1000 * (result["latency_p99"] or 0))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Sends the calls of a spool journal which did not reach the Racetrack server yet.
+
+    python -m pyRacetrack.replay <journal> [--server URL] [--workers N]
+
+Test sets are replayed in parallel, the calls of one test set in the order they were made.
+Replaying the same journal again only sends what is still missing.
+"""
+import Queue
+import argparse
+import json
+import sys
+import threading
+from collections import OrderedDict
+
+from pyRacetrack._spool import Journal, SpoolError, ID_PARAMETERS, PLACEHOLDER_PREFIX, post
+from pyRacetrack._transport import HTTPTransport
+
+
+def _runs(journal, done):
+    """
+    Groups the calls not sent yet by test set, each test set starts with its TestSetBegin.
+    """
+    owner = {}
+    runs = OrderedDict()
+    for url, seq, method, parameters, files in journal.records():
+        placeholder = PLACEHOLDER_PREFIX + str(seq)
+        if method == "TestSetBegin.php":
+            run = placeholder
+        else:
+            reference = next((parameters[name] for name in ID_PARAMETERS if parameters.get(name)), None)
+            run = owner.get(reference, reference)
+        owner[placeholder] = run
+        if seq not in done:
+            runs.setdefault(run, []).append((url, seq, method, parameters, files))
+    return runs
+
+
+def replay(path, transport=None, server=None, workers=4):
+    """
+    Sends the calls of the journal 'path' which were not acknowledged yet.
+
+    :param transport: Transport used to send the calls. Default: None, a pooled HTTPTransport is created.
+    :param server: (str) Racetrack URL overriding the one recorded in the journal.
+    :param workers: (int) Number of test sets replayed at the same time.
+    :return: (tuple) Number of calls sent, number of calls rejected by the server, list of errors of the test sets
+     which could not be replayed completely.
+    """
+    journal = Journal(path)
+    done = journal.acknowledged()
+    ids = dict((PLACEHOLDER_PREFIX + str(seq), content) for seq, content in done.iteritems())
+    runs = Queue.Queue()
+    for calls in _runs(journal, done).itervalues():
+        runs.put(calls)
+
+    own_transport = transport is None
+    if own_transport:
+        transport = HTTPTransport(pool_size=workers)
+
+    lock = threading.Lock()
+    counts = {"sent": 0, "rejected": 0}
+    errors = []
+
+    with open(journal.ack_path, 'ab') as ack:
+        def work():
+            while True:
+                try:
+                    calls = runs.get_nowait()
+                except Queue.Empty:
+                    return
+                for url, seq, method, parameters, files in calls:
+                    try:
+                        content = post(transport, server or url, method, parameters, files, ids)
+                    except SpoolError as err:
+                        if not err.permanent:
+                            errors.append(err)
+                            break
+                        content = None
+                    except Exception as err:
+                        errors.append(err)
+                        break
+                    ids[PLACEHOLDER_PREFIX + str(seq)] = content
+                    with lock:
+                        counts["sent" if content is not None else "rejected"] += 1
+                        ack.write(json.dumps([seq, content]) + "\n")
+                        ack.flush()
+
+        threads = [threading.Thread(target=work) for _ in xrange(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    if own_transport:
+        transport.close()
+    return counts["sent"], counts["rejected"], errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pyRacetrack.replay",
+                                     description="Sends the spooled Racetrack calls of a journal.")
+    parser.add_argument("journal", help="Journal file written by Racetrack(spool=...)")
+    parser.add_argument("--server", help="Racetrack URL, overrides the one recorded in the journal")
+    parser.add_argument("--workers", type=int, default=4, help="Test sets replayed in parallel (default: 4)")
+    args = parser.parse_args(argv)
+
+    sent, rejected, errors = replay(args.journal, server=args.server, workers=args.workers)
+    print "Sent: {0}, rejected by the server: {1}".format(sent, rejected)
+    for err in errors:
+        print >> sys.stderr, "Failed: {0}".format(err)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,542 @@
+"""
+Local daemon sending the Racetrack calls of all the test processes of a host over one pool of connections.
+
+    python -m pyRacetrack.sidecar [--socket /tmp/racetrack.sock] [--connections 8]
+
+Test processes use it with Racetrack(sidecar="/tmp/racetrack.sock"). Only the calls whose response is needed
+(TestSetBegin, TestCaseBegin, TestSetData) wait for the server, the others return as soon as the sidecar has them.
+The calls of a process are sent in the order they were made; the calls a process made before it died are still sent.
+The Racetrack API has one request per call and no batch endpoint, so the calls are not batched into fewer requests:
+they are sent back to back over the sidecar's pooled keep-alive connections instead.
+
+The failures of the calls which return at once are sent back to the process, which counts them (see
+SidecarTransport.stats()), and with --journal the sidecar appends these calls to a file, in the protocol below, from
+which --resend sends them again.
+
+Protocol, over a Unix domain socket: every call is a frame, a 4 bytes big-endian length followed by a JSON header
+{"id", "uri", "headers", "params", "body", "reply"}, then "body" bytes of request body when "params" is null. The
+sidecar answers the calls with "reply" set, and the other calls which failed, by a frame holding {"id", "status",
+"content"}.
+"""
+import Queue
+import itertools
+import json
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+import urlparse
+
+from pyRacetrack._multipart import CHUNK_SIZE
+from pyRacetrack._transport import HTTPTransport, _form
+
+
+DEFAULT_SOCKET = "/tmp/racetrack.sock"
+
+# Calls whose response the caller needs, the others are acknowledged as soon as the sidecar has them.
+REPLY_METHODS = ("TestSetBegin.php", "TestCaseBegin.php", "TestSetData.php")
+
+# Request bodies up to this size are kept in memory by the sidecar, larger ones in a temporary file.
+BODY_IN_MEMORY = 1024 * 1024
+
+_LENGTH = struct.Struct("!I")
+
+
+def _read(fh, size):
+    """
+    Returns 'size' bytes, or None if the connection ended first.
+    """
+    data = fh.read(size)
+    if len(data) < size:
+        return None
+    return data
+
+
+def _read_frame(fh):
+    length = _read(fh, _LENGTH.size)
+    if length is None:
+        return None
+    return _read(fh, _LENGTH.unpack(length)[0])
+
+
+def _frame(payload):
+    return _LENGTH.pack(len(payload)) + payload
+
+
+class _Response(object):
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+
+class SidecarTransport(object):
+    """
+    Transport sending the calls through the sidecar instead of connecting to the server, see Racetrack(sidecar=...).
+    The calls of all the threads go through one connection, in the order they are made. The calls which return at
+    once and then fail in the sidecar are counted in 'failed', the last one in 'last_failure'.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET, timeout=None):
+        """
+        :param path: (str) Unix socket of the sidecar.
+         Default: DEFAULT_SOCKET
+
+        :param timeout: (float) Seconds a call waits for its response, None waits forever.
+         Default: None
+        """
+        self.path = path
+        self.timeout = timeout
+        self._socket = None
+        self._ids = itertools.count(1)
+        self._send_lock = threading.Lock()
+        self._condition = threading.Condition()
+        # Id of the calls waiting for their reply to the socket they were sent on, and the replies received.
+        self._waiting = {}
+        self._replies = {}
+        self.failed = 0
+        self.last_failure = None
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        thread = threading.Thread(target=self._read_replies, args=(sock,), name="RacetrackSidecarClient")
+        thread.daemon = True
+        thread.start()
+        return sock
+
+    def _read_replies(self, sock):
+        fh = sock.makefile('rb')
+        try:
+            while True:
+                frame = _read_frame(fh)
+                if frame is None:
+                    break
+                reply = json.loads(frame)
+                with self._condition:
+                    if reply["id"] in self._waiting:
+                        self._replies[reply["id"]] = reply
+                        self._condition.notify_all()
+                    elif reply["status"] != 200:
+                        # A call which returned at once, or which timed out waiting.
+                        self.failed += 1
+                        self.last_failure = "{0}: {1}".format(reply["status"], reply["content"])
+        except socket.error:
+            pass
+        finally:
+            with self._condition:
+                if self._socket is sock:
+                    self._socket = None
+                # Wakes up the calls waiting for a reply which will not come.
+                for id, waiting in self._waiting.items():
+                    if waiting is sock:
+                        self._replies.setdefault(id, None)
+                self._condition.notify_all()
+
+    def post(self, uri, data=None, files=None, headers=None, timeout=None):
+        if files:
+            raise ValueError("SidecarTransport sends multipart bodies, not files.")
+        method = urlparse.urlsplit(uri).path.rsplit("/", 1)[-1]
+        reply = method in REPLY_METHODS
+        headers = dict(headers or {})
+        if isinstance(data, dict):
+            # Framed as the urlencoded body rather than JSON params, any value goes through as with the other
+            # transports.
+            data = _form(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        streamed = hasattr(data, "read")
+        header = {
+            "uri": uri,
+            "headers": headers,
+            "params": None,
+            "body": len(data or ""),
+            "reply": reply,
+        }
+
+        with self._send_lock:
+            if self._socket is None:
+                self._socket = self._connect()
+            sock = self._socket
+            header["id"] = id = next(self._ids)
+            if reply:
+                with self._condition:
+                    self._waiting[id] = sock
+            try:
+                sock.sendall(_frame(json.dumps(header)))
+                if not streamed:
+                    sock.sendall(data or "")
+                else:
+                    while True:
+                        chunk = data.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        sock.sendall(chunk)
+            except socket.error:
+                with self._condition:
+                    self._waiting.pop(id, None)
+                self._socket = None
+                sock.close()
+                raise
+        if not reply:
+            return _Response(200, "")
+
+        timeout = timeout if timeout is not None else self.timeout
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            try:
+                while id not in self._replies:
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise IOError("Racetrack sidecar did not answer {0} within {1} seconds.".format(
+                            method, timeout))
+                    self._condition.wait(remaining)
+                reply = self._replies.pop(id)
+            finally:
+                # A late reply is then dropped, or counted if the call failed.
+                del self._waiting[id]
+                self._replies.pop(id, None)
+        if reply is None:
+            raise IOError("Racetrack sidecar closed the connection before answering {0}.".format(method))
+        return _Response(reply["status"], reply["content"].encode('utf-8'))
+
+    def stats(self):
+        with self._condition:
+            return {"failed": self.failed, "last_failure": self.last_failure}
+
+    def close(self):
+        with self._send_lock:
+            sock, self._socket = self._socket, None
+            if sock is not None:
+                # The reading thread's file holds the socket open, shutdown() ends the connection.
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+                sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class _Body(object):
+    """
+    Request body received by the sidecar, sent again as it is.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.file = tempfile.SpooledTemporaryFile(BODY_IN_MEMORY)
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def rewind(self):
+        self.file.seek(0)
+
+    def close(self):
+        self.file.close()
+
+
+class Sidecar(object):
+    """
+    The daemon: one thread per connected process reads its calls, another one sends them in order, over a transport
+    shared by all the processes and at most 'connections' calls at a time.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET, connections=8, transport=None, drain_timeout=30, journal=None):
+        """
+        :param path: (str) Unix socket listened on.
+         Default: DEFAULT_SOCKET
+
+        :param connections: (int) Maximum number of calls sent to the server at once.
+         Default: 8
+
+        :param transport: Transport the calls are sent with.
+         Default: None, an HTTPTransport pooling 'connections' connections.
+
+        :param drain_timeout: (float) Seconds close() waits for the connected processes to disconnect and for the
+         calls received to be sent.
+         Default: 30
+
+        :param journal: (str) File the calls which failed without the process waiting for them are appended to,
+         see resend().
+         Default: None
+        """
+        self.path = path
+        self.connections = connections
+        self.transport = transport if transport is not None else HTTPTransport(pool_size=connections)
+        self.drain_timeout = drain_timeout
+        self.journal = journal
+        self.clients = 0
+        self.calls = 0
+        self.errors = 0
+        self.journaled = 0
+        self._pending = 0
+        # Receiving and sending threads still running, see close().
+        self._threads = 0
+        self._journal_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(connections)
+        self._condition = threading.Condition()
+        self._listener = None
+        self._closed = False
+
+    def listen(self):
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except socket.error:
+                # Left behind by a sidecar which did not exit cleanly.
+                os.remove(self.path)
+            else:
+                raise IOError("A sidecar is already listening on '{0}'.".format(self.path))
+            finally:
+                probe.close()
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.path)
+        self._listener.listen(128)
+        return self
+
+    def serve_forever(self):
+        if self._closed:
+            return
+        if self._listener is None:
+            self.listen()
+        while True:
+            listener = self._listener
+            if listener is None:
+                return
+            try:
+                conn, _ = listener.accept()
+            except socket.error:
+                if self._listener is None:
+                    return
+                raise
+            self._accept(conn)
+
+    def _accept(self, conn):
+        with self._condition:
+            self.clients += 1
+            self._threads += 2
+        thread = threading.Thread(target=self._receive, args=(conn,), name="RacetrackSidecarReceiver")
+        thread.daemon = True
+        thread.start()
+
+    def _receive(self, conn):
+        calls = Queue.Queue()
+        sender = threading.Thread(target=self._send, args=(conn, calls), name="RacetrackSidecarSender")
+        sender.daemon = True
+        sender.start()
+
+        fh = conn.makefile('rb')
+        try:
+            while True:
+                frame = _read_frame(fh)
+                if frame is None:
+                    break
+                header = json.loads(frame)
+                body = None
+                if header["params"] is None:
+                    body = _Body(header["body"])
+                    remaining = header["body"]
+                    while remaining:
+                        chunk = fh.read(min(CHUNK_SIZE, remaining))
+                        if not chunk:
+                            break
+                        body.file.write(chunk)
+                        remaining -= len(chunk)
+                    if remaining:
+                        # The process died while sending this call.
+                        body.close()
+                        break
+                    body.rewind()
+                with self._condition:
+                    self._pending += 1
+                calls.put((header, body))
+        except (socket.error, ValueError):
+            pass
+        finally:
+            calls.put(None)
+            with self._condition:
+                self.clients -= 1
+                self._threads -= 1
+                self._condition.notify_all()
+
+    def _send(self, conn, calls):
+        try:
+            while True:
+                call = calls.get()
+                if call is None:
+                    break
+                header, body = call
+                try:
+                    with self._slots:
+                        response = self.transport.post(header["uri"],
+                                                       data=body if body is not None else header["params"],
+                                                       headers=header["headers"])
+                    status, content = response.status_code, response.content
+                except Exception as err:
+                    status, content = 502, "Racetrack sidecar could not send the call: {0!r}".format(err)
+                try:
+                    if status != 200 and not header["reply"] and self.journal is not None:
+                        self._journal(header, body)
+                finally:
+                    if body is not None:
+                        body.close()
+
+                with self._condition:
+                    self.calls += 1
+                    self.errors += status != 200
+                    self._pending -= 1
+                    self._condition.notify_all()
+                if header["reply"] or status != 200:
+                    try:
+                        conn.sendall(_frame(json.dumps({"id": header["id"], "status": status,
+                                                        "content": content.decode('utf-8', 'replace')})))
+                    except socket.error:
+                        pass
+        finally:
+            conn.close()
+            with self._condition:
+                self._threads -= 1
+                self._condition.notify_all()
+
+    def _journal(self, header, body):
+        """
+        Appends a call which failed to the journal, as the frame and body the process sent.
+        """
+        if body is None:
+            data = _form(header["params"])
+        else:
+            body.rewind()
+            data = body.read()
+        header = dict(header, params=None, body=len(data), reply=False)
+        try:
+            with self._journal_lock:
+                with open(self.journal, 'ab') as fh:
+                    fh.write(_frame(json.dumps(header)))
+                    fh.write(data)
+            with self._condition:
+                self.journaled += 1
+        except (IOError, OSError):
+            pass
+
+    def stats(self):
+        with self._condition:
+            return {"clients": self.clients, "calls": self.calls, "errors": self.errors, "pending": self._pending,
+                    "journaled": self.journaled}
+
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self):
+        """
+        Stops accepting processes and waits up to drain_timeout seconds for the connected processes to disconnect and
+        for all the calls they sent, including those not read yet, to be sent. Returns False on timeout.
+        """
+        self._closed = True
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            # The processes which connected but were not accepted yet.
+            listener.settimeout(0)
+            while True:
+                try:
+                    conn, _ = listener.accept()
+                except socket.error:
+                    break
+                conn.settimeout(None)
+                self._accept(conn)
+            listener.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        deadline = time.time() + self.drain_timeout
+        with self._condition:
+            while self._threads:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            flushed = not self._threads
+        self.transport.close()
+        return flushed
+
+
+def resend(journal, path=DEFAULT_SOCKET):
+    """
+    Sends the calls of a sidecar journal (see Sidecar(journal=...)) to the sidecar listening on 'path', returns their
+    number. The sidecar journals again those which fail again.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    calls = 0
+    try:
+        with open(journal, 'rb') as fh:
+            while True:
+                frame = _read_frame(fh)
+                if frame is None:
+                    break
+                size = json.loads(frame)["body"]
+                sock.sendall(_frame(frame))
+                while size:
+                    chunk = fh.read(min(CHUNK_SIZE, size))
+                    if not chunk:
+                        raise IOError("Journal '{0}' is truncated.".format(journal))
+                    sock.sendall(chunk)
+                    size -= len(chunk)
+                calls += 1
+    finally:
+        sock.close()
+    return calls
+
+
+def main(argv=None):
+    # Not imported with the module, Racetrack imports it for SidecarTransport.
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m pyRacetrack.sidecar",
+                                     description="Sends the Racetrack calls of the processes of this host.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket (default: {0})".format(DEFAULT_SOCKET))
+    parser.add_argument("--connections", type=int, default=8,
+                        help="Calls sent to the server at once (default: 8)")
+    parser.add_argument("--drain-timeout", type=float, default=30,
+                        help="Seconds waited on exit for the processes and the calls not sent yet (default: 30)")
+    parser.add_argument("--journal", help="File the failed calls no process waited for are appended to")
+    parser.add_argument("--resend", metavar="JOURNAL",
+                        help="Send the calls of a journal to the sidecar listening on --socket, then exit")
+    args = parser.parse_args(argv)
+
+    if args.resend:
+        print "{0} calls sent again".format(resend(args.resend, args.socket))
+        return 0
+
+    sidecar = Sidecar(args.socket, connections=args.connections, drain_timeout=args.drain_timeout,
+                      journal=args.journal).listen()
+    print "Racetrack sidecar listening on {0}".format(args.socket)
+    try:
+        sidecar.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sidecar.close()
+        print sidecar.stats()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""
+Local stand-in for the Racetrack WebServices, for benchmarks and load tests. It answers every endpoint like the real
+server (TestSetBegin/TestCaseBegin/TestSetData return new IDs, the others no content) without storing anything, with
+optional injected latency and errors.
+
+    python -m pyRacetrack.stub [--port 8080] [--latency 0.02] [--jitter 0.01] [--error-rate 0.01]
+"""
+import argparse
+import itertools
+import random
+import sys
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+
+ENDPOINTS = ("TestSetBegin.php", "TestSetUpdate.php", "TestSetEnd.php", "TestSetData.php", "TestCaseBegin.php",
+             "TestCaseUpdate.php", "TestCaseEnd.php", "TestCaseComment.php", "TestCaseWarning.php",
+             "TestCaseVerification.php", "TestCaseScreenshot.php", "TestCaseLog.php")
+
+# Endpoints answering with the ID of what they created.
+ID_ENDPOINTS = ("TestSetBegin.php", "TestCaseBegin.php", "TestSetData.php")
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def _read_body(self):
+        length = self.headers.getheader("Content-Length")
+        if length is not None:
+            remaining = int(length)
+            while remaining:
+                data = self.rfile.read(min(remaining, 64 * 1024))
+                if not data:
+                    break
+                remaining -= len(data)
+            return int(length)
+
+        size = 0
+        while True:
+            chunk = int(self.rfile.readline().split(";")[0].strip() or 0, 16)
+            if not chunk:
+                self.rfile.readline()
+                return size
+            self.rfile.read(chunk)
+            self.rfile.readline()
+            size += chunk
+
+    def do_POST(self):
+        size = self._read_body()
+        endpoint = self.path.split("?")[0].rsplit("/", 1)[-1]
+        status, body = self.server.answer(endpoint, size)
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded stub Racetrack server, use it as a context manager or call start() and stop().
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0, jitter=0, error_rate=0, error_status=500, seed=None):
+        """
+        :param host: (str) Address listened on.
+         Default: "127.0.0.1"
+
+        :param port: (int) Port listened on, 0 picks a free one (see url).
+         Default: 0
+
+        :param latency: (float) Seconds every answer is delayed by.
+         Default: 0
+
+        :param jitter: (float) Up to this many seconds are randomly added to the latency.
+         Default: 0
+
+        :param error_rate: (float) Fraction of the calls answered with 'error_status', 0 to 1.
+         Default: 0
+
+        :param error_status: (int) HTTP status of the injected errors.
+         Default: 500
+
+        :param seed: (int) Seed of the latency/error randomness, for repeatable runs.
+         Default: None
+        """
+        HTTPServer.__init__(self, (host, port), _StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.calls = {}
+        self.errors = {}
+        self.bytes_received = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "http://{0}:{1}/".format(host, port)
+
+    def answer(self, endpoint, size):
+        """
+        Returns (status, body) for one call, after the injected latency.
+        """
+        with self._lock:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+            failed = self.error_rate and self._random.random() < self.error_rate
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            self.bytes_received += size
+            if endpoint not in ENDPOINTS:
+                return 404, "Unknown endpoint {0}".format(endpoint)
+            if failed:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            id = next(self._ids) if endpoint in ID_ENDPOINTS else None
+        if delay:
+            time.sleep(delay)
+        if failed:
+            return self.error_status, "Injected error"
+        return 200, "" if id is None else str(id)
+
+    def stats(self):
+        with self._lock:
+            return {"calls": dict(self.calls), "errors": dict(self.errors), "bytes_received": self.bytes_received}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="RacetrackStub")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pyRacetrack.stub",
+                                     description="Runs a local stand-in for the Racetrack WebServices.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address listened on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="Port listened on (default: 8080)")
+    parser.add_argument("--latency", type=float, default=0, help="Seconds every answer is delayed by (default: 0)")
+    parser.add_argument("--jitter", type=float, default=0, help="Up to this many seconds added to the latency "
+                                                                "(default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of the calls failed (default: 0)")
+    parser.add_argument("--error-status", type=int, default=500, help="Status of the failed calls (default: 500)")
+    args = parser.parse_args(argv)
+
+    server = StubServer(args.host, args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        error_status=args.error_status)
+    print "Racetrack stub listening on {0}".format(server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print server.stats()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+In-memory transport standing in for the Racetrack server in the tests.
+"""
+import itertools
+import threading
+import urllib
+import urlparse
+
+from pyRacetrack._recording import ID_METHODS
+
+
+class Response(object):
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+
+class FakeTransport(object):
+    """
+    Records every call as (method, fields, body) and answers 200, with a new ID for the calls creating something.
+    'fail' maps a method to the status codes answered to its next calls, an exception is raised instead of returned.
+    """
+
+    def __init__(self, fail=None):
+        self.calls = []
+        self.fail = dict(fail or {})
+        self.closed = False
+        self._ids = itertools.count(100)
+        self._lock = threading.Lock()
+
+    def post(self, uri, data=None, files=None, headers=None, timeout=None):
+        method = urlparse.urlsplit(uri).path.rsplit("/", 1)[-1]
+        if hasattr(data, "read"):
+            body = data.read()
+            content_type = (headers or {}).get("Content-Type", "")
+            fields = None
+            if content_type == "application/x-www-form-urlencoded":
+                fields = dict(urlparse.parse_qsl(body))
+        else:
+            fields = dict((name, value) for name, value in (data or {}).iteritems() if value is not None)
+            body = urllib.urlencode(sorted(fields.items()))
+        with self._lock:
+            failures = self.fail.get(method)
+            if failures:
+                status = failures.pop(0)
+                if isinstance(status, Exception):
+                    raise status
+                return Response(status, "failed")
+            self.calls.append((method, fields, body))
+            return Response(200, str(next(self._ids)) if method in ID_METHODS else "")
+
+    def methods(self):
+        return [call[0] for call in self.calls]
+
+    def close(self):
+        self.closed = True
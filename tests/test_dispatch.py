@@ -0,0 +1,99 @@
+import threading
+import unittest
+
+from pyRacetrack._dispatch import Dispatcher, POLICIES
+
+
+class _Sender(object):
+    """
+    Records the values sent; the first call waits for 'gate', so that the following ones queue up.
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.gate = threading.Event()
+        self.started = threading.Event()
+
+    def __call__(self, value):
+        if not self.started.is_set():
+            self.started.set()
+            self.gate.wait(5)
+        self.sent.append(value)
+
+
+class DispatcherOrderTest(unittest.TestCase):
+
+    def dispatcher(self, sender, **kwargs):
+        dispatcher = Dispatcher(sender, workers=1, **kwargs)
+        self.addCleanup(dispatcher.close, 5)
+        dispatcher.submit("gate", "gate")
+        self.assertTrue(sender.started.wait(5))
+        return dispatcher
+
+    def test_lanes_order_keys_not_the_calls_of_a_key(self):
+        sender = _Sender()
+        dispatcher = self.dispatcher(sender)
+        dispatcher.submit("a", "a1")
+        dispatcher.submit("a", "a2", lane="low")
+        dispatcher.submit("b", "b1", lane="low")
+        dispatcher.submit("c", "c1", lane="high")
+        dispatcher.submit("a", "a3", lane="high")
+        sender.gate.set()
+        self.assertTrue(dispatcher.flush(timeout=5))
+        # The keys holding a high call go first, the one with the oldest call first; "a" is sent in order, its high
+        # call included, and "b" only has a low call.
+        self.assertEqual(sender.sent, ["gate", "a1", "a2", "c1", "a3", "b1"])
+
+    def test_flush_of_a_key(self):
+        sender = _Sender()
+        dispatcher = self.dispatcher(sender)
+        dispatcher.submit("a", "a1")
+        self.assertFalse(dispatcher.flush(key="a", timeout=0.05))
+        sender.gate.set()
+        self.assertTrue(dispatcher.flush(key="a", timeout=5))
+        self.assertEqual(dispatcher.depth, 0)
+
+    def test_every_policy_keeps_the_order_of_a_key(self):
+        for policy in POLICIES:
+            sender = _Sender()
+            dispatcher = self.dispatcher(sender, queue_size=2, policy=policy,
+                                         coalesce=lambda queued, args: (queued[0] + args[0],))
+            # Blocked submits need the worker to go on.
+            threading.Timer(0.1, sender.gate.set).start()
+            for number in xrange(20):
+                dispatcher.submit("k", [number], lane="low")
+            self.assertTrue(dispatcher.flush(timeout=5))
+            sent = [number for values in sender.sent[1:] for number in values]
+            self.assertEqual(sent, sorted(sent), policy)
+            if policy == "drop-oldest":
+                self.assertEqual(len(sent) + dispatcher.stats()["low"]["dropped"], 20)
+                self.assertEqual(sent[-1], 19)
+            else:
+                self.assertEqual(sent, range(20), policy)
+
+    def test_drop_oldest_only_drops_the_low_lane(self):
+        sender = _Sender()
+        dispatcher = self.dispatcher(sender, queue_size=1, policy="drop-oldest")
+        dispatcher.submit("a", "normal")
+        dispatcher.submit("a", "low1", lane="low")
+        dispatcher.submit("a", "low2", lane="low")
+        sender.gate.set()
+        self.assertTrue(dispatcher.flush(timeout=5))
+        self.assertEqual(sender.sent, ["gate", "normal", "low2"])
+        self.assertEqual(dispatcher.stats()["low"]["dropped"], 1)
+
+    def test_failed_calls_are_reported(self):
+        errors = []
+
+        def send(value):
+            raise ValueError(value)
+
+        dispatcher = Dispatcher(send, workers=1, on_error=lambda args, err: errors.append((args, err)))
+        dispatcher.submit("a", "x")
+        self.assertTrue(dispatcher.close(timeout=5))
+        self.assertEqual(dispatcher.errors, 1)
+        self.assertEqual(errors[0][0], ("x",))
+
+
+if __name__ == "__main__":
+    unittest.main()
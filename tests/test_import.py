@@ -0,0 +1,99 @@
+import importlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyRacetrack import Racetrack, RESULT
+
+from tests.fakes import FakeTransport
+
+junit = importlib.import_module("pyRacetrack.import")
+
+
+RESULTS = """<?xml version="1.0" encoding="UTF-8"?>
+<testsuites>
+  <testsuite name="outer">
+    <testsuite name="login">
+      <testcase classname="ui.Login" name="ok" time="0.5">
+        <system-out>signed in</system-out>
+      </testcase>
+      <testcase classname="ui.Login" name="wrong_password" time="1.2">
+        <failure type="AssertionError" message="1 != 2">Traceback</failure>
+        <error message="teardown">boom</error>
+        <system-err>stack</system-err>
+      </testcase>
+    </testsuite>
+    <testcase name="plain">
+      <skipped message="not on this OS"/>
+    </testcase>
+  </testsuite>
+  <testsuite name="api">
+    <testcase classname="api.Users" name="failed"><failure message="500"/></testcase>
+  </testsuite>
+</testsuites>
+"""
+
+
+class CasesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="racetrack-test-")
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.path = os.path.join(self.directory, "results.xml")
+        with open(self.path, 'wb') as fh:
+            fh.write(RESULTS)
+
+    def test_cases(self):
+        cases = list(junit.cases(self.path))
+        self.assertEqual([(case.suite, case.classname, case.name) for case in cases], [
+            ("login", "ui.Login", "ok"),
+            ("login", "ui.Login", "wrong_password"),
+            ("outer", None, "plain"),
+            ("api", "api.Users", "failed"),
+        ])
+        self.assertEqual([case.key for case in cases],
+                         ["{0}:{1}".format(os.path.abspath(self.path), index) for index in xrange(4)])
+        ok, wrong, plain, failed = cases
+        self.assertEqual((ok.time, ok.stdout, ok.stderr, ok.events), ("0.5", "signed in", None, []))
+        self.assertEqual(wrong.events, [("failure", "AssertionError", "1 != 2", "Traceback"),
+                                        ("error", None, "teardown", "boom")])
+        self.assertEqual(wrong.stderr, "stack")
+        self.assertEqual([case.result for case in cases],
+                         [RESULT.passs, RESULT.script, RESULT.unsupported, RESULT.fail])
+
+    def import_files(self, transport):
+        progress = junit.Progress(self.path + ".progress")
+        self.addCleanup(progress.close)
+        racetrack = Racetrack(server="racetrack.example.com", port=80, transport=transport)
+        return junit.import_files(racetrack, [self.path], progress, workers=2, buildid=1, product="p",
+                                  description="d", user="u")
+
+    def test_import(self):
+        transport = FakeTransport()
+        self.assertEqual(self.import_files(transport), (4, 0))
+        ends = sorted(fields["Result"] for method, fields, body in transport.calls if method == "TestCaseEnd.php")
+        self.assertEqual(ends, sorted([RESULT.passs, RESULT.script, RESULT.unsupported, RESULT.fail]))
+        logs = [body for method, fields, body in transport.calls if method == "TestCaseLog.php"]
+        self.assertEqual(len(logs), 2)
+        self.assertTrue(any("signed in" in body for body in logs))
+
+        # Carries on in the same test set, with nothing left to import.
+        transport = FakeTransport()
+        self.assertEqual(self.import_files(transport), (0, 0))
+        self.assertEqual(transport.calls, [])
+
+    def test_partial_import_is_ended_and_not_begun_again(self):
+        transport = FakeTransport(fail={"TestCaseLog.php": [400]})
+        self.assertEqual(self.import_files(transport), (3, 1))
+        ends = [fields["Result"] for method, fields, body in transport.calls if method == "TestCaseEnd.php"]
+        self.assertEqual(len(ends), 4)
+        self.assertIn(RESULT.script, ends)
+
+        transport = FakeTransport()
+        self.assertEqual(self.import_files(transport), (0, 0))
+        self.assertEqual(transport.calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
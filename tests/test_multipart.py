@@ -0,0 +1,98 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyRacetrack._multipart import Attachment, BufferAttachment, FileObjectAttachment, MultipartEncoder, \
+    attachment, form_fields
+
+
+class MultipartEncoderTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix="racetrack-test-")
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.path = os.path.join(directory, "run.log")
+        with open(self.path, 'wb') as fh:
+            fh.write("x" * 1000)
+
+    def encoder(self, **kwargs):
+        return MultipartEncoder({"ResultID": 7, "Description": u"caf\xe9", "Skipped": None},
+                                {"Log": Attachment(self.path)}, **kwargs)
+
+    def test_body(self):
+        encoder = self.encoder()
+        boundary = encoder.content_type.split("boundary=")[1]
+        self.assertEqual(encoder.content_type, "multipart/form-data; boundary=" + boundary)
+        expected = (
+            '--{0}\r\nContent-Disposition: form-data; name="Description"\r\n\r\ncaf\xc3\xa9\r\n'
+            '--{0}\r\nContent-Disposition: form-data; name="ResultID"\r\n\r\n7\r\n'
+            '--{0}\r\nContent-Disposition: form-data; name="Log"; filename="run.log"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n{1}\r\n'
+            '--{0}--\r\n').format(boundary, "x" * 1000)
+        self.assertEqual(encoder.read(), expected)
+        self.assertEqual(len(encoder), len(expected))
+        self.assertEqual(encoder.read(), "")
+
+    def test_read_in_chunks_and_rewind(self):
+        encoder = self.encoder(chunk_size=7)
+        chunks = []
+        while True:
+            chunk = encoder.read(10)
+            if not chunk:
+                break
+            self.assertLessEqual(len(chunk), 10)
+            chunks.append(chunk)
+        encoder.rewind()
+        self.assertEqual("".join(chunks), encoder.read())
+        encoder.rewind()
+        self.assertEqual("".join(encoder), "".join(chunks))
+
+    def test_file_name_is_quoted(self):
+        encoder = MultipartEncoder({}, {"Log": BufferAttachment("data", u'a"b\xe9.log')})
+        self.assertIn('filename="a%22b\xc3\xa9.log"', encoder.read())
+
+    def test_attachment_shrinking_while_sent(self):
+        encoder = self.encoder()
+        with open(self.path, 'wb') as fh:
+            fh.write("x" * 10)
+        self.assertRaises(IOError, encoder.read)
+
+
+class AttachmentTest(unittest.TestCase):
+
+    def test_path_or_content(self):
+        self.assertIsInstance(attachment(__file__, "log.txt"), Attachment)
+        self.assertEqual(attachment(__file__, "log.txt").path, __file__)
+        content = attachment("\x89PNG\r\n\x1a\n\0\0", "screenshot")
+        self.assertIsInstance(content, BufferAttachment)
+        self.assertEqual(content.name, "screenshot.png")
+        self.assertEqual(attachment(bytearray("text"), "log.txt").name, "log.txt")
+
+    def test_file_object_from_its_position(self):
+        fh = io.BytesIO("headbody")
+        fh.read(4)
+        content = attachment(fh, "log.txt")
+        self.assertIsInstance(content, FileObjectAttachment)
+        self.assertEqual(content.size, 4)
+        with content.open() as reader:
+            self.assertEqual(reader.read(), "body")
+        self.assertEqual(content.detach().open().read(), "body")
+
+    def test_detach_copies_mutable_content(self):
+        data = bytearray("before")
+        detached = attachment(data, "log.txt").detach()
+        data[:] = "after!"
+        self.assertEqual(detached.open().read(), "before")
+
+    def test_unsupported_value(self):
+        self.assertRaises(TypeError, attachment, 42, "log.txt")
+
+    def test_form_fields(self):
+        self.assertEqual(form_fields({"a": 1, "b": None, "c": "\xff", "d": u"\xe9"}),
+                         {"a": u"1", "b": None, "c": u"\ufffd", "d": u"\xe9"})
+
+
+if __name__ == "__main__":
+    unittest.main()
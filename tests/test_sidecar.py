@@ -0,0 +1,142 @@
+import io
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from pyRacetrack._multipart import BufferAttachment, MultipartEncoder
+from pyRacetrack.sidecar import Sidecar, SidecarTransport, _frame, _read_frame, resend
+
+from tests.fakes import FakeTransport
+
+
+URL = "http://racetrack.example.com/"
+
+
+class _SlowTransport(FakeTransport):
+
+    def post(self, uri, **kwargs):
+        time.sleep(0.3)
+        return super(_SlowTransport, self).post(uri, **kwargs)
+
+
+class FrameTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        fh = io.BytesIO(_frame('{"id": 1}') + _frame(""))
+        self.assertEqual(_read_frame(fh), '{"id": 1}')
+        self.assertEqual(_read_frame(fh), "")
+        self.assertIsNone(_read_frame(fh))
+
+    def test_truncated(self):
+        self.assertIsNone(_read_frame(io.BytesIO(_frame("abcdef")[:-1])))
+        self.assertIsNone(_read_frame(io.BytesIO("\0\0")))
+
+
+class SidecarTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="racetrack-test-")
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.path = os.path.join(self.directory, "sidecar.sock")
+
+    def sidecar(self, transport, **kwargs):
+        sidecar = Sidecar(self.path, connections=2, transport=transport, drain_timeout=5, **kwargs).listen()
+        thread = threading.Thread(target=sidecar.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(sidecar.close)
+        return sidecar
+
+    def client(self, **kwargs):
+        client = SidecarTransport(self.path, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_calls_are_sent_in_order(self):
+        transport = FakeTransport()
+        sidecar = self.sidecar(transport)
+        client = self.client()
+        response = client.post(URL + "TestSetBegin.php", data={"BuildID": 1})
+        self.assertEqual((response.status_code, response.content), (200, "100"))
+        for number in xrange(10):
+            response = client.post(URL + "TestCaseComment.php", data={"ResultID": 100, "Description": number})
+            self.assertEqual(response.status_code, 200)
+        client.close()
+        self.assertTrue(sidecar.close())
+        self.assertEqual(transport.methods(), ["TestSetBegin.php"] + ["TestCaseComment.php"] * 10)
+        self.assertEqual([fields["Description"] for method, fields, body in transport.calls[1:]],
+                         [str(number) for number in xrange(10)])
+        self.assertTrue(transport.closed)
+
+    def test_close_sends_the_calls_not_read_yet(self):
+        transport = FakeTransport()
+        sidecar = self.sidecar(transport)
+        client = self.client()
+        for number in xrange(50):
+            client.post(URL + "TestCaseComment.php", data={"ResultID": 7, "Description": number})
+        client.close()
+        self.assertTrue(sidecar.close())
+        self.assertEqual(len(transport.calls), 50)
+        self.assertEqual(sidecar.stats()["pending"], 0)
+
+    def test_bodies_are_sent_as_they_are(self):
+        transport = FakeTransport()
+        sidecar = self.sidecar(transport)
+        client = self.client()
+        encoder = MultipartEncoder({"ResultID": 7}, {"Log": BufferAttachment("x" * 200000, "run.log")})
+        client.post(URL + "TestCaseLog.php", data=encoder, headers={"Content-Type": encoder.content_type})
+        client.close()
+        self.assertTrue(sidecar.close())
+        encoder.rewind()
+        self.assertEqual(transport.calls[0][2], encoder.read())
+
+    def test_calls_of_a_process_which_died_are_sent(self):
+        transport = FakeTransport()
+        sidecar = self.sidecar(transport)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        header = {"id": 1, "uri": URL + "TestCaseComment.php", "params": None, "reply": False,
+                  "headers": {"Content-Type": "application/x-www-form-urlencoded"}}
+        sock.sendall(_frame(json.dumps(dict(header, body=len("Description=sent")))) + "Description=sent")
+        # Dies while sending the second call.
+        sock.sendall(_frame(json.dumps(dict(header, id=2, body=100))) + "Descr")
+        sock.close()
+        self.assertTrue(sidecar.close())
+        self.assertEqual([fields for method, fields, body in transport.calls], [{"Description": "sent"}])
+
+    def test_failures_are_reported_and_journaled(self):
+        journal = os.path.join(self.directory, "failed")
+        sidecar = self.sidecar(FakeTransport(fail={"TestCaseComment.php": [500]}), journal=journal)
+        client = self.client()
+        response = client.post(URL + "TestCaseComment.php", data={"ResultID": 7, "Description": "lost"})
+        self.assertEqual(response.status_code, 200)
+        # Answered after the failed call, by the same sender.
+        client.post(URL + "TestCaseBegin.php", data={"ResultSetID": 1})
+        self.assertEqual(client.stats()["failed"], 1)
+        self.assertTrue(client.stats()["last_failure"].startswith("500"))
+        client.close()
+        self.assertTrue(sidecar.close())
+        self.assertEqual(sidecar.stats()["journaled"], 1)
+
+        transport = FakeTransport()
+        sidecar = self.sidecar(transport)
+        self.assertEqual(resend(journal, self.path), 1)
+        self.assertTrue(sidecar.close())
+        self.assertEqual(transport.calls[0][:2], ("TestCaseComment.php", {"ResultID": "7", "Description": "lost"}))
+
+    def test_late_replies_are_dropped(self):
+        self.sidecar(_SlowTransport())
+        client = self.client(timeout=0.05)
+        self.assertRaises(IOError, client.post, URL + "TestSetBegin.php", data={"BuildID": 1})
+        time.sleep(0.5)
+        self.assertEqual((client._replies, client._waiting), ({}, {}))
+        self.assertEqual(client.stats()["failed"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
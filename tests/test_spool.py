@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyRacetrack._multipart import BufferAttachment
+from pyRacetrack._spool import Journal, Spool
+from pyRacetrack.replay import replay
+
+from tests.fakes import FakeTransport
+
+
+URL = "http://racetrack.example.com/"
+
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="racetrack-test-")
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.path = os.path.join(self.directory, "journal")
+
+    def spool(self, transport):
+        spool = Spool(self.path, URL, transport, drain_timeout=5, retry_interval=(0.01, 0.01))
+        self.addCleanup(spool.close, 0)
+        return spool
+
+    def journal_test_case(self, spool):
+        test_set = spool.append("TestSetBegin.php", {"BuildID": 1, "Product": "p"}, {})
+        test_case = spool.append("TestCaseBegin.php", {"ResultSetID": test_set, "Name": "n"}, {})
+        spool.append("TestCaseComment.php", {"ResultID": test_case, "Description": "c"}, {})
+        spool.append("TestCaseEnd.php", {"ID": test_case, "Result": "PASS"}, {})
+        return test_set, test_case
+
+    def test_placeholders_are_replaced_by_the_ids(self):
+        transport = FakeTransport()
+        spool = self.spool(transport)
+        test_set, test_case = self.journal_test_case(spool)
+        self.assertEqual((test_set, test_case), ("@1", "@2"))
+        self.assertTrue(spool.flush(timeout=5))
+        self.assertEqual(transport.methods(), ["TestSetBegin.php", "TestCaseBegin.php", "TestCaseComment.php",
+                                               "TestCaseEnd.php"])
+        self.assertEqual(transport.calls[1][1]["ResultSetID"], "100")
+        self.assertEqual(transport.calls[2][1]["ResultID"], "101")
+        self.assertEqual(transport.calls[3][1]["ID"], "101")
+        self.assertEqual(spool.resolve(test_case), "101")
+
+    def test_a_sent_journal_is_not_sent_again(self):
+        spool = self.spool(FakeTransport())
+        self.journal_test_case(spool)
+        self.assertTrue(spool.close(timeout=5))
+
+        transport = FakeTransport()
+        spool = self.spool(transport)
+        self.assertTrue(spool.flush(timeout=5))
+        self.assertEqual(transport.calls, [])
+        self.assertEqual(spool.resolve("@2"), "101")
+        self.assertEqual(replay(self.path, transport=transport), (0, 0, []))
+        self.assertEqual(transport.calls, [])
+
+    def test_replay_sends_what_is_missing_once(self):
+        spool = self.spool(FakeTransport(fail={"TestCaseComment.php": [IOError("down")] * 1000}))
+        self.journal_test_case(spool)
+        self.assertFalse(spool.close(timeout=0.2))
+
+        transport = FakeTransport()
+        self.assertEqual(replay(self.path, transport=transport), (2, 0, []))
+        self.assertEqual(transport.methods(), ["TestCaseComment.php", "TestCaseEnd.php"])
+        # The ID the spool received for the test case before it stopped.
+        self.assertEqual(transport.calls[0][1]["ResultID"], "101")
+
+        self.assertEqual(replay(self.path, transport=transport), (0, 0, []))
+        self.assertEqual(len(transport.calls), 2)
+
+    def test_rejected_calls_are_not_sent_again(self):
+        spool = self.spool(FakeTransport(fail={"TestCaseComment.php": [400]}))
+        self.journal_test_case(spool)
+        self.assertTrue(spool.close(timeout=5))
+        self.assertEqual(spool.rejected, 1)
+        self.assertEqual(replay(self.path, transport=FakeTransport()), (0, 0, []))
+
+    def test_attachments_in_memory_are_journaled(self):
+        transport = FakeTransport()
+        spool = self.spool(transport)
+        spool.append("TestCaseLog.php", {"ResultID": "7", "Description": "log"},
+                     {"Log": BufferAttachment("line\n", "run.log")})
+        self.assertTrue(spool.flush(timeout=5))
+        method, fields, body = transport.calls[0]
+        self.assertIn('filename="run.log"', body)
+        self.assertIn("line\n", body)
+        # Deleted once sent.
+        self.assertEqual(os.listdir(self.path + ".files"), [])
+
+    def test_torn_last_line_is_ignored(self):
+        spool = self.spool(FakeTransport())
+        spool.append("TestCaseComment.php", {"ResultID": "7", "Description": "c"}, {})
+        self.assertTrue(spool.close(timeout=5))
+        with open(self.path, 'ab') as fh:
+            fh.write('[2,"TestCaseComment.php",{"Resu')
+        self.assertEqual([record[2] for record in Journal(self.path).records()], ["TestCaseComment.php"])
+
+
+if __name__ == "__main__":
+    unittest.main()